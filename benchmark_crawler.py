@@ -0,0 +1,697 @@
+"""
+Benchmarks for IPTV Crawler
+===========================
+
+Offline benchmarks for the crawler's hot paths. Everything runs against
+synthetic input: parsing benchmarks use generated pages and playlists, and the
+end-to-end crawl and /proxy-video benchmarks talk to a local stand-in server
+with configurable latency, failures and SSL errors, so no network access or
+running server is needed.
+
+Each benchmark records its best wall time, throughput and peak traced memory.
+Results are written as JSON, and a previous results file can be passed as the
+baseline to compare against.
+
+How to run:
+    python benchmark_crawler.py
+    python benchmark_crawler.py --quick --output bench_results.json
+    python benchmark_crawler.py --baseline bench_results.json --tolerance 0.15
+"""
+
+import argparse
+import contextlib
+import http.server
+import io
+import json
+import os
+import platform
+import random
+import re
+import socketserver
+import ssl
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+from bs4 import BeautifulSoup
+
+from iptv_crawler import (RESPONSE_ENCODINGS, STREAM_CATEGORIES, URL_CATEGORIES, IPTVCrawler, StreamRecord,
+                          columnar_fields, compress_chunks, configure_logging, iter_json, parse_playlist_chunk,
+                          split_playlist, stream_categorizer, unpack_playlist_chunks)
+
+
+def legacy_extract_iptv_urls(content):
+    """The original ten-pattern extract_iptv_urls, kept as the reference to compare against"""
+    iptv_urls = []
+    soup = BeautifulSoup(content, 'html.parser')
+    text_content = soup.get_text()
+    patterns = [
+        r'https?://[^\s<>"]*get\.php\?[^\s<>"]*username=[^\s<>"]*&password=[^\s<>"]*&type=m3u[^\s<>"]*',
+        r'https?://[^\s<>"]*get\.php\?[^\s<>"]*password=[^\s<>"]*&username=[^\s<>"]*&type=m3u[^\s<>"]*',
+        r'https?://[^\s<>"]*get\.php\?[^\s<>"]*type=m3u[^\s<>"]*',
+        r'https?://[^\s<>"]*:8080/get\.php\?[^\s<>"]*',
+        r'https?://[^\s<>"]*:80/get\.php\?[^\s<>"]*',
+        r'https?://[^\s<>"]*get\.php\?[^\s<>"]*',
+        r'https?://[^\s<>"]*:8080/[^\s<>"]*',
+        r'https?://[^\s<>"]*:80/[^\s<>"]*',
+        r'https?://[^\s<>"]*\?[^\s<>"]*username=[^\s<>"]*&password=[^\s<>"]*[^\s<>"]*',
+        r'https?://[^\s<>"]*\?[^\s<>"]*password=[^\s<>"]*&username=[^\s<>"]*[^\s<>"]*',
+    ]
+    for pattern in patterns:
+        iptv_urls.extend(re.findall(pattern, text_content, re.IGNORECASE))
+    for link in soup.find_all('a', href=True):
+        href = link['href']
+        if 'get.php' in href or ('username=' in href and 'password=' in href):
+            if href.startswith('http'):
+                iptv_urls.append(href)
+    for script in soup.find_all('script'):
+        if script.string:
+            for pattern in patterns:
+                iptv_urls.extend(re.findall(pattern, script.string, re.IGNORECASE))
+    unique_urls = []
+    for url in iptv_urls:
+        url = url.strip()
+        url = re.sub(r'[^\w\-\.:/?=&%]+$', '', url)
+        if url not in unique_urls and url.startswith('http'):
+            unique_urls.append(url)
+    return unique_urls
+
+
+def legacy_extract_streams_from_m3u(content, filter_keyword=None):
+    """The original line-window extract_streams_from_m3u, kept as the reference to compare against"""
+    streams = []
+    lines = content.split('\n')
+    current_name = None
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXTINF:'):
+            name_match = re.search(r'tvg-name="([^"]*)"', line)
+            if name_match:
+                current_name = name_match.group(1)
+            else:
+                parts = line.split(',')
+                current_name = parts[-1].strip() if len(parts) > 1 else f"Channel {len(streams) + 1}"
+            continue
+        if line.startswith('http'):
+            if filter_keyword:
+                check_lines = lines[max(0, i-5):i]
+                if not any(filter_keyword.lower() in check_line.lower() for check_line in check_lines):
+                    continue
+            if not current_name:
+                current_name = f"Channel {len(streams) + 1}"
+            streams.append((current_name, line))
+            current_name = None
+    return streams
+
+
+def legacy_categorize_streams(streams, categories=STREAM_CATEGORIES, url_categories=URL_CATEGORIES):
+    """The web frontend's categorizeStreams: one regex per category, tried in turn on each name, then the URL"""
+    name_patterns = [(label, re.compile('|'.join(map(re.escape, words)))) for label, words in categories]
+    url_patterns = [(label, re.compile('|'.join(map(re.escape, words)))) for label, words in url_categories]
+    grouped = {}
+    for stream in streams:
+        name, url = stream.name.lower(), stream.url.lower()
+        category = (next((label for label, pattern in name_patterns if pattern.search(name)), None)
+                    or next((label for label, pattern in url_patterns if pattern.search(url)), None) or 'General')
+        grouped.setdefault(category, []).append(stream)
+    return grouped
+
+
+GROUPS = ['Sports', 'News', 'Movies', 'Kids', 'Music', 'Documentary', 'UK | Entertainment', 'AR | Arabic',
+          'FR | France', 'DE | Germany', 'US | Local', 'Religious', 'Series', 'Adult', 'PPV', 'Radio']
+
+
+def make_m3u_playlist(n_entries, seed=1):
+    """Build an Xtream-style M3U playlist with n_entries channels carrying full EXTINF attributes"""
+    rng = random.Random(seed)
+    lines = ['#EXTM3U']
+    for i in range(n_entries):
+        group = GROUPS[rng.randrange(len(GROUPS))]
+        name = f"{group.split(' | ')[-1].upper()} {rng.choice(['HD', 'FHD', 'SD', '4K'])} Channel {i}"
+        lines.append(f'#EXTINF:-1 tvg-id="ch{i}.example" tvg-name="{name}" '
+                     f'tvg-logo="http://logos.example.net/{i}.png" group-title="{group}",{name}')
+        lines.append(f"http://portal{i % 50}.example.net:8080/live/user{i % 7}/pass{i % 7}/{i}.ts")
+    return '\n'.join(lines) + '\n'
+
+
+def make_xtream_catalog(n_entries, seed=1):
+    """The live categories and streams player_api.php would list for make_m3u_playlist(n_entries, seed)"""
+    rng = random.Random(seed)
+    categories = [{'category_id': str(i + 1), 'category_name': group, 'parent_id': 0} for i, group in enumerate(GROUPS)]
+    streams = []
+    for i in range(n_entries):
+        group = rng.randrange(len(GROUPS))
+        name = f"{GROUPS[group].split(' | ')[-1].upper()} {rng.choice(['HD', 'FHD', 'SD', '4K'])} Channel {i}"
+        streams.append({'num': i + 1, 'name': name, 'stream_type': 'live', 'stream_id': i,
+                        'stream_icon': f"http://logos.example.net/{i}.png", 'epg_channel_id': f"ch{i}.example",
+                        'category_id': str(group + 1)})
+    return categories, streams
+
+
+def make_portal_page(n_urls, seed=1):
+    """
+    Build a forum-style HTML page listing n_urls portal credentials in text,
+    links and scripts, among assets on :80/:8080 (stylesheets, images, CSS),
+    expired portals in comments and &region= parameters that must not be
+    mistaken for entities: everything the legacy extractor did and didn't pick up.
+    """
+    rng = random.Random(seed)
+    parts = ['<html><head><title>Free IPTV portals</title>',
+             '<link rel="stylesheet" href="http://cdn.example.com:8080/forum.css">',
+             '<style>.post { background: url(http://cdn.example.com:80/post.png) }</style>',
+             '</head><body>']
+    script_urls = []
+    for i in range(n_urls):
+        host = f"portal{rng.randint(1, n_urls // 4 + 1)}.example.net"
+        port = rng.choice([':8080', ':80', ':25461', ''])
+        region = '&region=eu' if i % 8 == 3 else ''
+        url = f"http://{host}{port}/get.php?username=user{i}{region}&password=pw{rng.randint(1000, 9999)}&type=m3u_plus"
+        kind = i % 4
+        if kind == 0:
+            parts.append(f"<p>Portal {i}: {url.replace('&', '&amp;')}</p>")
+        elif kind == 1:
+            parts.append(f'<p><a href="{url.replace("&", "&amp;")}">Portal {i}</a></p>')
+        elif kind == 2:
+            parts.append(f"<div class=\"post\">Expires 2025-01-{i % 28 + 1:02d}<br/>\n{url}\n</div>")
+        else:
+            script_urls.append(url)
+        # Filler text, links and assets that must not be picked up
+        parts.append(f'<p>Read more at <a href="https://blog.example.com/post/{i}">post {i}</a> lorem ipsum dolor sit amet.</p>')
+        if i % 10 == 0:
+            parts.append(f'<!-- expired: http://old.example.net:8080/get.php?username=old{i}&amp;password=x&amp;type=m3u -->')
+            parts.append(f'<img src="http://img.example.com:8080/avatar/{i}.png" style="background: url(http://img.example.com:80/{i}.gif)">')
+    parts.append('<script>var portals = [' + ','.join(f'"{u}"' for u in script_urls) + '];</script>')
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+class StandServer:
+    """
+    Local HTTP stand-in for portal sites, serving generated content:
+
+        /page?portals=N&entries=M   forum page listing N get.php portals on this server
+                                    (numbered from &first=K, so pages can list different ones)
+        /forum?threads=T&portals=N  forum index linking to T such pages, an image,
+                                    and the same index on another host
+        /get.php?...&entries=M      M3U playlist with M entries
+        /player_api.php?...         Xtream API listing the channels of a get.php
+                                    playlist of xtream_entries entries (404 unless set)
+        /video?bytes=N              N bytes of video body (honouring a single Range)
+        /hls/master.m3u8            HLS master playlist with one variant, media.m3u8
+        /hls/media.m3u8?segments=N  HLS media playlist of N segments, seg0.ts...
+                                    (missing.ts instead with &missing=1, which 404s)
+
+    Every response waits latency seconds first, and failure_rate of them are
+    answered with a 503. Playlists of the usernames in expired_accounts are
+    refused with a 403, like a lapsed Xtream subscription. ssl_rate of the portals on a page are listed as
+    https://, which this plain-HTTP server can't speak, so fetching them hits
+    an SSL error and the crawler's HTTP fallback. Portals are spread over
+    127.0.0.2-127.0.0.51, so per-host limits behave as they would across
+    real hosts. Given certfile and keyfile (a self-signed pair, say) the
+    server speaks HTTPS instead, with a certificate no client trusts.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, ssl_rate=0.0, seed=1, expired_accounts=(),
+                 certfile=None, keyfile=None, xtream_entries=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.ssl_rate = ssl_rate
+        self.expired_accounts = set(expired_accounts)
+        self.xtream_entries = xtream_entries
+        self.requests = 0
+        self.paths = []  # Path and query of every request, in order
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._playlists = {}
+        stand = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stand.handle(self)
+
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+            request_queue_size = 1024
+
+        self.server = Server(('', 0), Handler)
+        self.port = self.server.server_address[1]
+        self.scheme = 'http'
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+            self.scheme = 'https'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path, host='127.0.0.1'):
+        return f"{self.scheme}://{host}:{self.port}{path}"
+
+    def playlist(self, entries):
+        with self._lock:
+            if entries not in self._playlists:
+                self._playlists[entries] = make_m3u_playlist(entries).encode()
+            return self._playlists[entries]
+
+    def handle(self, handler):
+        with self._lock:
+            self.requests += 1
+            self.paths.append(handler.path)
+            failed = self._rng.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        parts = urllib.parse.urlsplit(handler.path)
+        params = dict(urllib.parse.parse_qsl(parts.query))
+        if failed:
+            return self.send(handler, 503, b'', 'text/plain')
+        if parts.path == '/page':
+            return self.send(handler, 200, self.page(int(params.get('portals', 100)), int(params.get('entries', 1000)),
+                                                     int(params.get('first', 0))), 'text/html')
+        if parts.path == '/forum':
+            return self.send(handler, 200, self.forum(int(params.get('threads', 5)), int(params.get('portals', 10)),
+                                                      int(params.get('entries', 1000))), 'text/html')
+        if parts.path == '/get.php':
+            if params.get('username') in self.expired_accounts:
+                return self.send(handler, 403, b'', 'text/plain')
+            # Each account gets its own stream hosts, so portals don't all deduplicate to one playlist
+            body = self.playlist(int(params.get('entries', 1000)))
+            body = body.replace(b'.example.net:8080/', f".{params.get('username', '')}.example.net:8080/".encode())
+            return self.send(handler, 200, body, 'audio/x-mpegurl')
+        if parts.path == '/player_api.php' and self.xtream_entries is not None:
+            return self.send(handler, 200, self.player_api(params), 'application/json')
+        if parts.path == '/video':
+            return self.send_video(handler, int(params.get('bytes', 1024 * 1024)))
+        if parts.path.startswith('/hls/'):
+            return self.send_hls(handler, parts.path[len('/hls/'):], params)
+        return self.send(handler, 404, b'', 'text/plain')
+
+    def page(self, portals, entries, first=0):
+        rng = random.Random(portals)
+        lines = ['<html><body>']
+        for i in range(first, first + portals):
+            scheme = 'https' if rng.random() < self.ssl_rate else 'http'
+            url = (f"{scheme}://127.0.0.{i % 50 + 2}:{self.port}/get.php?username=user{i}&amp;password=pw{i}"
+                   f"&amp;type=m3u_plus&amp;entries={entries}")
+            lines.append(f"<p>Portal {i}: {url}</p>")
+        lines.append('</body></html>')
+        return '\n'.join(lines).encode()
+
+    def player_api(self, params):
+        if params.get('username') in self.expired_accounts:
+            return json.dumps({'user_info': {'auth': 0}}).encode()
+        categories, streams = make_xtream_catalog(self.xtream_entries)
+        action = params.get('action')
+        if action == 'get_live_categories':
+            body = categories
+        elif action == 'get_live_streams':
+            body = [stream for stream in streams if params.get('category_id') in (None, stream['category_id'])]
+        else:
+            body = {'user_info': {'username': params.get('username'), 'auth': 1, 'status': 'Active'},
+                    'server_info': {'url': '127.0.0.1', 'port': str(self.port)}}
+        return json.dumps(body).encode()
+
+    def forum(self, threads, portals, entries):
+        lines = ['<html><body>', '<a href="/logo.png">Logo</a>']
+        for t in range(threads):
+            lines.append(f'<a href="/page?portals={portals}&amp;entries={entries}&amp;first={t * portals}">IPTV list {t}</a>')
+        lines.append(f'<a href="{self.url("/forum?threads=1", host="127.0.0.2")}">Another forum</a>')
+        lines.append('</body></html>')
+        return '\n'.join(lines).encode()
+
+    @staticmethod
+    def send(handler, status, body, content_type):
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def send_hls(self, handler, name, params):
+        segments = int(params.get('segments', 3))
+        if name == 'master.m3u8':
+            body = f"#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\nmedia.m3u8?segments={segments}\n"
+        elif name == 'media.m3u8':
+            segment = 'missing.ts' if params.get('missing') else 'seg{}.ts'
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+            for i in range(segments):
+                lines += ['#EXTINF:4.0,', segment.format(i)]
+            body = '\n'.join(lines) + '\n'
+        elif re.fullmatch(r'seg\d+\.ts', name):
+            return self.send(handler, 200, bytes(range(256)) * 16, 'video/mp2t')
+        else:
+            return self.send(handler, 404, b'', 'text/plain')
+        return self.send(handler, 200, body.encode(), 'application/vnd.apple.mpegurl')
+
+    @staticmethod
+    def send_video(handler, size):
+        # Byte i of the body is i % 256; a single "bytes=a-b" Range gets a 206 of that slice
+        start, end = 0, size - 1
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', handler.headers.get('Range', ''))
+        if match:
+            start, end = int(match.group(1)), min(int(match.group(2) or end), end)
+            if start > end:
+                handler.send_response(416)
+                handler.send_header('Content-Range', f'bytes */{size}')
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+                return
+        handler.send_response(206 if match else 200)
+        handler.send_header('Content-Type', 'video/mp2t')
+        handler.send_header('Accept-Ranges', 'bytes')
+        handler.send_header('Content-Length', str(end - start + 1))
+        if match:
+            handler.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        handler.end_headers()
+        chunk = bytes(range(256)) * 1024
+        offset = start % 256
+        remaining = end - start + 1
+        try:
+            while remaining > 0:
+                piece = chunk[offset:offset + remaining]
+                handler.wfile.write(piece)
+                remaining -= len(piece)
+                offset = 0
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def time_call(func, *args, repeat=3):
+    """Best-of-N wall time for func(*args), with its stdout silenced"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def peak_memory(func, *args):
+    """Peak memory traced by tracemalloc while running func(*args) once, with its stdout silenced"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        try:
+            func(*args)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+
+def record(results, name, seconds, count, unit, peak_bytes=None):
+    """Store one measurement as JSON-ready numbers and return it"""
+    results[name] = {
+        'seconds': round(seconds, 6),
+        'count': count,
+        'unit': unit,
+        'per_second': round(count / seconds, 1) if seconds else None,
+        'peak_mb': round(peak_bytes / (1024 * 1024), 2) if peak_bytes is not None else None,
+    }
+    return results[name]
+
+
+def describe(result):
+    peak = f" | peak {result['peak_mb']:8.1f} MB" if result['peak_mb'] is not None else ''
+    return f"{result['seconds'] * 1000:9.1f} ms | {result['per_second']:12,.0f} {result['unit']}/s{peak}"
+
+
+def benchmark_extract_iptv_urls(results, sizes=(100, 1000, 5000)):
+    """Compare extract_iptv_urls against the legacy implementation"""
+    crawler = IPTVCrawler()
+    print("🔍 extract_iptv_urls")
+    for n in sizes:
+        page = make_portal_page(n)
+        legacy_time, legacy_urls = time_call(legacy_extract_iptv_urls, page, repeat=1 if n > 1000 else 3)
+        new_time, new_urls = time_call(crawler.extract_iptv_urls, page)
+        bytes_time, bytes_urls = time_call(crawler.extract_iptv_urls, page.encode())
+        assert set(new_urls) == set(legacy_urls) == set(bytes_urls), f"result sets differ for n={n}"
+        print(f"  {n:>6} URLs, {len(page) / 1024:8.0f} KB: legacy {legacy_time * 1000:9.1f} ms | "
+              f"new {new_time * 1000:7.1f} ms (str) {bytes_time * 1000:7.1f} ms (bytes) | "
+              f"speedup {legacy_time / new_time:6.1f}x")
+        record(results, f"extract_iptv_urls/{n}", new_time, len(page) / (1024 * 1024), 'MB',
+               peak_memory(crawler.extract_iptv_urls, page))
+
+
+def benchmark_extract_streams_from_m3u(results, sizes=(1000, 10000, 100000, 1000000),
+                                       keywords=('sports', 'channel 4242', 'hd'), legacy_up_to=100000):
+    """
+    Compare full and filtered playlist parsing against the legacy implementation
+    (skipped above legacy_up_to). Records leave name and group unparsed until
+    read, so "all + to_dict" also times reading every record back.
+    """
+    crawler = IPTVCrawler()
+    print("📺 extract_streams_from_m3u")
+    for n in sizes:
+        playlist = make_m3u_playlist(n)
+        repeat = 1 if n > 100000 else 3
+        legacy = n <= legacy_up_to
+        new_time, new_streams = time_call(crawler.extract_streams_from_m3u, playlist, repeat=repeat)
+        result = record(results, f"extract_streams_from_m3u/{n}/all", new_time, n, 'entries',
+                        peak_memory(crawler.extract_streams_from_m3u, playlist))
+        if legacy:
+            legacy_time, legacy_streams = time_call(legacy_extract_streams_from_m3u, playlist, repeat=repeat)
+            assert [tuple(s) for s in new_streams] == legacy_streams, f"parsed streams differ for n={n}"
+            print(f"  {n:>7} entries, all: legacy {legacy_time * 1000:8.1f} ms | new {describe(result)}")
+            new_time, _ = time_call(lambda: [stream.to_dict() for stream in crawler.extract_streams_from_m3u(playlist)],
+                                    repeat=repeat)
+            legacy_time, _ = time_call(lambda: [{'name': name, 'url': url}
+                                                for name, url in legacy_extract_streams_from_m3u(playlist)], repeat=repeat)
+            record(results, f"extract_streams_from_m3u/{n}/all+to_dict", new_time, n, 'entries')
+            print(f"  {n:>7} entries, all + to_dict: legacy {legacy_time * 1000:8.1f} ms | new {new_time * 1000:8.1f} ms")
+        else:
+            print(f"  {n:>7} entries, all: new {describe(result)}")
+        
+        for keyword in keywords:
+            new_time, new_streams = time_call(crawler.extract_streams_from_m3u, playlist, keyword, repeat=repeat)
+            result = record(results, f"extract_streams_from_m3u/{n}/{keyword}", new_time, n, 'entries')
+            if legacy:
+                legacy_time, legacy_streams = time_call(legacy_extract_streams_from_m3u, playlist, keyword, repeat=repeat)
+                print(f"  {n:>7} entries, '{keyword}': legacy {legacy_time * 1000:8.1f} ms | new {new_time * 1000:8.1f} ms | "
+                      f"speedup {legacy_time / new_time:6.1f}x ({len(new_streams)} matches)")
+            else:
+                print(f"  {n:>7} entries, '{keyword}': new {describe(result)} ({len(new_streams)} matches)")
+
+
+def benchmark_deduplicate_streams(results, sizes=(10000, 100000, 1000000)):
+    """deduplicate_streams over records where half are credential variants of the other half"""
+    crawler = IPTVCrawler()
+    print("🚫 deduplicate_streams")
+    for n in sizes:
+        half = n // 2
+        streams = [StreamRecord(f"Channel {i % half}", f"http://portal{i % 50}.example.net:8080/live/"
+                                f"user{i // half}/pass{i // half}/{i % half}.ts") for i in range(n)]
+        seconds, unique = time_call(crawler.deduplicate_streams, streams, repeat=1 if n > 100000 else 3)
+        assert len(unique) == half, f"expected {half} unique streams, got {len(unique)}"
+        result = record(results, f"deduplicate_streams/{n}", seconds, n, 'streams',
+                        peak_memory(crawler.deduplicate_streams, streams))
+        print(f"  {n:>7} streams: {describe(result)}")
+
+
+def benchmark_categorize_streams(results, sizes=(10000, 100000)):
+    """Categorizing a parsed playlist: the combined matcher against the frontend's per-category regexes"""
+    crawler = IPTVCrawler(cache=False)
+    print("🏷️ categorize streams")
+    for n in sizes:
+        streams = crawler.extract_streams_from_m3u(make_m3u_playlist(n))
+        legacy_time, _ = time_call(legacy_categorize_streams, streams)
+        seconds, index = time_call(stream_categorizer.index, streams)
+        assert sum(map(len, index.values())) == n, f"categorized {sum(map(len, index.values()))} of {n} streams"
+        result = record(results, f"categorize_streams/{n}", seconds, n, 'streams')
+        print(f"  {n:>7} streams: legacy {legacy_time * 1000:8.1f} ms | new {describe(result)} | "
+              f"speedup {legacy_time / seconds:6.1f}x ({len(index)} categories)")
+
+
+def benchmark_crawl_serialization(results, n=100000):
+    """Size and time of a /crawl body: row and columnar formats, uncompressed and with each encoding"""
+    streams = IPTVCrawler(cache=False).extract_streams_from_m3u(make_m3u_playlist(n))
+    formats = {
+        'json': lambda: [('streams', (stream.to_dict() for stream in streams))],
+        'columnar': lambda: columnar_fields(streams),
+    }
+    print(f"📦 /crawl serialization ({n} streams)")
+    for name, fields in formats.items():
+        for encoding in (None,) + RESPONSE_ENCODINGS:
+            seconds, size = time_call(lambda: sum(map(len, compress_chunks(iter_json(fields()), encoding))))
+            result = record(results, f"crawl_serialization/{n}/{name}/{encoding or 'identity'}", seconds, n, 'streams')
+            result['bytes'] = size
+            print(f"  {name:>8} {encoding or 'identity':>8}: {describe(result)} | {size / (1024 * 1024):7.2f} MB")
+
+
+def benchmark_parse_workers(results, n=300000, workers=(0, 1, 2, 4), repeat=3):
+    """
+    Parse one large playlist in-thread and with parse process pools of different sizes.
+
+    Wall time only improves with more workers when there are idle cores for
+    them, so the calling thread's CPU time is recorded too. The "serial"
+    line times the part no number of workers takes off the caller: turning
+    the workers' finished results into records. In-thread time divided by it
+    bounds the speedup on a machine with cores to spare.
+    """
+    playlist = make_m3u_playlist(n)
+    print(f"🧵 parse_playlist ({n} entries, {os.cpu_count()} CPUs)")
+    for count in workers:
+        crawler = IPTVCrawler(cache=False, parse_workers=count, parse_offload_bytes=0,
+                              parse_chunk_bytes=max(1, len(playlist) // max(1, count * 2)))
+        if count:
+            # Start the workers outside the timing
+            crawler.parse_playlist(playlist[:crawler.parse_chunk_bytes])
+        cpu_start = time.thread_time()
+        seconds, streams = time_call(crawler.parse_playlist, playlist, repeat=repeat)
+        caller_cpu = (time.thread_time() - cpu_start) / repeat
+        assert len(streams) == n, f"parse_workers={count} parsed {len(streams)} of {n} entries"
+        result = record(results, f"parse_playlist/{n}/workers={count}", seconds, n, 'entries')
+        result['caller_cpu_seconds'] = round(caller_cpu, 6)
+        print(f"  {count} workers: {describe(result)} | caller CPU {caller_cpu * 1000:8.1f} ms")
+        crawler.close()
+
+    batches = [parse_playlist_chunk(chunk) for chunk in split_playlist(playlist, len(playlist) // 8)]
+    seconds, streams = time_call(unpack_playlist_chunks, batches, repeat=repeat)
+    assert len(streams) == n
+    result = record(results, f"parse_playlist/{n}/serial", seconds, n, 'entries')
+    print(f"  serial: {describe(result)}")
+
+
+def crawl_once(url):
+    """One end-to-end crawl with a fresh, cache-less crawler, so repeats measure the network path"""
+    return IPTVCrawler(cache=False).crawl_iptv_streams(url)
+
+
+def benchmark_crawl_iptv_streams(results, portals=200, entries=1000, latency=0.02, failure_rate=0.05, ssl_rate=0.1):
+    """End-to-end crawl of a stand-in page listing `portals` portals, through latency, failures and SSL errors"""
+    print("🌐 crawl_iptv_streams")
+    with StandServer(latency=latency, failure_rate=failure_rate, ssl_rate=ssl_rate) as stand:
+        url = stand.url(f"/page?portals={portals}&entries={entries}")
+        seconds, streams = time_call(crawl_once, url, repeat=1)
+        requests_made = stand.requests
+        result = record(results, f"crawl_iptv_streams/{portals}x{entries}", seconds, len(streams), 'streams',
+                        peak_memory(crawl_once, url))
+    print(f"  {portals} portals x {entries} entries, {latency * 1000:.0f} ms latency, {failure_rate:.0%} failures, "
+          f"{ssl_rate:.0%} SSL errors: {describe(result)} ({len(streams)} streams, {requests_made} requests, "
+          f"{portals / seconds:.1f} portals/s)")
+
+
+def proxy_once(client, path):
+    """Read a /proxy-video response to the end through the Flask test client; returns the bytes relayed"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = client.get(path, buffered=False)
+        try:
+            assert response.status_code == 200, f"/proxy-video returned {response.status_code}"
+            return sum(len(chunk) for chunk in response.response)
+        finally:
+            response.close()
+
+
+def benchmark_proxy_video(results, sizes=(16 * 1024 * 1024, 256 * 1024 * 1024)):
+    """/proxy-video relaying a stand-in video body, in-process through the Flask test client"""
+    from iptv_crawler import app
+
+    print("🎬 /proxy-video")
+    client = app.test_client()
+    with StandServer() as stand:
+        for size in sizes:
+            path = '/proxy-video?url=' + urllib.parse.quote(stand.url(f"/video?bytes={size}"), safe='')
+            seconds, relayed = time_call(proxy_once, client, path, repeat=1 if size > 64 * 1024 * 1024 else 3)
+            assert relayed == size, f"relayed {relayed} of {size} bytes"
+            megabytes = size / (1024 * 1024)
+            result = record(results, f"proxy_video/{megabytes:.0f}MB", seconds, megabytes, 'MB',
+                            peak_memory(proxy_once, client, path))
+            print(f"  {megabytes:6.0f} MB: {describe(result)}")
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Print how each result's time moved against the baseline; returns the names that got slower than tolerance"""
+    print("📊 Compared to baseline")
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before or not before.get('seconds'):
+            print(f"  {name:<45} new")
+            continue
+        ratio = result['seconds'] / before['seconds']
+        memory = ''
+        if result['peak_mb'] is not None and before.get('peak_mb'):
+            memory = f" | peak {before['peak_mb']:.1f} -> {result['peak_mb']:.1f} MB"
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = '  ⚠️ slower'
+        print(f"  {name:<45} {before['seconds'] * 1000:9.1f} -> {result['seconds'] * 1000:9.1f} ms "
+              f"({ratio:5.2f}x){memory}{flag}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the IPTV crawler')
+    parser.add_argument('--quick', action='store_true', help='Smaller inputs, for a fast sanity run')
+    parser.add_argument('--output', default='bench_results.json', help='Where to write the JSON results (default: bench_results.json)')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Slowdown against the baseline that counts as a regression (default: 0.1 = 10%%)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {}
+    # Injected failures and SSL errors would otherwise log a warning apiece
+    configure_logging('ERROR')
+
+    print("🚀 IPTV Crawler Benchmarks")
+    print("=" * 50)
+    if args.quick:
+        benchmark_extract_iptv_urls(results, sizes=(100, 1000))
+        benchmark_extract_streams_from_m3u(results, sizes=(1000, 10000))
+        benchmark_deduplicate_streams(results, sizes=(10000, 100000))
+        benchmark_categorize_streams(results, sizes=(10000,))
+        benchmark_crawl_serialization(results, n=10000)
+        benchmark_parse_workers(results, n=50000, workers=(0, 2))
+        benchmark_crawl_iptv_streams(results, portals=50, entries=1000)
+        benchmark_proxy_video(results, sizes=(16 * 1024 * 1024,))
+    else:
+        benchmark_extract_iptv_urls(results)
+        benchmark_extract_streams_from_m3u(results)
+        benchmark_deduplicate_streams(results)
+        benchmark_categorize_streams(results)
+        benchmark_crawl_serialization(results)
+        benchmark_parse_workers(results)
+        benchmark_crawl_iptv_streams(results)
+        benchmark_proxy_video(results)
+
+    with open(args.output, 'w', encoding='utf-8') as handle:
+        json.dump({
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'quick': args.quick,
+            'results': results,
+        }, handle, indent=2)
+    print(f"💾 Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as handle:
+            baseline = json.load(handle)['results']
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"⚠️ {len(regressions)} benchmarks slower than the baseline by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
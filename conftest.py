@@ -0,0 +1,9 @@
+import pytest
+
+import iptv_crawler
+
+
+@pytest.fixture(autouse=True, scope='session')
+def catalog_in_tmp(tmp_path_factory):
+    # Crawls through the app write to the module's catalog; keep it out of the working directory
+    iptv_crawler.catalog.path = str(tmp_path_factory.mktemp('catalog') / 'iptv_catalog.db')
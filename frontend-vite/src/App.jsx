@@ -24,7 +24,7 @@ import {
   setScanMode
 } from './store/slices/validationSlice'
 import { openPlayer, closePlayer } from './store/slices/playerSlice'
-import { categorizeStreams, downloadM3U, filterStreamsByStatus } from './utils/categorization'
+import { categorizeStreams, groupStreamsByIndex, downloadM3U, filterStreamsByStatus } from './utils/categorization'
 import Header from './components/Header'
 import CrawlerForm from './components/CrawlerForm'
 import ResultsContainer from './components/ResultsContainer'
@@ -92,8 +92,10 @@ function App() {
     try {
       const result = await dispatch(crawlStreams({ url, filter })).unwrap()
       
-      // Categorize streams
-      const categorized = categorizeStreams(result.streams)
+      // Group streams by the categories the server assigned
+      const categorized = result.category_index
+        ? groupStreamsByIndex(result.streams, result.category_index)
+        : categorizeStreams(result.streams)
       dispatch(setCategorizedStreams(categorized))
       
       dispatch(addNotification({ 
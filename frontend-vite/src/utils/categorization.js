@@ -1,4 +1,14 @@
+// Group streams by the category index the /crawl response carries (category -> positions in streams)
+export const groupStreamsByIndex = (streams, categoryIndex) => {
+  const categories = {}
+  for (const [category, positions] of Object.entries(categoryIndex)) {
+    categories[category] = positions.map(position => streams[position])
+  }
+  return categories
+}
+
 // Smart categorization function that analyzes stream names and groups them intelligently
+// (fallback for responses without a category index; the API categorizes results itself)
 export const categorizeStreams = (streams) => {
   const categories = {}
   
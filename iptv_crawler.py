@@ -17,12 +17,46 @@ The API will be available at http://localhost:5000
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import requests
+import argparse
+import asyncio
+import bisect
+import collections
+import contextlib
+import functools
+import hashlib
+import heapq
+import json
+import logging
+import os
+import itertools
+import math
+import multiprocessing
 import re
+import signal
 import time
+import socket
+import sqlite3
+import threading
+import http.cookiejar
 import urllib.parse
-from bs4 import BeautifulSoup
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import uuid
+import zlib
+import lxml.etree
+import lxml.html
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 import urllib3
+import urllib3.connection
+import urllib3.connectionpool
+from requests.adapters import HTTPAdapter
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator, wrap_file
+
+try:
+    import brotli  # Optional: /crawl responses are offered brotli-compressed when it's installed
+except ImportError:
+    brotli = None
 
 # Suppress SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -30,386 +64,3679 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 app = Flask(__name__)
 CORS(app)
 
-class IPTVCrawler:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-        })
+log = logging.getLogger('iptv_crawler')
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms kept in memory and rendered in the
+    Prometheus text format for /metrics.
+
+    Every metric is declared up front with its kind, help text and label
+    names. Each metric holds at most max_series label combinations; past that,
+    new combinations are folded into one series whose labels all read
+    "other", so a crawl over thousands of hosts can't grow it without bound.
+    """
+
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, max_series=1000):
+        self.max_series = max_series
+        self._metrics = {}  # name -> (kind, help, label names, buckets)
+        self._series = {}  # name -> {label values: value, or [bucket counts..., sum, count] for histograms}
+        self._lock = threading.Lock()
+
+    def declare(self, name, kind, help_text, labels=(), buckets=None):
+        self._metrics[name] = (kind, help_text, tuple(labels), tuple(buckets or self.DEFAULT_BUCKETS))
+        # Unlabelled counters and gauges read 0 until first touched
+        self._series[name] = {} if labels or kind == 'histogram' else {(): 0}
+
+    def _key(self, name, labels):
+        key = tuple(str(labels.get(label, '')) for label in self._metrics[name][2])
+        series = self._series[name]
+        if key not in series and len(series) >= self.max_series:
+            key = ('other',) * len(key)
+        return series, key
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter, or to a gauge (negative values included)"""
+        with self._lock:
+            series, key = self._key(name, labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            series, key = self._key(name, labels)
+            series[key] = value
+
+    def observe(self, name, value, **labels):
+        buckets = self._metrics[name][3]
+        with self._lock:
+            series, key = self._key(name, labels)
+            counts = series.get(key)
+            if counts is None:
+                counts = series[key] = [0] * (len(buckets) + 3)  # buckets, +Inf, sum, count
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observe the wall time of the with block (exceptions included)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def value(self, name, **labels):
+        """Current value of a counter or gauge series (0 if it was never touched)"""
+        with self._lock:
+            return self._series[name].get(tuple(str(labels.get(label, '')) for label in self._metrics[name][2]), 0)
+
+    @staticmethod
+    def _labels(names, values, extra=''):
+        pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(pairs) + '}'
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            snapshot = {name: {key: (list(value) if isinstance(value, list) else value)
+                               for key, value in series.items()} for name, series in self._series.items()}
+        for name, (kind, help_text, label_names, buckets) in self._metrics.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(snapshot[name].items()):
+                values = [v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in key]
+                if kind != 'histogram':
+                    lines.append(f'{name}{self._labels(label_names, values)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value):
+                    cumulative += count
+                    le = 'le="%s"' % bound
+                    lines.append(f'{name}_bucket{self._labels(label_names, values, le)} {cumulative}')
+                lines.append(f'{name}_sum{self._labels(label_names, values)} {value[-2]:.6f}')
+                lines.append(f'{name}_count{self._labels(label_names, values)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.declare('iptv_stage_seconds', 'histogram', 'Time spent in each crawl pipeline stage', ['stage'])
+metrics.declare('iptv_host_requests_total', 'counter',
+                'Upstream requests by host and outcome (ok, error, refused with a 4xx, or skipped by an open circuit)', ['host', 'outcome'])
+metrics.declare('iptv_inflight_fetches', 'gauge', 'Upstream requests waiting for response headers')
+metrics.declare('iptv_fetched_bytes_total', 'counter', 'Page and playlist body bytes downloaded')
+metrics.declare('iptv_proxied_bytes_total', 'counter', 'Body bytes sent to clients by /proxy-video')
+metrics.declare('iptv_crawls_total', 'counter', 'Crawl requests by where the result came from', ['source'])
+metrics.declare('iptv_log_suppressed_total', 'counter', 'Log records dropped by the rate limiter', ['level'])
+metrics.declare('iptv_admission_active', 'gauge', 'Requests holding a slot in each admission budget', ['budget'])
+metrics.declare('iptv_admission_waiting', 'gauge', 'Requests queued for a slot in each admission budget', ['budget'])
+metrics.declare('iptv_admission_rejected_total', 'counter', 'Requests turned away by each admission budget', ['budget'])
+
+
+def timed(stage):
+    """Decorator recording each call of the function under the given pipeline stage"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics.timer('iptv_stage_seconds', stage=stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class LogRateLimiter(logging.Filter):
+    """
+    Lets through at most `burst` records per message template and level in
+    each `interval` seconds. The first record let through after some were
+    dropped carries their number as suppressed=N.
+    """
+
+    def __init__(self, burst=20, interval=10.0, max_keys=10000):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_keys = max_keys
+        self._windows = {}  # (logger, level, template) -> [window start, records let through, records dropped]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is None and len(self._windows) >= self.max_keys:
+                    self._windows.clear()
+                dropped = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+            else:
+                dropped = 0
+            if window[1] >= self.burst:
+                window[2] += 1
+                metrics.inc('iptv_log_suppressed_total', level=record.levelname)
+                return False
+            window[1] += 1
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+
+# Attributes every LogRecord has; anything else on a record came from extra= and is logged as a field
+STANDARD_LOG_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    One line per record: time, level, message and then the extra= fields as
+    key=value pairs, or (json_lines) the same as one JSON object per line.
+    """
+
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = {key: value for key, value in vars(record).items() if key not in STANDARD_LOG_ATTRS}
+        if record.exc_info:
+            fields['exc'] = self.formatException(record.exc_info)
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}'
+        if self.json_lines:
+            return json.dumps({'ts': timestamp, 'level': record.levelname.lower(), 'logger': record.name,
+                               'msg': record.getMessage(), **fields}, default=str)
+        pairs = ''.join(f' {key}={json.dumps(value, default=str) if isinstance(value, str) and (" " in value or not value) else value}'
+                        for key, value in fields.items())
+        return f'{timestamp} {record.levelname:<7} {record.getMessage()}{pairs}'
+
+
+def configure_logging(level=None, json_lines=None, burst=20, interval=10.0):
+    """
+    Send the crawler's log to stderr through the rate limiter and structured formatter.
+
+    level and json_lines default to the IPTV_LOG_LEVEL (INFO) and
+    IPTV_LOG_FORMAT (text or json) environment variables.
+    """
+    level = level or os.environ.get('IPTV_LOG_LEVEL', 'INFO')
+    if json_lines is None:
+        json_lines = os.environ.get('IPTV_LOG_FORMAT', 'text').lower() == 'json'
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(json_lines))
+    handler.addFilter(LogRateLimiter(burst, interval))
+    for existing in list(log.handlers):
+        log.removeHandler(existing)
+    log.addHandler(handler)
+    log.setLevel(level.upper() if isinstance(level, str) else level)
+    log.propagate = False
+    return handler
+
+# A URL token (up to whitespace, <, > or ") that looks like an IPTV portal: a
+# get.php call, a :8080/ or :80/ port, or a username/password query string.
+# Folds together what used to be ten separate patterns.
+_IPTV_URL_PATTERN = (
+    r'https?://'
+    r'(?=[^\s<>"]*(?:get\.php\?|:80(?:80)?/'
+    r'|\?[^\s<>"]*(?:username=[^\s<>"]*&password=|password=[^\s<>"]*&username=)))'
+    r'[^\s<>"]*'
+)
+IPTV_URL_RE = re.compile(_IPTV_URL_PATTERN, re.IGNORECASE)
+IPTV_URL_BYTES_RE = re.compile(_IPTV_URL_PATTERN.encode(), re.IGNORECASE)
+TRAILING_URL_JUNK_RE = re.compile(r'[^\w\-\.:/?=&%]+$')
+
+# Everything of a page that isn't visible text: comments, tags (with their
+# attributes, so <link href>, <img src> and style="" URLs are never scanned),
+# and whole <script>, <style> and <template> elements. Script bodies are
+# scanned separately, as they are, by _SCRIPT_PATTERN.
+_MARKUP_PATTERN = (
+    r'<(?:!--.*?--|script\b[^>]*>.*?</script\s*|style\b[^>]*>.*?</style\s*|template\b[^>]*>.*?</template\s*'
+    r'|[^>]*)>'
+)
+_SCRIPT_PATTERN = r'<script\b[^>]*>(.*?)</script\s*>'
+MARKUP_RE = re.compile(_MARKUP_PATTERN, re.IGNORECASE | re.DOTALL)
+MARKUP_BYTES_RE = re.compile(_MARKUP_PATTERN.encode(), re.IGNORECASE | re.DOTALL)
+SCRIPT_RE = re.compile(_SCRIPT_PATTERN, re.IGNORECASE | re.DOTALL)
+SCRIPT_BYTES_RE = re.compile(_SCRIPT_PATTERN.encode(), re.IGNORECASE | re.DOTALL)
+
+# Site crawl: words in a link's URL or text that suggest it leads to more portal
+# credentials, signs of a "next page" link, and files that are never HTML pages
+LINK_HINT_RE = re.compile(r'iptv|m3u|xtream|portal|playlist|server|login|username|smarters|stbemu|mac', re.IGNORECASE)
+PAGINATION_RE = re.compile(r'(?:[?&/](?:page|p|part)[=/-]?\d+|/\d+/?$|\bnext\b|\bolder\b|»|›)', re.IGNORECASE)
+NON_PAGE_LINK_RE = re.compile(
+    r'\.(?:jpe?g|png|gif|webp|svg|ico|css|js|pdf|zip|rar|7z|apk|exe|mp4|mkv|ts|m3u8?|mp3|xml|json)(?:[?#]|$)'
+    r'|^(?:mailto|javascript|tel):|/(?:wp-login|wp-admin|feed|tag|author)/?|[?&]replytocom=',
+    re.IGNORECASE)
+
+# Request headers tried in turn when a site or portal blocks the first set
+PAGE_HEADER_STRATEGIES = [
+    {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+    },
+    {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+        'Accept': '*/*',
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive'
+    },
+    {
+        'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+    }
+]
+
+PLAYLIST_HEADER_STRATEGIES = [
+    {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': '*/*',
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive'
+    },
+    {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+        'Accept': '*/*',
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive'
+    },
+    {
+        'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+        'Accept': '*/*',
+    }
+]
+
+EXTINF_ATTR_RE = re.compile(r'([\w-]+)="([^"]*)"')
+
+# A filtered parse that finds the keyword in more than 1/DENSE_FILTER_SHARE of
+# the playlist's entries (checked every DENSE_FILTER_CHECK of them) walks the
+# rest of it line by line instead of jumping from hit to hit
+DENSE_FILTER_SHARE = 4
+DENSE_FILTER_CHECK = 512
+
+
+def parse_extinf(line):
+    """Split an #EXTINF line into a dict of its key="value" attributes and its title"""
+    attrs = dict(EXTINF_ATTR_RE.findall(line)) if '="' in line else {}
+    # The title follows the first comma after the attributes
+    comma = line.find(',', line.rfind('"') + 1 if attrs else 8)
+    title = line[comma + 1:].strip() if comma != -1 else ''
+    return attrs, title
+
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Xtream Codes stream paths: /live/<user>/<pass>/<id>.ts, /movie/... and /series/....
+# The bare /<user>/<pass>/<id> form is left out: on its own it can't be told
+# apart from ordinary paths such as /news/hd/1.m3u8
+XTREAM_PATH_RE = re.compile(r'^/(live|movie|series)/[^/]+/[^/]+/(\d+)(?:\.\w+)?$')
+
+
+# http(s) URLs with a plain host[:port], which _canonical_parts splits without urlsplit
+SIMPLE_URL_RE = re.compile(r'(https?)://([a-z0-9.\-]+)(?::(\d{1,5}))?(/[^?#]*)?(?:\?([^#]*))?(?:#.*)?\Z', re.IGNORECASE)
+
+
+def _canonical_parts(url):
+    """(scheme, netloc, path, query) with the host lowercased, the default port dropped and the query sorted"""
+    url = url.strip()
+    match = SIMPLE_URL_RE.match(url)
+    if match:
+        # Nearly every stream URL: skip urlsplit, which dominates deduplicating large playlists
+        scheme, netloc, port, path, query = match.groups()
+        scheme = scheme.lower()
+        netloc = netloc.lower()
+        if port and DEFAULT_PORTS.get(scheme) != int(port):
+            netloc = f'{netloc}:{int(port)}'
+        path = path or '/'
+    else:
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        host = parts.hostname or ''
+        netloc = f'[{host}]' if ':' in host else host
+        port = parts.port
+        if port and DEFAULT_PORTS.get(scheme) != port:
+            netloc = f'{netloc}:{port}'
+        if '@' in parts.netloc:
+            netloc = parts.netloc.rpartition('@')[0] + '@' + netloc
+        path, query = parts.path or '/', parts.query
+    query = query or ''
+    if '&' in query:
+        query = '&'.join(sorted(query.split('&')))
+    return scheme, netloc, path, query
+
+
+def canonical_url(url):
+    """
+    Canonical form of a URL for comparing and caching: lowercase scheme and
+    host, no default port, query parameters sorted, fragment dropped.
+    """
+    try:
+        scheme, netloc, path, query = _canonical_parts(url)
+    except ValueError:
+        return url.strip()
+    return urllib.parse.urlunsplit((scheme, netloc, path, query, ''))
+
+
+def stream_dedup_key(url):
+    """
+    8-byte digest identifying the channel a stream URL plays.
+
+    Xtream stream URLs (/live, /movie or /series/<user>/<pass>/<id>, with no
+    query) reduce to portal + stream type + stream id, so the same channel
+    reached with different credentials or container extensions collapses to
+    one key; anything else is keyed by its canonical URL, query included.
+    """
+    try:
+        scheme, netloc, path, query = _canonical_parts(url)
+    except ValueError:
+        key = url.strip()
+    else:
+        # A query (tokens, channel parameters) means the path alone doesn't name the stream
+        match = None if query else XTREAM_PATH_RE.match(path)
+        if match:
+            # Credentials live in the path, so the host and port identify the portal
+            key = f"xtream|{netloc.rpartition('@')[2]}|{match.group(1)}|{match.group(2)}"
+        else:
+            key = urllib.parse.urlunsplit((scheme, netloc, path, query, ''))
+    return hashlib.blake2b(key.encode('utf-8', errors='surrogatepass'), digest_size=8).digest()
+
+
+def xtream_portal(url):
+    """
+    (base URL, username, password, stream extension) for an Xtream get.php
+    playlist URL, or None if it isn't one. The base is what player_api.php
+    and the /live/ stream paths hang off.
+    """
+    try:
+        parts = urllib.parse.urlsplit(url)
+    except ValueError:
+        return None
+    prefix, _, script = parts.path.rpartition('/')
+    if script.lower() != 'get.php':
+        return None
+    params = dict(urllib.parse.parse_qsl(parts.query))
+    if not params.get('username') or not params.get('password'):
+        return None
+    extension = 'm3u8' if params.get('output', '').lower() in ('m3u8', 'hls') else 'ts'
+    base = urllib.parse.urlunsplit((parts.scheme, parts.netloc, prefix, '', ''))
+    return base, params['username'], params['password'], extension
+
+
+def score_link(url, text='', rel=''):
+    """Frontier priority for a link found during a site crawl: higher is fetched sooner"""
+    score = 2 * len(LINK_HINT_RE.findall(url)) + 2 * len(LINK_HINT_RE.findall(text))
+    if 'next' in rel or PAGINATION_RE.search(url) or PAGINATION_RE.search(text):
+        score += 3
+    return score
+
+
+class BloomFilter:
+    """
+    Fixed-size set of strings with no false negatives and about error_rate
+    false positives once capacity items are in. At the default 0.1% that is
+    under 2 bytes per item, however long the strings are.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: k bit positions from the two halves of one digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        """Add item; returns False if it was (probably) there already"""
+        added = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def __len__(self):
+        return self.count
+
+
+class StreamRecord:
+    """
+    One playlist entry.
+
+    A record parsed from a playlist starts out holding just its URL and raw
+    #EXTINF line. The name and group, and their lowercase forms that filters
+    match against, are pulled out of the line the first time any of them is
+    read, so entries that are only deduplicated or written back out (or
+    dropped) never pay for it. Every other attribute stays in the line and is
+    available through `attributes`. Unpacks as (name, url), like the plain
+    tuples the crawler used to return. A generated "Channel N" name is never
+    matched by a filter.
+    """
+
+    __slots__ = ('url', 'extinf', '_name', '_group_title', '_name_lc', '_group_lc', '_number', '_extgrp')
+
+    def __init__(self, name, url, group_title='', extinf=None, name_lc=None):
+        self.url = url
+        self.extinf = extinf
+        self._name = name
+        self._group_title = group_title
+        self._name_lc = name_lc  # The lowercase forms are filled in when first read
+        self._group_lc = None
+
+    @classmethod
+    def from_extinf(cls, extinf, url, number, group=''):
+        """
+        Build a record from an #EXTINF line (or None) and the URL line that
+        follows it. number is the N of the "Channel N" name used if the line
+        has none, and group the #EXTGRP group used if it has no group-title.
+        """
+        record = cls.__new__(cls)
+        record.url = url
+        record.extinf = extinf
+        record._name = None  # Not parsed yet
+        record._number = number
+        record._extgrp = group
+        return record
+
+    def _parse_extinf(self):
+        extinf, group = self.extinf, self._extgrp
+        name = ''
+        if extinf is not None:
+            # Inline finds for the two attributes needed; a full parse_extinf costs several times more
+            start = extinf.find(' tvg-name="')
+            if start != -1:
+                start += 11
+                name = extinf[start:extinf.find('"', start)]
+            start = extinf.find(' group-title="')
+            if start != -1:
+                start += 14
+                group = extinf[start:extinf.find('"', start)] or group
+            if not name:
+                # The title follows the first comma after the attributes
+                comma = extinf.find(',', extinf.rfind('"') + 1 if '="' in extinf else 8)
+                name = extinf[comma + 1:].strip() if comma != -1 else ''
+        self._group_title = group
+        self._name_lc = None if name else ''
+        self._group_lc = None
+        self._name = name or f"Channel {self._number}"
+
+    @classmethod
+    def from_columns(cls, extinfs, urls, first_number=1, groups=None):
+        """
+        from_extinf for many entries at once: a list of records from parallel
+        lists of #EXTINF lines ('' for none) and URLs, numbered from
+        first_number, with groups mapping list positions to #EXTGRP groups.
+        """
+        new_record = cls.__new__
+        records = []
+        append = records.append
+        for number, (extinf, url) in enumerate(zip(extinfs, urls), first_number):
+            record = new_record(cls)
+            record.url = url
+            record.extinf = extinf or None
+            record._name = None
+            record._number = number
+            record._extgrp = ''
+            append(record)
+        if groups:
+            for position, group in groups.items():
+                records[position]._extgrp = group
+        return records
+
+    @property
+    def name(self):
+        if self._name is None:
+            self._parse_extinf()
+        return self._name
+
+    @property
+    def group_title(self):
+        if self._name is None:
+            self._parse_extinf()
+        return self._group_title
+
+    @property
+    def name_lc(self):
+        if self._name is None:
+            self._parse_extinf()
+        if self._name_lc is None:
+            self._name_lc = self._name.lower()
+        return self._name_lc
+
+    @property
+    def group_lc(self):
+        if self._name is None:
+            self._parse_extinf()
+        if self._group_lc is None:
+            self._group_lc = self._group_title.lower()
+        return self._group_lc
+
+    @property
+    def attributes(self):
+        """All key="value" attributes of the #EXTINF line"""
+        return parse_extinf(self.extinf)[0] if self.extinf else {}
+
+    @property
+    def tvg_id(self):
+        return self.attributes.get('tvg-id', '')
+
+    @property
+    def tvg_logo(self):
+        return self.attributes.get('tvg-logo', '')
+
+    def matches(self, keyword, field=None):
+        """Check a lowercase keyword against the name, the group, or (by default) either"""
+        if field == 'group':
+            return keyword in self.group_lc
+        if field == 'name':
+            return keyword in self.name_lc
+        return keyword in self.name_lc or keyword in self.group_lc
+
+    def to_dict(self):
+        """JSON form for API responses"""
+        stream = {'name': self.name, 'url': self.url}
+        if self.group_title:
+            stream['group'] = self.group_title
+        return stream
+
+    def __iter__(self):
+        return iter((self.name, self.url))
+
+    def __repr__(self):
+        return f"StreamRecord(name={self.name!r}, url={self.url!r}, group_title={self.group_title!r})"
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values, where every
+    entry also carries its own TTL.
+
+    Expired entries stay put until LRU eviction pushes them out, so callers
+    that can revalidate them (see peek) still have them to hand.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, sizeof=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self._entries = collections.OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+
+    def peek(self, key):
+        """Return (value, fresh) for key, including expired entries; (None, False) if absent"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, False
+            self._entries.move_to_end(key)
+            return entry[0], entry[1] > time.monotonic()
+
+    def get(self, key, default=None):
+        """Return the value for key if it exists and hasn't expired"""
+        value, fresh = self.peek(key)
+        return value if fresh else default
+
+    def set(self, key, value, ttl=None):
+        size = self.sizeof(value)
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, expires_at, size)
+            self.size += size
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._remove(key)
+        return entry[0] if entry else None
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SingleFlight:
+    """Collapses concurrent calls that share a key into one execution whose result they all get"""
+
+    def __init__(self):
+        self.shared = 0  # Calls answered by another caller's execution
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.shared += 1
+        
+        if not leader:
+            return future.result()
+        
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+
+class CachedResponse:
+    """A cached response body plus the validators needed to revalidate it"""
+
+    __slots__ = ('text', 'etag', 'last_modified', 'size')
+
+    def __init__(self, text, etag=None, last_modified=None):
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = len(text)
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers or None
+
+
+# A cache directory over its budget is trimmed to this share of it, so a full
+# cache isn't listed again on the very next write
+CACHE_DIR_TRIM_TO = 0.9
+
+
+def trim_cache_dir(disk_dir, max_bytes):
+    """
+    Delete the least recently written files in a cache directory once it is
+    over max_bytes; returns the bytes left in it.
+    """
+    files = []
+    total = 0
+    for name in os.listdir(disk_dir):
+        if name.endswith('.tmp'):
+            continue
+        path = os.path.join(disk_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    if total <= max_bytes:
+        return total
+    for _, size, path in sorted(files):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if total <= max_bytes:
+            break
+    return total
+
+
+def replace_file(tmp_path, path):
+    """os.replace(tmp_path, path), returning the size of the file it replaced (0 if there was none)"""
+    try:
+        replaced = os.stat(path).st_size
+    except OSError:
+        replaced = 0
+    os.replace(tmp_path, path)
+    return replaced
+
+
+class DiskCacheBudget:
+    """
+    Running total of a cache directory's size, so writes don't have to list it.
+
+    The directory is scanned once, on the first write, and then only when the
+    total goes over max_bytes, when it is trimmed to CACHE_DIR_TRIM_TO of the
+    budget. Each scan also picks up files other processes wrote.
+    """
+
+    def __init__(self, disk_dir, max_bytes):
+        self.disk_dir = disk_dir
+        self.max_bytes = max_bytes
+        self.size = None  # Unknown until the first write
+        self.trims = 0
+        self._lock = threading.Lock()
+
+    def add(self, delta):
+        """Count a write that grew (or shrank) the directory by delta bytes, trimming it if it is now over budget"""
+        with self._lock:
+            if self.size is None:
+                self.size = trim_cache_dir(self.disk_dir, self.max_bytes)
+            else:
+                self.size += delta
+            if self.size > self.max_bytes:
+                self.size = trim_cache_dir(self.disk_dir, int(self.max_bytes * CACHE_DIR_TRIM_TO))
+                self.trims += 1
+
+
+class ResponseCache:
+    """
+    Cache of fetched pages and playlists, keyed by URL.
+
+    Entries live in a size-bounded in-memory LRU and, when disk_dir is set, in
+    a second on-disk tier that survives restarts. Each entry is fresh for the
+    response's Cache-Control max-age (or the default ttl); after that it is
+    revalidated with its ETag / Last-Modified instead of being downloaded again.
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024, ttl=300, disk_dir=None, max_disk_bytes=1024 * 1024 * 1024):
+        self.ttl = ttl
+        self.memory = TTLCache(max_size=max_bytes, ttl=ttl, sizeof=lambda entry: entry.size)
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_budget = DiskCacheBudget(disk_dir, max_disk_bytes) if disk_dir else None
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def lookup(self, url):
+        """Return (entry, fresh); entry is None on a miss, or a stale entry to revalidate"""
+        entry, fresh = self.memory.peek(url)
+        if entry is None and self.disk_dir:
+            entry, fresh = self._load_from_disk(url)
+        with self._lock:
+            if fresh:
+                self.hits += 1
+                self.bytes_saved += entry.size
+            else:
+                self.misses += 1
+        return entry, fresh
+
+    def store(self, url, response, text):
+        """Cache a successful response unless it forbids storing"""
+        if response.status_code != 200:
+            return
+        ttl = self._response_ttl(response)
+        if ttl is None:
+            return
+        entry = CachedResponse(text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        self.memory.set(url, entry, ttl)
+        if self.disk_dir:
+            self._save_to_disk(url, entry, ttl)
+
+    def revalidated(self, url, entry, response):
+        """Record a 304 for a stale entry and make it fresh again"""
+        ttl = self._response_ttl(response)
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            # lookup() counted this as a miss, but the body never crossed the wire
+            self.misses -= 1
+            self.hits += 1
+            self.revalidations += 1
+            self.bytes_saved += entry.size
+        entry.etag = response.headers.get('ETag', entry.etag)
+        entry.last_modified = response.headers.get('Last-Modified', entry.last_modified)
+        self.memory.set(url, entry, ttl)
+        if self.disk_dir:
+            self._save_to_disk(url, entry, ttl)
+
+    def _response_ttl(self, response):
+        """Seconds the response may be served without revalidation, or None if it mustn't be cached"""
+        cache_control = response.headers.get('Cache-Control', '').lower()
+        if 'no-store' in cache_control:
+            return None
+        if 'no-cache' in cache_control:
+            return 0
+        match = re.search(r'max-age=(\d+)', cache_control)
+        return int(match.group(1)) if match else self.ttl
+
+    def _disk_path(self, url):
+        return os.path.join(self.disk_dir, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def _save_to_disk(self, url, entry, ttl):
+        path = self._disk_path(url)
+        meta = {'url': url, 'etag': entry.etag, 'last_modified': entry.last_modified, 'expires': time.time() + ttl}
+        try:
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps(meta).encode('utf-8') + b'\n')
+                f.write(entry.text.encode('utf-8'))
+                size = f.tell()
+            self.disk_budget.add(size - replace_file(tmp_path, path))
+        except OSError as e:
+            log.warning("Could not write cache entry: %s", e, extra={'url': url})
+
+    def _load_from_disk(self, url):
+        try:
+            with open(self._disk_path(url), 'rb') as f:
+                meta = json.loads(f.readline())
+                text = f.read().decode('utf-8')
+        except (OSError, ValueError):
+            return None, False
+        if meta.get('url') != url:
+            return None, False
+        entry = CachedResponse(text, meta.get('etag'), meta.get('last_modified'))
+        remaining = meta.get('expires', 0) - time.time()
+        self.memory.set(url, entry, max(remaining, 0))
+        return entry, remaining > 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory.size,
+                'disk_bytes': self.disk_budget.size if self.disk_budget else None,
+            }
+
+
+class DNSCache:
+    """Thread-safe TTL cache in front of socket.getaddrinfo"""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """
+        Return the cached IP addresses for host in the order to try them, or
+        (host,) if it is already an IP literal or can't be resolved.
+        """
+        host = host.strip('[]')
+        try:
+            socket.inet_pton(socket.AF_INET6 if ':' in host else socket.AF_INET, host)
+            return (host,)  # Already an IP literal
+        except OSError:
+            pass
+        
+        key = (host.lower(), port)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        
+        try:
+            infos = socket.getaddrinfo(host, port, urllib3.util.connection.allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror:
+            # Let urllib3 do the lookup itself so it raises its usual NameResolutionError
+            return (host,)
+        addresses = tuple(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self._entries[key] = (addresses, now + self.ttl)
+        return addresses
+
+    def demote(self, host, port, address):
+        """Move an address that couldn't be connected to to the back of host's cached list"""
+        key = (host.strip('[]').lower(), port)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and address in entry[0] and entry[0][-1] != address:
+                self._entries[key] = (tuple(a for a in entry[0] if a != address) + (address,), entry[1])
+
+
+class _TransportConnectionMixin:
+    """
+    Resolves through the transport's DNS cache, trying each cached address in
+    turn, and counts new (pool-miss) connections
+    """
+    transport = None
+
+    def _new_conn(self):
+        self.transport._record_new_connection()
+        hostname = self._dns_host
+        dns_cache = self.transport.dns_cache
+        addresses = dns_cache.resolve(hostname, self.port)
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except urllib3.exceptions.ConnectTimeoutError:
+                    # Refused or timed out (NewConnectionError is one too); the next address may answer
+                    if i == len(addresses) - 1:
+                        raise
+                    dns_cache.demote(hostname, self.port, address)
+        finally:
+            self._dns_host = hostname
+
+
+class _TransportAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools use the transport's connection classes"""
+
+    def __init__(self, transport, **kwargs):
+        self.transport = transport
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.transport.pool_classes
+
+    def send(self, request, **kwargs):
+        self.transport._record_request()
+        return super().send(request, **kwargs)
+
+
+class HTTPTransport:
+    """
+    Shared, thread-safe HTTP transport used by the crawler and the video proxy.
+
+    Keeps a keep-alive connection pool per host:port (pool_connections hosts,
+    pool_maxsize idle connections each), caches DNS lookups for dns_ttl seconds
+    and counts how many requests were served by a pooled connection.
+    """
+
+    def __init__(self, pool_connections=256, pool_maxsize=16, dns_ttl=300):
+        self.dns_cache = DNSCache(ttl=dns_ttl)
+        self.requests = 0
+        self.new_connections = 0
+        self._lock = threading.Lock()
+        
+        transport = self
+        
+        class HTTPConnection(_TransportConnectionMixin, urllib3.connection.HTTPConnection):
+            pass
+        
+        class HTTPSConnection(_TransportConnectionMixin, urllib3.connection.HTTPSConnection):
+            pass
+        
+        HTTPConnection.transport = HTTPSConnection.transport = transport
+        
+        class HTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+            ConnectionCls = HTTPConnection
+        
+        class HTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+            ConnectionCls = HTTPSConnection
+        
+        self.pool_classes = {'http': HTTPConnectionPool, 'https': HTTPSConnectionPool}
+        
+        self.session = requests.Session()
+        # The session is shared by every crawl and proxied stream, so never let
+        # one portal's cookies leak into another user's requests
+        self.session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        adapter = _TransportAdapter(self, pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def _record_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.session.head(url, **kwargs)
+
+    def stats(self):
+        """Connection pool and DNS cache counters"""
+        with self._lock:
+            requests_sent = self.requests
+            misses = min(self.new_connections, requests_sent)
+        return {
+            'requests': requests_sent,
+            'pool_hits': requests_sent - misses,
+            'pool_misses': misses,
+            'dns_hits': self.dns_cache.hits,
+            'dns_misses': self.dns_cache.misses,
+        }
+
+
+def split_playlist(content, chunk_size):
+    """
+    Cut M3U content into pieces of roughly chunk_size characters. Every cut
+    falls just before an #EXTINF line, so each entry lands whole in one piece
+    and the pieces parse independently (the first one keeps the header).
+    """
+    chunks = []
+    start = 0
+    while len(content) - start > chunk_size:
+        cut = content.find('\n#EXTINF:', start + chunk_size)
+        if cut == -1:
+            break
+        chunks.append(content[start:cut + 1])
+        start = cut + 1
+    chunks.append(content[start:])
+    return chunks
+
+
+# Separator for packed record batches; chunks that contain it are sent back unpacked
+PACKED_FIELD = '\x1f'
+# Parse pools that may break in a row before parsing stays on the crawl threads
+MAX_PARSE_POOL_FAILURES = 3
+
+_chunk_parser = None
+
+
+def parse_playlist_chunk(chunk, filter_keyword=None, filter_field=None):
+    """
+    Process-pool entry point: parse one piece of a playlist.
+
+    Returns the entries as columns, (URLs, #EXTINF lines, {position: #EXTGRP
+    group}), with the two big columns packed into one string each rather
+    than pickled a string apiece. What a StreamRecord reads from its
+    #EXTINF line is left for the caller to read when needed, so the caller
+    only splits two strings and builds the records (see
+    StreamRecord.from_columns).
+    """
+    global _chunk_parser
+    if _chunk_parser is None:
+        _chunk_parser = IPTVCrawler(cache=False)
+    records = _chunk_parser.extract_streams_from_m3u(chunk, filter_keyword, filter_field)
+    urls = [record.url for record in records]
+    extinfs = [record.extinf or '' for record in records]
+    groups = {position: record._extgrp for position, record in enumerate(records) if record._extgrp}
+    if PACKED_FIELD in chunk:
+        return urls, extinfs, groups
+    return PACKED_FIELD.join(urls), PACKED_FIELD.join(extinfs), groups
+
+
+def unpack_playlist_chunks(batches):
+    """StreamRecords from parse_playlist_chunk results, in order and numbered as one playlist"""
+    streams = []
+    for urls, extinfs, groups in batches:
+        if isinstance(urls, str):
+            urls, extinfs = (urls.split(PACKED_FIELD), extinfs.split(PACKED_FIELD)) if urls else ([], [])
+        streams.extend(StreamRecord.from_columns(extinfs, urls, len(streams) + 1, groups))
+    return streams
+
+
+def extract_page_urls(content):
+    """Process-pool entry point for extract_iptv_urls"""
+    global _chunk_parser
+    if _chunk_parser is None:
+        _chunk_parser = IPTVCrawler(cache=False)
+    return _chunk_parser.extract_iptv_urls(content)
+
+
+# Stream categories in priority order, with the keywords that put a stream in
+# each (the same tables the web frontend used to apply per stream)
+STREAM_CATEGORIES = (
+    ('Sports', ('sport', 'football', 'soccer', 'basketball', 'tennis', 'cricket', 'hockey', 'baseball', 'golf',
+                'boxing', 'mma', 'ufc', 'wrestling', 'bein', 'espn', 'sky sports', 'premier league',
+                'champions league', 'epl', 'mls', 'nfl', 'nba', 'nhl', 'olympics', 'world cup', 'championship')),
+    ('News', ('news', 'cnn', 'bbc', 'fox news', 'msnbc', 'al jazeera', 'reuters', 'bloomberg', 'cnbc',
+              'fox business', 'breaking', 'headlines', 'current affairs')),
+    ('Movies', ('movie', 'film', 'cinema', 'hollywood', 'netflix', 'hbo', 'disney', 'marvel', 'dc', 'action',
+                'comedy', 'drama', 'horror', 'thriller', 'romance', 'sci-fi')),
+    ('Kids', ('kids', 'children', 'cartoon', 'disney', 'nickelodeon', 'cartoon network', 'pbs kids', 'baby',
+              'toddler', 'animated', 'family')),
+    ('Music', ('music', 'mtv', 'vh1', 'bet', 'fuse', 'concert', 'live music', 'radio', 'top 40', 'rock', 'pop',
+               'hip hop', 'country', 'jazz', 'classical')),
+    ('Documentary', ('documentary', 'discovery', 'national geographic', 'history', 'science', 'nature', 'wildlife',
+                     'travel', 'exploration', 'educational')),
+    ('Entertainment', ('entertainment', 'comedy', 'talk show', 'reality', 'variety', 'game show', 'quiz', 'talent',
+                       'show', 'program')),
+    ('Regional', ('arabic', 'hindi', 'spanish', 'french', 'german', 'italian', 'chinese', 'japanese', 'korean',
+                  'russian', 'portuguese', 'turkish')),
+    ('Religious', ('religious', 'christian', 'islamic', 'catholic', 'evangelical', 'church', 'mosque', 'prayer',
+                   'gospel', 'spiritual')),
+    ('Educational', ('educational', 'learning', 'tutorial', 'how to', 'instruction', 'academic', 'university',
+                     'college', 'course', 'lesson')),
+    ('Live TV', ('live', 'live tv', 'live stream', 'broadcast', 'channel', 'station', 'network', 'television')),
+    ('Gaming', ('gaming', 'game', 'esports', 'twitch', 'streamer', 'gamer', 'playstation', 'xbox', 'nintendo')),
+    ('Business', ('business', 'finance', 'economy', 'stock', 'market', 'trading', 'investment', 'corporate',
+                  'entrepreneur')),
+    ('Technology', ('tech', 'technology', 'digital', 'innovation', 'startup', 'software', 'hardware', 'ai',
+                    'artificial intelligence')),
+    ('Lifestyle', ('lifestyle', 'fashion', 'beauty', 'health', 'fitness', 'cooking', 'food', 'travel', 'home',
+                   'garden')),
+)
+
+# Fallback keywords looked for in the stream URL when neither group nor name matched
+URL_CATEGORIES = (
+    ('Sports', ('sport', 'football', 'soccer')),
+    ('News', ('news', 'cnn', 'bbc')),
+    ('Movies', ('movie', 'film', 'netflix')),
+    ('Music', ('music', 'mtv', 'concert')),
+    ('Live TV', ('live', 'tv', 'channel')),
+)
+
+DEFAULT_CATEGORY = 'General'
+
+
+def keyword_trie_pattern(words):
+    """
+    Regex source matching any of words, factored into a prefix trie
+    ('sport', 'soccer' -> 's(?:occer|port)'). re tries the alternatives of a
+    plain a|b|c one by one at every position; the trie only follows the
+    branch for the next character. Longer words are preferred at a position.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:%s)' % '|'.join(branches)
+        return '(?:%s)?' % body if '' in node else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """
+    Finds which of several keyword sets a text mentions, in one regex scan.
+
+    All the keywords go into one trie-shaped pattern inside a lookahead, so
+    a single findall reports the keyword starting at every position, even
+    where matches overlap. When a text mentions several sets the first one
+    in table order wins, as if each set's pattern were tried in turn.
+    Keywords match anywhere in the text, like `in`; texts are expected
+    lowercase.
+    """
+
+    def __init__(self, table):
+        self.labels = [label for label, _ in table]
+        self.rank = {}
+        for rank, (_, words) in enumerate(table):
+            for word in words:
+                self.rank.setdefault(word, rank)
+        self.pattern = re.compile('(?=(%s))' % keyword_trie_pattern(self.rank))
+
+    def match(self, text):
+        """The label of the highest-priority keyword set found in text, or None"""
+        found = self.pattern.findall(text)
+        if not found:
+            return None
+        return self.labels[min(map(self.rank.__getitem__, found))]
+
+
+class StreamCategorizer:
+    """
+    Puts each stream in one category.
+
+    The playlist's own group-title is used when it has one: a group that
+    mentions a category's keywords goes in that category. Otherwise the
+    stream name, then the URL are matched, and a stream none of them places
+    keeps its group-title as its category (or DEFAULT_CATEGORY without one).
+    Groups are matched once per distinct title rather than once per stream.
+    """
+
+    def __init__(self, categories=STREAM_CATEGORIES, url_categories=URL_CATEGORIES, default=DEFAULT_CATEGORY):
+        self.text = KeywordMatcher(categories)
+        self.urls = KeywordMatcher(url_categories)
+        self.default = default
+
+    def index(self, streams):
+        """{category: [positions in streams]}, categories in order of first appearance"""
+        index = {}
+        groups = {}
+        for position, stream in enumerate(streams):
+            group = stream.group_title
+            category = groups.get(group)
+            if category is None:
+                category = groups[group] = (self.text.match(stream.group_lc) if group else None) or ''
+            if not category:
+                # A generated "Channel N" name has an empty name_lc and is not matched
+                category = (self.text.match(stream.name_lc) or self.urls.match(stream.url.lower())
+                            or group or self.default)
+            positions = index.get(category)
+            if positions is None:
+                positions = index[category] = []
+            positions.append(position)
+        return index
+
+
+stream_categorizer = StreamCategorizer()
+
+
+def category_index(streams):
+    """stream_categorizer.index(streams), computed once per CrawlResult"""
+    index = getattr(streams, 'categories', None)
+    if index is None:
+        with metrics.timer('iptv_stage_seconds', stage='categorize'):
+            index = stream_categorizer.index(streams)
+        if isinstance(streams, CrawlResult):
+            streams.categories = index
+    return index
+
+
+class CrawlResult(list):
+    """
+    The streams a crawl found, plus the portals it gave up on when it ran out
+    of time and, for recrawls, the streams added and removed since last time.
+    """
+
+    def __init__(self, streams=(), unfinished=(), timed_out=False):
+        super().__init__(streams)
+        self.unfinished = list(unfinished)
+        self.timed_out = timed_out
+        self.added = None
+        self.removed = None
+        self.categories = None  # category_index(), filled in on first use
+        self.fingerprint = None  # result_fingerprint(), likewise
+
+
+def content_fingerprint(content):
+    """Fixed-size digest of a page or playlist body (str or bytes)"""
+    if isinstance(content, str):
+        content = content.encode('utf-8', errors='surrogatepass')
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
+def result_fingerprint(streams, batch_size=10000):
+    """
+    Digest of a crawl result: every stream's name, URL and group in order,
+    plus whether it was cut short. Hashed in batches rather than as one
+    string, and computed once per CrawlResult.
+    """
+    fingerprint = getattr(streams, 'fingerprint', None)
+    if fingerprint is None:
+        digest = hashlib.blake2b(repr((getattr(streams, 'timed_out', False),
+                                       sorted(getattr(streams, 'unfinished', [])))).encode('utf-8'), digest_size=16)
+        for start in range(0, len(streams), batch_size):
+            digest.update('\x1f'.join(field for stream in streams[start:start + batch_size]
+                                       for field in (stream.name, stream.url, stream.group_title, ''))
+                          .encode('utf-8', errors='surrogatepass'))
+        fingerprint = digest.hexdigest()
+        if isinstance(streams, CrawlResult):
+            streams.fingerprint = fingerprint
+    return fingerprint
+
+
+class FingerprintStore:
+    """
+    Remembers what each input looked like last time, for incremental recrawls.
+
+    reuse() keys a parse result by its input's content fingerprint, so an
+    unchanged page or playlist hands back the previous result without being
+    parsed again. delta() compares a crawl's streams with the previous crawl
+    of the same source. Bounded by the total number of items held.
+    """
+
+    def __init__(self, max_items=5000000, ttl=7 * 24 * 3600):
+        self.entries = TTLCache(max_size=max_items, ttl=ttl, sizeof=lambda entry: len(entry[1]) + 1)
+        self.unchanged = 0
+        self.changed = 0
+        self._lock = threading.Lock()
+
+    def reuse(self, key, content, parse, *args):
+        """parse(*args), or the result stored for key if content hasn't changed since"""
+        digest = content_fingerprint(content)
+        stored = self.entries.get(key)
+        if stored is not None and stored[0] == digest:
+            with self._lock:
+                self.unchanged += 1
+            return stored[1]
+        result = parse(*args)
+        self.entries.set(key, (digest, result))
+        with self._lock:
+            self.changed += 1
+        return result
+
+    def delta(self, key, streams, partial=False):
+        """
+        (added, removed) streams relative to the previous crawl stored under key.
+
+        A partial crawl reports no removals, since the portals it didn't reach
+        would look removed, and isn't stored as the new baseline.
+        """
+        stored = self.entries.get(key)
+        previous = stored[1] if stored is not None else []
+        previous_keys = {stream_dedup_key(stream.url) for stream in previous}
+        current_keys = {stream_dedup_key(stream.url) for stream in streams}
+        added = [stream for stream in streams if stream_dedup_key(stream.url) not in previous_keys]
+        removed = [] if partial else [stream for stream in previous if stream_dedup_key(stream.url) not in current_keys]
+        if not partial:
+            self.entries.set(key, (None, list(streams)))
+        return added, removed
+
+    def stats(self):
+        return {'unchanged_inputs': self.unchanged, 'parsed_inputs': self.changed, 'entries': len(self.entries)}
+
+
+def host_is_down(error):
+    """
+    Whether a request error means the host is unreachable or failing, as
+    opposed to refusing this one request: an HTTP 4xx (an expired Xtream
+    account, a removed playlist) proves the host is up.
+    """
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is None or response.status_code >= 500
+
+
+class HostState:
+    """What the crawler has learned about one host:port"""
+
+    __slots__ = ('strategies', 'use_http', 'failures', 'open_until')
+
+    def __init__(self):
+        self.strategies = {}  # strategy label -> index of the header strategy that last worked
+        self.use_http = False  # HTTPS failed with an SSL error but plain HTTP worked
+        self.failures = 0  # Consecutive requests where every strategy failed
+        self.open_until = 0.0  # Circuit breaker: skip the host until this monotonic time
+
+
+class HostStateTable:
+    """
+    Per-host memory for request_with_strategies.
+
+    Remembers the header strategy and scheme that last worked for each host so
+    they are tried first next time, and trips a circuit breaker on hosts that
+    fail failure_threshold times in a row: they are skipped for cooldown
+    seconds, after which a single trial request is let through. Only
+    connection errors, timeouts and 5xx answers count as failures.
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=300, max_hosts=100000):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hosts = TTLCache(max_size=max_hosts, ttl=24 * 3600)
+        self.skipped = 0
+        self.circuits_opened = 0
+        self._lock = threading.Lock()
+
+    def _state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = HostState()
+            self.hosts.set(host, state)
+        return state
+
+    def allow(self, host):
+        """False while the host's circuit is open; lets one trial request through once it cools down"""
+        with self._lock:
+            state = self.hosts.get(host)
+            if state is None or state.failures < self.failure_threshold:
+                return True
+            now = time.monotonic()
+            if now < state.open_until:
+                self.skipped += 1
+                return False
+            # Half-open: this caller makes the trial, everyone else keeps skipping
+            state.open_until = now + self.cooldown
+            return True
+
+    def use_http(self, host):
+        state = self.hosts.get(host)
+        return state is not None and state.use_http
+
+    def strategy_order(self, host, label, count):
+        """Strategy indices to try, the one that last worked for this host first"""
+        state = self.hosts.get(host)
+        best = state.strategies.get(label) if state is not None else None
+        order = list(range(count))
+        if best is not None and 0 < best < count:
+            order.remove(best)
+            order.insert(0, best)
+        return order
+
+    def record_success(self, host, label, index, used_http=False):
+        with self._lock:
+            state = self._state(host)
+            state.strategies[label] = index
+            state.use_http = state.use_http or used_http
+            state.failures = 0
+            state.open_until = 0.0
+
+    def record_alive(self, host):
+        """The host answered, if only with an HTTP error: its run of failures is over"""
+        with self._lock:
+            state = self.hosts.get(host)
+            if state is not None:
+                state.failures = 0
+                state.open_until = 0.0
+
+    def record_failure(self, host):
+        with self._lock:
+            state = self._state(host)
+            state.failures += 1
+            if state.failures == self.failure_threshold:
+                self.circuits_opened += 1
+            if state.failures >= self.failure_threshold:
+                state.open_until = time.monotonic() + self.cooldown
+
+    def stats(self):
+        return {
+            'tracked_hosts': len(self.hosts),
+            'circuits_opened': self.circuits_opened,
+            'skipped_requests': self.skipped,
+        }
+
+
+class IPTVCrawler:
+    def __init__(self, max_concurrency=200, per_host_concurrency=8, transport=None,
+                 stream_playlists=False, max_playlist_bytes=256 * 1024 * 1024, max_playlist_entries=1000000,
+                 cache=None, host_state=None, hedge_after=None, page_concurrency=8, per_domain_pages=2,
+                 page_delay=0.5, xtream_api=True, parse_workers=0, parse_offload_bytes=1024 * 1024,
+                 parse_chunk_bytes=4 * 1024 * 1024):
+        """
+        max_concurrency: threads fetching portals and site pages, shared by every crawl running on this crawler
+        per_host_concurrency: how many of those may target the same host:port
+        transport: HTTPTransport to share with other components (one is created if omitted)
+        stream_playlists: parse portal playlists line by line while they download
+        max_playlist_bytes / max_playlist_entries: caps for streamed playlists (0 = unlimited)
+        cache: ResponseCache for pages and playlists (a memory-only one if omitted, False to disable)
+        host_state: HostStateTable of per-host strategy memory and circuit breakers (created if omitted)
+        hedge_after: seconds to wait before racing a second header strategy (None = never hedge)
+        page_concurrency / per_domain_pages: pages a site crawl fetches at once, overall and per domain
+        page_delay: minimum seconds between two site-crawl requests to the same domain
+        xtream_api: answer filtered crawls of get.php portals from player_api.php rather than the full playlist
+        parse_workers: processes to parse pages and playlists of parse_offload_bytes or more in (0 = parse on the
+            calling thread); playlists are split into parse_chunk_bytes pieces so one can use several processes
+        """
+        if cache is None:
+            cache = ResponseCache()
+        self.cache = cache or None
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.stream_playlists = stream_playlists
+        self.max_playlist_bytes = max_playlist_bytes
+        self.max_playlist_entries = max_playlist_entries
+        # Request headers come from the header strategies in each fetch method
+        self.transport = transport or HTTPTransport()
+        self.session = self.transport.session
+        self.hosts = host_state or HostStateTable()
+        self.hedge_after = hedge_after
+        self.page_concurrency = page_concurrency
+        self.per_domain_pages = per_domain_pages
+        self.page_delay = page_delay
+        self.xtream_api = xtream_api
+        self.xtream_unsupported = TTLCache(max_size=4096, ttl=3600)  # Hosts whose player_api.php failed
+        self.parse_workers = parse_workers
+        self.parse_offload_bytes = parse_offload_bytes
+        self.parse_chunk_bytes = parse_chunk_bytes
+        self.parse_pool_failures = 0  # Pools broken in a row
+        self._parse_executor = None
+        self._parse_lock = threading.Lock()
+        self.bytes_fetched = 0  # Response body bytes downloaded by fetch_text and iter_m3u_streams
+        self.fingerprints = FingerprintStore()
+        self._stats_lock = threading.Lock()
+        self.hedged_requests = 0
+        self._hedge_executor = None
+        self._hedge_lock = threading.Lock()
+        self._fetch_executor = None
+        self._fetch_lock = threading.Lock()
+
+    @timed('page_fetch')
+    def fetch_webpage(self, url, timeout=30, revalidate=False):
+        """Fetch webpage content from any URL (revalidate: don't trust a fresh cached copy)"""
+        try:
+            log.info("Fetching webpage", extra={'url': url})
+            
+            # Clean the URL - remove any extra text after the URL (like dates, timestamps, etc.)
+            # Look for common patterns that indicate the URL ends
+            url_patterns = [
+                r'(https?://[^\s]+?get\.php\?[^\s]+?username=[^\s]+?password=[^\s]+?type=m3u[^\s]*)',  # Complete get.php URLs
+                r'(https?://[^\s]+?get\.php\?[^\s]+?password=[^\s]+?username=[^\s]+?type=m3u[^\s]*)',  # Complete get.php URLs (password first)
+                r'(https?://[^\s]+?get\.php\?[^\s]+?type=m3u[^\s]*)',  # get.php URLs with type=m3u
+                r'(https?://[^\s]+?get\.php\?[^\s]+?username=[^\s]+?password=[^\s]+)',  # get.php URLs with username/password
+                r'(https?://[^\s]+?get\.php\?[^\s]+?password=[^\s]+?username=[^\s]+)',  # get.php URLs with password/username
+                r'(https?://[^\s]+?\.(?:php|m3u|m3u8|mp4|ts))',  # URLs ending with common extensions
+            ]
+            
+            cleaned_url = url
+            for pattern in url_patterns:
+                match = re.search(pattern, url, re.IGNORECASE)
+                if match:
+                    cleaned_url = match.group(1)
+                    log.debug("Cleaned URL", extra={'url': url, 'cleaned': cleaned_url})
+                    break
+            
+            # Handle port issues - if HTTPS on port 80, change to HTTP
+            if cleaned_url.startswith('https://') and ':80/' in cleaned_url:
+                cleaned_url = cleaned_url.replace('https://', 'http://')
+                log.debug("Fixed HTTPS on port 80", extra={'url': cleaned_url})
+            
+            # Handle URL encoding issues
+            if '%' in cleaned_url:
+                cleaned_url = urllib.parse.unquote(cleaned_url)
+                log.debug("Decoded URL", extra={'url': cleaned_url})
+            
+            # Try different approaches to handle various websites
+            content = self.fetch_text(cleaned_url, PAGE_HEADER_STRATEGIES, timeout=timeout, label='strategy', revalidate=revalidate)
+            if content is None:
+                raise Exception("All request strategies failed")
+            
+            return content
+            
+        except Exception as e:
+            log.error("Error fetching webpage: %s", e, extra={'url': url})
+            return None
+
+    @timed('url_extraction')
+    def extract_iptv_urls(self, content):
+        """
+        Extract IPTV URLs from webpage content (str or raw bytes).
+
+        Looks where the original BeautifulSoup version did: the page's text,
+        <a href> links and <script> bodies. One substitution blanks out tags,
+        comments and script/style/template elements, and one precompiled
+        pattern then scans what is left. Only &amp; is decoded in the text,
+        as other entity-like runs (&region=, &copy...) are part of the
+        credentials far more often than real entities; scripts are scanned
+        as they are.
+        """
+        if isinstance(content, bytes):
+            url_re, markup_re, script_re, amp = IPTV_URL_BYTES_RE, MARKUP_BYTES_RE, SCRIPT_BYTES_RE, (b'&amp;', b'&')
+        else:
+            url_re, markup_re, script_re, amp = IPTV_URL_RE, MARKUP_RE, SCRIPT_RE, ('&amp;', '&')
+        
+        # dict keys keep first-seen order and make the duplicate check O(1)
+        unique_urls = {}
+        
+        def add(url):
+            if isinstance(url, bytes):
+                url = url.decode('utf-8', errors='replace')
+            url = url.strip()
+            # Remove any trailing characters that might be part of the URL
+            url = TRAILING_URL_JUNK_RE.sub('', url)
+            if url.startswith('http'):
+                unique_urls[url] = None
+        
+        text = markup_re.sub(b' ' if isinstance(content, bytes) else ' ', content).replace(*amp)
+        for match in url_re.finditer(text):
+            add(match.group(0))
+        
+        # Also look for URLs in href attributes
+        for href in self._iter_hrefs(content):
+            if 'get.php' in href or ('username=' in href and 'password=' in href):
+                if href.startswith('http'):
+                    add(href)
+        
+        for script in script_re.findall(content):
+            for match in url_re.finditer(script):
+                add(match.group(0))
+        
+        log.info("Found %d unique IPTV URLs", len(unique_urls))
+        return list(unique_urls)
+
+    @staticmethod
+    def _iter_hrefs(content):
+        """Yield the href of every <a> tag, parsed with lxml"""
+        if isinstance(content, str):
+            # lxml refuses str input that carries an XML encoding declaration
+            content = content.encode('utf-8')
+        try:
+            document = lxml.html.document_fromstring(content)
+        except (ValueError, lxml.etree.ParserError):
+            return
+        for link in document.iter('a'):
+            href = link.get('href')
+            if href:
+                yield href
+
+    @staticmethod
+    def _iter_links(content, base_url):
+        """Yield (absolute url, link text, rel) for every <a href> on a page, fragments dropped"""
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        try:
+            document = lxml.html.document_fromstring(content)
+        except (ValueError, lxml.etree.ParserError):
+            return
+        for link in document.iter('a'):
+            href = link.get('href')
+            if not href or href.startswith('#'):
+                continue
+            try:
+                url = urllib.parse.urldefrag(urllib.parse.urljoin(base_url, href.strip()))[0]
+            except ValueError:
+                continue
+            if url.startswith(('http://', 'https://')):
+                yield url, link.text_content().strip()[:200], (link.get('rel') or '').lower()
+
+    def site_links(self, content, base_url, site):
+        """List the (url, text, rel) links of a page that lead to further pages of the same site"""
+        return [(url, text, rel) for url, text, rel in self._iter_links(content, base_url)
+                if self.site_key(url) == site and not NON_PAGE_LINK_RE.search(url) and not IPTV_URL_RE.match(url)]
+
+    def clean_iptv_url(self, iptv_url):
+        """Strip trailing junk and URL-encoding from an extracted IPTV URL"""
+        # Clean the URL - remove any extra text after the URL (like dates, timestamps, etc.)
+        url_patterns = [
+            r'(https?://[^\s]+?get\.php\?[^\s]+?username=[^\s]+?password=[^\s]+?type=m3u[^\s]*)',  # Complete get.php URLs
+            r'(https?://[^\s]+?get\.php\?[^\s]+?password=[^\s]+?username=[^\s]+?type=m3u[^\s]*)',  # Complete get.php URLs (password first)
+            r'(https?://[^\s]+?get\.php\?[^\s]+?type=m3u[^\s]*)',  # get.php URLs with type=m3u
+            r'(https?://[^\s]+?get\.php\?[^\s]+?username=[^\s]+?password=[^\s]+)',  # get.php URLs with username/password
+            r'(https?://[^\s]+?get\.php\?[^\s]+?password=[^\s]+?username=[^\s]+)',  # get.php URLs with password/username
+            r'(https?://[^\s]+?\.(?:php|m3u|m3u8|mp4|ts))',  # URLs ending with common extensions
+        ]
+        
+        cleaned_url = iptv_url
+        for pattern in url_patterns:
+            match = re.search(pattern, iptv_url, re.IGNORECASE)
+            if match:
+                cleaned_url = match.group(1)
+                log.debug("Cleaned IPTV URL", extra={'url': iptv_url, 'cleaned': cleaned_url})
+                break
+        
+        # Handle URL encoding issues
+        if '%' in cleaned_url:
+            cleaned_url = urllib.parse.unquote(cleaned_url)
+            log.debug("Decoded IPTV URL", extra={'url': cleaned_url})
+        
+        return cleaned_url
+
+    def request_with_strategies(self, url, header_strategies, timeout, stream=False, extra_headers=None, label='strategy'):
+        """
+        Request url with each header strategy in turn, retrying over HTTP on SSL errors; returns the response or None.
+
+        The strategy and scheme that last worked for the host are tried first,
+        hosts whose circuit breaker is open are skipped outright, and a host that
+        can't be reached at all isn't retried with the remaining strategies. With
+        hedge_after set, a second strategy is started if the first hasn't
+        answered within that many seconds and whichever succeeds first is used.
+        """
+        host = self.host_key(url)
+        if not self.hosts.allow(host):
+            log.warning("Skipping URL, host keeps failing (circuit open)", extra={'url': url, 'host': host})
+            metrics.inc('iptv_host_requests_total', host=host, outcome='skipped')
+            return None
+        if url.startswith('https://') and self.hosts.use_http(host):
+            url = 'http://' + url[len('https://'):]
+        
+        order = self.hosts.strategy_order(host, label, len(header_strategies))
+        attempts = [(i, {**header_strategies[i], **extra_headers} if extra_headers else header_strategies[i])
+                    for i in order]
+        
+        errors = []
+        if self.hedge_after is not None and len(attempts) > 1:
+            result, unreachable = self._hedged_request(url, attempts[:2], timeout, stream, label, errors)
+            attempts = attempts[2:]
+        else:
+            result, unreachable = None, False
+        
+        for i, headers in attempts:
+            if result is not None or unreachable:
+                break
+            try:
+                log.debug("Trying %s %d", label, i + 1, extra={'url': url})
+                result = (i,) + self._request_once(url, headers, timeout, stream, label, i)
+                log.debug("Success with %s %d", label, i + 1, extra={'url': url})
+            except requests.exceptions.RequestException as e:
+                log.warning("Request error with %s %d: %s", label, i + 1, e, extra={'url': url})
+                errors.append(e)
+                # Other headers won't help a host that can't be reached or doesn't answer
+                unreachable = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+        
+        if result is None:
+            if all(host_is_down(e) for e in errors):
+                self.hosts.record_failure(host)
+                metrics.inc('iptv_host_requests_total', host=host, outcome='error')
+            else:
+                # Refused (say a dead account's 403), but the host is up for everyone else
+                self.hosts.record_alive(host)
+                metrics.inc('iptv_host_requests_total', host=host, outcome='refused')
+            return None
+        i, response, used_url = result
+        self.hosts.record_success(host, label, i, used_http=used_url != url)
+        metrics.inc('iptv_host_requests_total', host=host, outcome='ok')
+        return response
+
+    def _request_once(self, url, headers, timeout, stream, label, i):
+        """One strategy attempt, retried over HTTP on an SSL error; returns (response, url used) or raises"""
+        metrics.inc('iptv_inflight_fetches')
+        try:
+            response = self.transport.get(url, timeout=timeout, verify=False, allow_redirects=True, headers=headers, stream=stream)
+        except requests.exceptions.SSLError:
+            if not url.startswith('https://'):
+                raise
+            log.info("SSL error with %s %d, trying HTTP", label, i + 1, extra={'url': url})
+            url = 'http://' + url[len('https://'):]
+            response = self.transport.get(url, timeout=timeout, verify=False, allow_redirects=True, headers=headers, stream=stream)
+        finally:
+            metrics.inc('iptv_inflight_fetches', -1)
+        try:
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            response.close()
+            raise
+        return response, url
+
+    def _hedged_request(self, url, attempts, timeout, stream, label, errors):
+        """
+        Run the first attempt, adding the second if the first is still pending
+        after hedge_after seconds; returns ((index, response, url used) or None, unreachable).
+        Request errors are appended to errors.
+        """
+        if self._hedge_executor is None:
+            with self._hedge_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='hedge')
+        
+        def attempt(i, headers):
+            return (i,) + self._request_once(url, headers, timeout, stream, label, i)
+        
+        log.debug("Trying %s %d", label, attempts[0][0] + 1, extra={'url': url})
+        pending = {self._hedge_executor.submit(attempt, *attempts[0])}
+        done, _ = wait(pending, timeout=self.hedge_after)
+        second_started = not done
+        if second_started:
+            log.debug("No answer after %ss, hedging with %s %d", self.hedge_after, label, attempts[1][0] + 1, extra={'url': url})
+            with self._hedge_lock:
+                self.hedged_requests += 1
+            pending.add(self._hedge_executor.submit(attempt, *attempts[1]))
+        
+        result = None
+        unreachable = False
+        while pending and result is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    outcome = future.result()
+                except requests.exceptions.RequestException as e:
+                    log.warning("Request error with %s: %s", label, e, extra={'url': url})
+                    errors.append(e)
+                    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                        unreachable = True
+                    elif not second_started:
+                        # The first strategy was refused quickly: the second simply runs next
+                        second_started = True
+                        log.debug("Trying %s %d", label, attempts[1][0] + 1, extra={'url': url})
+                        pending.add(self._hedge_executor.submit(attempt, *attempts[1]))
+                    continue
+                if result is None:
+                    result = outcome
+                    log.debug("Success with %s %d", label, outcome[0] + 1, extra={'url': url})
+                else:
+                    outcome[1].close()
+        
+        # Whatever is still running lost the race: drop its response when it arrives
+        for future in pending:
+            future.add_done_callback(self._close_hedge_loser)
+        return result, unreachable
+
+    @staticmethod
+    def _close_hedge_loser(future):
+        if not future.cancelled() and future.exception() is None:
+            future.result()[1].close()
+
+
+    def fetch_text(self, url, header_strategies, timeout, label='strategy', revalidate=False):
+        """
+        GET url through the response cache and return the body text (None on failure).
+
+        Fresh cache entries are served without touching the network; stale ones
+        are revalidated with If-None-Match / If-Modified-Since and reused on a 304.
+        revalidate treats every cached entry as stale.
+        """
+        entry, fresh = self.cache.lookup(url) if self.cache else (None, False)
+        if fresh and not revalidate:
+            log.debug("Cache hit", extra={'url': url})
+            return entry.text
+        
+        extra_headers = entry.conditional_headers() if entry is not None else None
+        response = self.request_with_strategies(url, header_strategies, timeout, extra_headers=extra_headers, label=label)
+        if response is None:
+            return None
+        
+        if response.status_code == 304 and entry is not None:
+            log.debug("Not modified, using cached copy", extra={'url': url})
+            self.cache.revalidated(url, entry, response)
+            return entry.text
+        
+        text = response.text
+        self._record_bytes(len(response.content))
+        if self.cache:
+            self.cache.store(url, response, text)
+        return text
+
+    def _record_bytes(self, count):
+        with self._stats_lock:
+            self.bytes_fetched += count
+        metrics.inc('iptv_fetched_bytes_total', count)
+
+    def request_playlist(self, cleaned_url, stream=False):
+        """Request a playlist URL, trying each header strategy in turn; returns the response or None"""
+        response = self.request_with_strategies(cleaned_url, PLAYLIST_HEADER_STRATEGIES, timeout=15, stream=stream, label='IPTV strategy')
+        if response is None:
+            log.warning("All IPTV request strategies failed", extra={'url': cleaned_url})
+        return response
+
+    @timed('playlist_fetch')
+    def fetch_m3u_playlist(self, iptv_url, revalidate=False):
+        """Fetch M3U playlist from an IPTV URL"""
+        try:
+            log.debug("Fetching M3U", extra={'url': iptv_url})
+            
+            cleaned_url = self.clean_iptv_url(iptv_url)
+            content = self.fetch_text(cleaned_url, PLAYLIST_HEADER_STRATEGIES, timeout=15, label='IPTV strategy',
+                                      revalidate=revalidate)
+            if content is None:
+                log.warning("All IPTV request strategies failed", extra={'url': cleaned_url})
+                return None
+            
+            log.debug("M3U content length: %d", len(content), extra={'url': cleaned_url})
+            
+            # Verify it's M3U content
+            if self.is_m3u_content(content):
+                return content
+            else:
+                log.warning("Content is not M3U format", extra={'url': cleaned_url})
+                return None
+                
+        except Exception as e:
+            log.error("Error fetching M3U: %s", e, extra={'url': iptv_url})
+            return None
+
+    def iter_m3u_streams(self, iptv_url, filter_keyword=None, max_bytes=None, max_entries=None, filter_field=None):
+        """
+        Stream (name, url) pairs from an IPTV URL without buffering the playlist.
+
+        The body is read line by line, so memory stays flat however large the
+        playlist is. Bodies without an M3U header in their first lines are dropped
+        before the rest is downloaded, and reading stops once max_bytes of body or
+        max_entries streams have been consumed (defaults come from the crawler).
+        A fresh copy in the response cache is used when there is one, but streamed
+        bodies are never added to it.
+        """
+        max_bytes = self.max_playlist_bytes if max_bytes is None else max_bytes
+        max_entries = self.max_playlist_entries if max_entries is None else max_entries
+        
+        log.debug("Streaming M3U", extra={'url': iptv_url})
+        cleaned_url = self.clean_iptv_url(iptv_url)
+        
+        entry, fresh = self.cache.lookup(cleaned_url) if self.cache else (None, False)
+        if fresh:
+            log.debug("Cache hit", extra={'url': cleaned_url})
+            if self.is_m3u_content(entry.text):
+                streams = self._parse_m3u_lines(entry.text.split('\n'), filter_keyword, filter_field)
+                yield from itertools.islice(streams, max_entries or None)
+            return
+        
+        try:
+            response = self.request_playlist(cleaned_url, stream=True)
+        except Exception as e:
+            log.error("Error fetching M3U: %s", e, extra={'url': iptv_url})
+            return
+        if response is None:
+            return
+        
+        try:
+            bytes_read = 0
+            head = []
+            lines = response.iter_lines(chunk_size=65536)
+            
+            def decoded_lines():
+                nonlocal bytes_read
+                for raw_line in lines:
+                    bytes_read += len(raw_line) + 1
+                    if max_bytes and bytes_read > max_bytes:
+                        log.warning("M3U exceeded %d bytes, truncating", max_bytes, extra={'url': cleaned_url})
+                        return
+                    yield raw_line.decode('utf-8', errors='replace')
+            
+            body = decoded_lines()
+            
+            # Validate the header from the first lines before reading any further
+            for line in body:
+                head.append(line)
+                if self.is_m3u_content(line) or len(head) >= 10:
+                    break
+            if not self.is_m3u_content('\n'.join(head)):
+                log.warning("Content is not M3U format", extra={'url': cleaned_url})
+                return
+            
+            count = 0
+            for stream in self._parse_m3u_lines(itertools.chain(head, body), filter_keyword, filter_field):
+                yield stream
+                count += 1
+                if max_entries and count >= max_entries:
+                    log.warning("M3U reached %d entries, truncating", max_entries, extra={'url': cleaned_url})
+                    break
+            log.debug("Streamed %d bytes of M3U", bytes_read, extra={'url': cleaned_url})
+            self._record_bytes(bytes_read)
+        except requests.exceptions.RequestException as e:
+            log.error("Error reading M3U: %s", e, extra={'url': iptv_url})
+        finally:
+            response.close()
+
+    def is_m3u_content(self, content):
+        """Check if content is M3U format"""
+        lines = content.split('\n')
+        for line in lines[:10]:  # Check first 10 lines
+            if line.strip().startswith('#EXTM3U') or line.strip().startswith('#EXTINF:'):
+                return True
+        return False
+
+    @timed('parse')
+    def extract_streams_from_m3u(self, content, filter_keyword=None, filter_field=None):
+        """
+        Extract StreamRecords from M3U content.
+
+        filter_keyword keeps entries whose name or group-title contains it
+        (filter_field='name' or 'group' narrows that to one field). Rather than
+        walking every line, the filter searches a lowercased copy of the whole
+        playlist and only parses the entries the keyword actually occurs in,
+        until those turn out to be a large share of the playlist: from there
+        the remaining lines are walked, which is cheaper than jumping between
+        hits.
+        """
+        if not filter_keyword:
+            return list(self._parse_m3u_lines(content.split('\n')))
+        
+        keyword = filter_keyword.lower()
+        lowered = content.lower()
+        if len(lowered) != len(content):
+            # A few characters change length when lowercased, so offsets would drift
+            return list(self._parse_m3u_lines(content.split('\n'), filter_keyword, filter_field))
+        
+        streams = []
+        candidates = covered = 0  # Entries the keyword occurs in, and their total length
+        pos = lowered.find(keyword)
+        while pos != -1:
+            start = lowered.rfind('#extinf:', 0, pos + 1)
+            if start == -1:
+                # Hit in the playlist header, before the first entry
+                pos = lowered.find(keyword, pos + 1)
+                continue
+            end = lowered.find('#extinf:', start + 8)
+            if end == -1:
+                end = len(content)
+            record = self._parse_m3u_entry(content[start:end], len(streams))
+            if record is not None and record.matches(keyword, filter_field):
+                streams.append(record)
+            candidates += 1
+            covered += end - start
+            if candidates % DENSE_FILTER_CHECK == 0 and covered * DENSE_FILTER_SHARE > end:
+                rest = content[lowered.rfind('\n', 0, end) + 1:]
+                streams.extend(self._parse_m3u_lines(rest.split('\n'), filter_keyword, filter_field, len(streams)))
+                break
+            pos = lowered.find(keyword, end)
+        return streams
+
+    def _parse_m3u_entry(self, entry, index):
+        """Parse the text of one #EXTINF entry (through its URL line) into a StreamRecord"""
+        lines = entry.split('\n')
+        group = ''
+        for line in lines[1:]:
+            line = line.strip()
+            if line.startswith('http'):
+                return StreamRecord.from_extinf(lines[0].strip(), line, index + 1, group)
+            if line.startswith('#EXTGRP:'):
+                group = line[8:].strip()
+        return None
+
+    def _parse_m3u_lines(self, lines, filter_keyword=None, filter_field=None, first_index=0):
+        """Yield StreamRecords from an iterable of M3U lines"""
+        keyword = filter_keyword.lower() if filter_keyword else None
+        extinf = None
+        group = ''
+        count = first_index
+        new_record = StreamRecord.__new__
+        
+        for line in lines:
+            line = line.strip()
+            
+            # Skip empty lines
+            if not line:
+                continue
+            
+            if line[0] == '#':
+                # Channel info lines: #EXTINF carries the name and attributes,
+                # #EXTGRP an optional group for playlists without group-title
+                if line.startswith('#EXTINF:'):
+                    extinf = line
+                    group = ''
+                elif line.startswith('#EXTGRP:'):
+                    group = line[8:].strip()
+                continue
+            
+            # Check if line contains a URL
+            if not line.startswith('http'):
+                continue
+            
+            entry, entry_group = extinf, group
+            extinf, group = None, ''
+            if keyword:
+                # Name and group are substrings of these lines, so most entries
+                # can be rejected without parsing their attributes
+                if entry is None or (keyword not in entry.lower() and keyword not in entry_group.lower()):
+                    continue
+                record = StreamRecord.from_extinf(entry, line, count + 1, entry_group)
+                if not record.matches(keyword, filter_field):
+                    continue
+            else:
+                # StreamRecord.from_extinf, inlined: this runs for every entry of every playlist
+                record = new_record(StreamRecord)
+                record.url = line
+                record.extinf = entry
+                record._name = None
+                record._number = count + 1
+                record._extgrp = entry_group
+            
+            yield record
+            count += 1
+
+    @timed('dedup')
+    def deduplicate_streams(self, streams):
+        """
+        Remove duplicate streams, keeping the first of each channel.
+
+        Streams are compared by stream_dedup_key, so credential and
+        query-order variants of the same channel count as duplicates, and only
+        fixed-size digests are held while deduplicating.
+        """
+        seen_keys = set()
+        unique_streams = []
+        
+        for stream in streams:
+            key = stream_dedup_key(stream.url)
+            if key not in seen_keys:
+                seen_keys.add(key)
+                unique_streams.append(stream)
+        
+        return unique_streams
+
+    def fetch_portal_streams(self, iptv_url, filter_keyword=None, filter_field=None, recrawl=False):
+        """
+        Fetch one portal playlist and return its StreamRecords (None if no playlist could be fetched).
+
+        With recrawl set, a playlist whose content hasn't changed since it was
+        last parsed isn't parsed again (playlists are then always buffered, and
+        cached copies are revalidated rather than trusted).
+        """
+        if filter_keyword and self.xtream_api:
+            streams = self.fetch_xtream_streams(iptv_url, filter_keyword, filter_field, revalidate=recrawl)
+            if streams is not None:
+                return streams
+        if self.stream_playlists and not recrawl:
+            # Download and parse overlap when streaming, so the whole read counts as the fetch
+            with metrics.timer('iptv_stage_seconds', stage='playlist_fetch'):
+                return list(self.iter_m3u_streams(iptv_url, filter_keyword, filter_field=filter_field))
+        m3u_content = self.fetch_m3u_playlist(iptv_url, revalidate=recrawl)
+        if not m3u_content:
+            return None
+        if recrawl:
+            return self.fingerprints.reuse(('playlist', iptv_url, filter_keyword, filter_field), m3u_content,
+                                           self.parse_playlist, m3u_content, filter_keyword, filter_field)
+        return self.parse_playlist(m3u_content, filter_keyword, filter_field)
+
+    def _parse_pool(self):
+        """The parse process pool, started on first use; None once parsing has moved back to the calling threads"""
+        if self._parse_executor is None:
+            with self._parse_lock:
+                if self._parse_executor is None and self.parse_workers:
+                    # spawn: forking a process full of crawl threads could copy held locks
+                    self._parse_executor = ProcessPoolExecutor(max_workers=self.parse_workers,
+                                                               mp_context=multiprocessing.get_context('spawn'))
+        return self._parse_executor
+
+    def _discard_parse_pool(self, executor, error):
+        """
+        Drop a parse pool that broke (a worker died), so the next large parse
+        starts a new one; after MAX_PARSE_POOL_FAILURES in a row, stop
+        offloading and parse on the calling threads from then on.
+        """
+        with self._parse_lock:
+            if self._parse_executor is not executor:
+                return  # Another thread got here first
+            self._parse_executor = None
+            self.parse_pool_failures += 1
+            if self.parse_pool_failures >= MAX_PARSE_POOL_FAILURES:
+                log.error("Parse process pool failed %d times in a row, parsing on the crawl threads from now on: %s",
+                          self.parse_pool_failures, error)
+                self.parse_workers = 0
+            else:
+                log.warning("Parse process pool failed, starting a new one for the next parse: %s", error)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        """
+        Stop the parse process pool, if one was started. Parses still running
+        (a crawl thread that couldn't be stopped) finish on their own thread
+        rather than starting a new pool.
+        """
+        with self._parse_lock:
+            executor, self._parse_executor = self._parse_executor, None
+            self.parse_workers = 0
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def parse_playlist(self, content, filter_keyword=None, filter_field=None):
+        """
+        extract_streams_from_m3u, run in the parse process pool for large playlists.
+
+        The playlist is split at #EXTINF boundaries into parse_chunk_bytes
+        pieces that are parsed in parallel; their columns are turned into
+        records here in order, giving the same records as parsing it in one go.
+        """
+        if not self.parse_workers or len(content) < self.parse_offload_bytes:
+            return self.extract_streams_from_m3u(content, filter_keyword, filter_field)
+
+        executor = self._parse_pool()
+        if executor is not None:
+            chunks = split_playlist(content, self.parse_chunk_bytes)
+            try:
+                with metrics.timer('iptv_stage_seconds', stage='parse'):
+                    futures = [executor.submit(parse_playlist_chunk, chunk, filter_keyword, filter_field)
+                               for chunk in chunks]
+                    streams = unpack_playlist_chunks(future.result() for future in futures)
+            except BrokenProcessPool as e:
+                self._discard_parse_pool(executor, e)
+            except (CancelledError, RuntimeError):
+                if self._parse_executor is executor:
+                    raise
+                # close() shut the pool down under this parse
+            else:
+                self.parse_pool_failures = 0
+                return streams
+        return self.extract_streams_from_m3u(content, filter_keyword, filter_field)
+
+    @timed('playlist_fetch')
+    def fetch_xtream_api(self, base, username, password, revalidate=False, **params):
+        """GET player_api.php through the response cache and return the decoded JSON (None on failure)"""
+        query = urllib.parse.urlencode({'username': username, 'password': password, **params})
+        text = self.fetch_text(f"{base}/player_api.php?{query}", PLAYLIST_HEADER_STRATEGIES, timeout=15,
+                               label='Xtream API strategy', revalidate=revalidate)
+        if text is None:
+            return None
+        try:
+            return json.loads(text)
+        except ValueError:
+            log.warning("player_api.php did not return JSON", extra={'url': base})
+            return None
+
+    def fetch_xtream_streams(self, iptv_url, filter_keyword, filter_field=None, revalidate=False):
+        """
+        Filtered StreamRecords for a get.php portal, read from its player_api.php
+        instead of the full playlist export; None if the portal has no usable API.
+
+        Account info and the live category list are fetched first (both go
+        through the response cache, so repeat crawls reuse them). A group filter
+        then only downloads the live streams of the categories whose name
+        matches; name filters need every live stream, but that list is still a
+        fraction of a full export with its VOD and series entries. Only live
+        channels are returned.
+        """
+        portal = xtream_portal(self.clean_iptv_url(iptv_url))
+        if portal is None:
+            return None
+        base, username, password, extension = portal
+        host = self.host_key(base)
+        if self.xtream_unsupported.get(host):
+            return None
+        
+        log.debug("Using player_api.php", extra={'url': base})
+        account = self.fetch_xtream_api(base, username, password, revalidate)
+        if isinstance(account, dict) and isinstance(account.get('user_info'), dict):
+            if not account['user_info'].get('auth'):
+                log.warning("Xtream account rejected", extra={'url': base})
+                return []
+            categories = self.fetch_xtream_api(base, username, password, revalidate, action='get_live_categories')
+        else:
+            categories = None
+        if not isinstance(categories, list):
+            log.info("No usable player_api.php, falling back to the playlist", extra={'url': base})
+            self.xtream_unsupported.set(host, True)
+            return None
+        
+        keyword = filter_keyword.lower()
+        category_names = {str(category.get('category_id')): str(category.get('category_name') or '')
+                          for category in categories if isinstance(category, dict)}
+        if filter_field == 'group':
+            pages = [self.fetch_xtream_api(base, username, password, revalidate, action='get_live_streams',
+                                           category_id=category_id)
+                     for category_id, name in category_names.items() if keyword in name.lower()]
+        else:
+            pages = [self.fetch_xtream_api(base, username, password, revalidate, action='get_live_streams')]
+        if any(not isinstance(page, list) for page in pages):
+            return None
+        
+        credentials = f"{urllib.parse.quote(username, safe='')}/{urllib.parse.quote(password, safe='')}"
+        streams = []
+        for entry in itertools.chain.from_iterable(pages):
+            if not isinstance(entry, dict) or entry.get('stream_id') is None:
+                continue
+            record = self._xtream_record(entry, category_names, f"{base}/live/{credentials}", extension, len(streams))
+            if record.matches(keyword, filter_field):
+                streams.append(record)
+        log.debug("player_api.php: %d matching live streams", len(streams), extra={'url': base})
+        return streams
+
+    @staticmethod
+    def _xtream_record(entry, category_names, live_base, extension, index):
+        """StreamRecord for one get_live_streams entry, with the #EXTINF line a get.php export would carry"""
+        def attribute(value):
+            return str(value or '').replace('"', "'")
+        
+        name = str(entry.get('name') or '').strip() or f"Channel {index + 1}"
+        group = category_names.get(str(entry.get('category_id')), '')
+        extinf = (f'#EXTINF:-1 tvg-id="{attribute(entry.get("epg_channel_id"))}" tvg-name="{attribute(name)}" '
+                  f'tvg-logo="{attribute(entry.get("stream_icon"))}" group-title="{attribute(group)}",{name}')
+        return StreamRecord(name, f"{live_base}/{entry['stream_id']}.{extension}", group, extinf)
+
+    def page_portals(self, url, content, recrawl=False):
+        """extract_iptv_urls for a fetched page, skipped when recrawling a page that hasn't changed"""
+        if recrawl:
+            return self.fingerprints.reuse(('page', url), content, self.parse_page, content)
+        return self.parse_page(content)
+
+    def parse_page(self, content):
+        """extract_iptv_urls, run in the parse process pool for large pages"""
+        if not self.parse_workers or len(content) < self.parse_offload_bytes:
+            return self.extract_iptv_urls(content)
+        executor = self._parse_pool()
+        if executor is not None:
+            try:
+                with metrics.timer('iptv_stage_seconds', stage='url_extraction'):
+                    urls = executor.submit(extract_page_urls, content).result()
+            except BrokenProcessPool as e:
+                self._discard_parse_pool(executor, e)
+            except (CancelledError, RuntimeError):
+                if self._parse_executor is executor:
+                    raise
+            else:
+                self.parse_pool_failures = 0
+                return urls
+        return self.extract_iptv_urls(content)
+
+    @staticmethod
+    def host_key(url):
+        """Return the lowercase host:port a URL points at (used for per-host limits)"""
+        try:
+            return urllib.parse.urlsplit(url.strip()).netloc.lower()
+        except ValueError:
+            return ''
+
+    @staticmethod
+    def site_key(url):
+        """Host of a URL without port or a leading www., so a site crawl stays on one site"""
+        host = urllib.parse.urlsplit(url).hostname or ''
+        return host[4:] if host.startswith('www.') else host
+
+    async def _crawl_site(self, start_url, max_depth, max_pages, executor, found, deadline_at=None, recrawl=False):
+        """
+        Crawl up to max_pages pages of start_url's site, max_depth links deep,
+        passing the IPTV URLs of each page to found() as soon as it is parsed.
+
+        The frontier is a priority queue that favours links whose URL or text
+        hints at portal lists or further pages. Pages are fetched page_concurrency
+        at a time, at most per_domain_pages per domain and page_delay apart, and
+        visited URLs are remembered in a Bloom filter so memory stays bounded.
+        """
+        loop = asyncio.get_running_loop()
+        site = self.site_key(start_url)
+        visited = BloomFilter(capacity=max(1000, max_pages * 100))
+        visited.add(start_url)
+        frontier = [(0, 0, start_url, 0)]  # (-score, tie-break, url, depth)
+        order = itertools.count(1)
+        domain_limits = {}
+        next_request_at = {}
+
+        async def crawl_page(url, depth):
+            domain = self.host_key(url)
+            if domain not in domain_limits:
+                domain_limits[domain] = asyncio.Semaphore(self.per_domain_pages)
+            async with domain_limits[domain]:
+                # Space requests to the same domain at least page_delay apart
+                now = loop.time()
+                start = max(now, next_request_at.get(domain, now))
+                next_request_at[domain] = start + self.page_delay
+                if start > now:
+                    await asyncio.sleep(start - now)
+                timeout = 30 if deadline_at is None else max(1, min(30, deadline_at - time.monotonic()))
+                content = await loop.run_in_executor(executor, self.fetch_webpage, url, timeout, recrawl)
+            if not content:
+                return
+            # Parsing stays off the loop, so one large page doesn't hold up every other fetch
+            found(await loop.run_in_executor(executor, self.page_portals, url, content, recrawl))
+            if depth >= max_depth:
+                return
+            for link, text, rel in await loop.run_in_executor(executor, self.site_links, content, url, site):
+                if visited.add(link):
+                    heapq.heappush(frontier, (depth - score_link(link, text, rel), next(order), link, depth + 1))
+
+        pages = 0
+        running = set()
+        while frontier or running:
+            while frontier and pages < max_pages and len(running) < self.page_concurrency:
+                _, _, url, depth = heapq.heappop(frontier)
+                pages += 1
+                running.add(asyncio.ensure_future(crawl_page(url, depth)))
+            if not running:
+                break
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    log.warning("Failed to crawl page: %s", task.exception())
+        log.info("Site crawl finished: %d pages fetched, %d links left in the frontier", pages, len(frontier))
+
+    def _fetch_pool(self):
+        """
+        The thread pool every crawl fetches portals and pages on: max_concurrency
+        threads in all, however many crawls run at once.
+        """
+        if self._fetch_executor is None:
+            with self._fetch_lock:
+                if self._fetch_executor is None:
+                    self._fetch_executor = ThreadPoolExecutor(max_workers=max(1, self.max_concurrency),
+                                                              thread_name_prefix='fetch')
+        return self._fetch_executor
+
+    async def _crawl_portals(self, iptv_urls, filter_keyword=None, filter_field=None, progress=None, deadline_at=None,
+                             site=None, recrawl=False):
+        """
+        Fetch every portal playlist, up to max_concurrency at a time and
+        per_host_concurrency per host.
+
+        The fetches are blocking requests calls on the crawler's shared fetch
+        pool (see _fetch_pool); the event loop here only schedules them and
+        holds the limits, so threads are bounded across crawls, not per crawl.
+        With site=(start_url, max_depth, max_pages) the site is crawled at the
+        same time and the portals on each page join the queue as it is parsed.
+        Once deadline_at (a time.monotonic() value) passes, portals still queued
+        are cancelled and fetches in flight are abandoned, along with the rest
+        of the site crawl. Returns (streams, the portals that didn't finish,
+        whether the deadline cut anything short).
+
+        Streams come back grouped by portal in the order the portals were
+        listed (portals found by a site crawl follow, sorted by URL), not in
+        the order the fetches happened to finish, so the same sources give the
+        same result and the same ETag from one crawl to the next.
+        """
+        loop = asyncio.get_running_loop()
+        global_limit = asyncio.Semaphore(self.max_concurrency)
+        host_limits = {}
+        portal_streams = {}  # portal URL -> its streams
+        executor = self._fetch_pool()
+        tasks = {}  # portal URL -> task
+        finished = asyncio.Event()
+        site_task = None
+
+        def check_finished():
+            if all(task.done() for task in tasks.values()) and (site_task is None or site_task.done()):
+                finished.set()
+
+        def schedule(urls):
+            new_urls = [url for url in urls if url not in tasks]
+            for url in new_urls:
+                tasks[url] = asyncio.ensure_future(crawl_portal(url))
+                tasks[url].add_done_callback(lambda task: check_finished())
+            if new_urls and progress:
+                progress.portals_found(len(tasks))
+
+        async def crawl_portal(iptv_url):
+            host = self.host_key(iptv_url)
+            if host not in host_limits:
+                host_limits[host] = asyncio.Semaphore(self.per_host_concurrency)
+            # Take the host slot first so a busy host doesn't hold global slots while it waits
+            async with host_limits[host]:
+                async with global_limit:
+                    try:
+                        streams = await loop.run_in_executor(
+                            executor, self.fetch_portal_streams, iptv_url, filter_keyword, filter_field, recrawl)
+                    except Exception as e:
+                        log.warning("Failed to process portal: %s", e, extra={'url': iptv_url})
+                        if progress:
+                            progress.portal_done(iptv_url, [], error=str(e))
+                        return
+            if progress:
+                progress.portal_done(iptv_url, streams or [], error=None if streams is not None else 'No M3U playlist')
+            if streams:
+                portal_streams[iptv_url] = streams
+                log.debug("Added %d streams", len(streams), extra={'url': iptv_url})
+
+        schedule(iptv_urls)
+        if site:
+            start_url, max_depth, max_pages = site
+            site_task = asyncio.ensure_future(
+                self._crawl_site(start_url, max_depth, max_pages, executor, schedule, deadline_at, recrawl))
+            site_task.add_done_callback(lambda task: check_finished())
+        check_finished()
+        
+        timeout = None if deadline_at is None else max(0, deadline_at - time.monotonic())
+        try:
+            await asyncio.wait_for(finished.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        pending = [task for task in tasks.values() if not task.done()]
+        if site_task is not None and not site_task.done():
+            pending.append(site_task)
+        # Cancelling a task cancels its fetch if it is still queued on the pool; threads
+        # already fetching can't be interrupted and finish in the background
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        unfinished = [url for url, task in tasks.items() if task.cancelled()]
+        if unfinished:
+            log.warning("Deadline reached, %d portals did not finish", len(unfinished))
+        if site_task is not None and site_task.cancelled():
+            log.warning("Deadline reached before the site crawl finished")
+        # Site crawl discovery order depends on which pages answer first
+        listed = set(iptv_urls)
+        order = list(dict.fromkeys(iptv_urls)) + sorted(url for url in tasks if url not in listed)
+        all_streams = [stream for url in order for stream in portal_streams.get(url, ())]
+        return all_streams, unfinished, bool(pending)
+
+    def crawl_iptv_streams(self, url, filter_keyword=None, filter_field=None, progress=None, deadline=None,
+                           max_depth=0, max_pages=50, recrawl=False):
+        """
+        Main method to crawl IPTV streams from any URL
+
+        Returns a CrawlResult: the unique streams found. With deadline (seconds)
+        set, the crawl stops when it runs out, returning what it has so far with
+        timed_out set and the unfinished portals listed.
+
+        max_depth > 0 turns on site crawl mode: links on the page are followed up
+        to max_depth deep and max_pages pages in all, and portals found on every
+        page are fetched while the rest of the site is still being crawled.
 
-    def fetch_webpage(self, url):
-        """Fetch webpage content from any URL"""
+        recrawl skips parsing any page or playlist whose content fingerprint
+        matches the last crawl, and fills in the result's added / removed
+        streams relative to the previous recrawl of the same source.
+
+        progress, if given, is told how many portals were found
+        (progress.portals_found(count)) and about each portal as it finishes
+        (progress.portal_done(iptv_url, streams, error)).
+        """
+        deadline_at = time.monotonic() + deadline if deadline else None
+        baseline = ('crawl', url, filter_keyword, filter_field, max_depth, max_pages)
+        
+        def finish(result):
+            if recrawl:
+                result.added, result.removed = self.fingerprints.delta(baseline, result, partial=result.timed_out)
+                log.info("Recrawl: %d streams added, %d removed", len(result.added), len(result.removed))
+            return result
+        
         try:
-            print(f"Fetching webpage: {url}")
-            
-            # Clean the URL - remove any extra text after the URL (like dates, timestamps, etc.)
-            # Look for common patterns that indicate the URL ends
-            url_patterns = [
-                r'(https?://[^\s]+?get\.php\?[^\s]+?username=[^\s]+?password=[^\s]+?type=m3u[^\s]*)',  # Complete get.php URLs
-                r'(https?://[^\s]+?get\.php\?[^\s]+?password=[^\s]+?username=[^\s]+?type=m3u[^\s]*)',  # Complete get.php URLs (password first)
-                r'(https?://[^\s]+?get\.php\?[^\s]+?type=m3u[^\s]*)',  # get.php URLs with type=m3u
-                r'(https?://[^\s]+?get\.php\?[^\s]+?username=[^\s]+?password=[^\s]+)',  # get.php URLs with username/password
-                r'(https?://[^\s]+?get\.php\?[^\s]+?password=[^\s]+?username=[^\s]+)',  # get.php URLs with password/username
-                r'(https?://[^\s]+?\.(?:php|m3u|m3u8|mp4|ts))',  # URLs ending with common extensions
-            ]
-            
-            cleaned_url = url
-            for pattern in url_patterns:
-                match = re.search(pattern, url, re.IGNORECASE)
-                if match:
-                    cleaned_url = match.group(1)
-                    print(f"Cleaned URL from: {url}")
-                    print(f"Cleaned URL to: {cleaned_url}")
-                    break
-            
-            # Handle port issues - if HTTPS on port 80, change to HTTP
-            if cleaned_url.startswith('https://') and ':80/' in cleaned_url:
-                cleaned_url = cleaned_url.replace('https://', 'http://')
-                print(f"Fixed HTTPS on port 80, using: {cleaned_url}")
-            
-            # Handle URL encoding issues
-            if '%' in cleaned_url:
-                cleaned_url = urllib.parse.unquote(cleaned_url)
-                print(f"Decoded URL: {cleaned_url}")
+            log.info("Starting crawl", extra={'url': url})
             
-            # Try different approaches to handle various websites
-            response = None
+            # Check if the input URL is already an IPTV URL (get.php with username/password)
+            if 'get.php' in url and ('username=' in url and 'password=' in url):
+                log.debug("Input URL appears to be an IPTV URL, fetching directly")
+                iptv_urls = [url]
+            elif max_depth > 0:
+                log.info("Crawling site up to %d links deep (%d pages at most)", max_depth, max_pages)
+                iptv_urls = []
+            else:
+                # Step 1: Fetch webpage content
+                timeout = 30 if deadline_at is None else max(1, min(30, deadline_at - time.monotonic()))
+                content = self.fetch_webpage(url, timeout=timeout, revalidate=recrawl)
+                if not content:
+                    return CrawlResult(timed_out=deadline_at is not None and time.monotonic() >= deadline_at)
+                
+                # The URL may be a playlist itself rather than a page listing portals
+                if self.is_m3u_content(content):
+                    log.debug("URL is an M3U playlist, parsing it directly")
+                    if recrawl:
+                        streams = self.fingerprints.reuse(('playlist', url, filter_keyword, filter_field), content,
+                                                          self.parse_playlist, content, filter_keyword, filter_field)
+                    else:
+                        streams = self.parse_playlist(content, filter_keyword, filter_field)
+                    streams = self.deduplicate_streams(streams)
+                    if progress:
+                        progress.portals_found(1)
+                        progress.portal_done(url, streams)
+                    return finish(CrawlResult(streams))
+                
+                # Step 2: Extract IPTV URLs from webpage
+                iptv_urls = self.page_portals(url, content, recrawl)
+                if not iptv_urls:
+                    log.info("No IPTV URLs found on the webpage", extra={'url': url})
+                    return finish(CrawlResult())
             
-            # Multiple header strategies to bypass blocking
-            header_strategies = [
-                {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                    'Accept-Language': 'en-US,en;q=0.5',
-                    'Accept-Encoding': 'gzip, deflate',
-                    'Connection': 'keep-alive',
-                    'Upgrade-Insecure-Requests': '1',
-                },
-                {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                    'Accept': '*/*',
-                    'Accept-Encoding': 'gzip, deflate',
-                    'Connection': 'keep-alive'
-                },
-                {
-                    'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                    'Accept-Language': 'en-US,en;q=0.5',
-                }
-            ]
+            if progress:
+                progress.portals_found(len(iptv_urls))
             
-            for i, headers in enumerate(header_strategies):
-                try:
-                    print(f"Trying strategy {i+1}...")
-                    response = requests.get(cleaned_url, timeout=30, verify=False, allow_redirects=True, headers=headers)
-                    response.raise_for_status()
-                    print(f"Success with strategy {i+1}")
-                    break
-                except requests.exceptions.SSLError:
-                    print(f"SSL Error with strategy {i+1}, trying HTTP...")
-                    if cleaned_url.startswith('https://'):
-                        http_url = cleaned_url.replace('https://', 'http://')
-                        response = requests.get(http_url, timeout=30, verify=False, allow_redirects=True, headers=headers)
-                        response.raise_for_status()
-                        print(f"Success with HTTP and strategy {i+1}")
-                        break
-                    else:
-                        continue
-                except requests.exceptions.RequestException as e:
-                    print(f"Request error with strategy {i+1}: {str(e)}")
-                    continue
+            # Step 3: Fetch M3U playlists from each IPTV URL
+            site = (url, max_depth, max_pages) if max_depth > 0 and not iptv_urls else None
+            all_streams, unfinished, timed_out = asyncio.run(
+                self._crawl_portals(iptv_urls, filter_keyword, filter_field, progress, deadline_at, site, recrawl))
             
-            if response is None:
-                raise Exception("All request strategies failed")
+            # Step 4: Remove duplicates
+            unique_streams = self.deduplicate_streams(all_streams)
             
-            return response.text
+            log.info("Total unique streams found: %d", len(unique_streams), extra={'url': url})
+            return finish(CrawlResult(unique_streams, unfinished, timed_out=timed_out))
             
         except Exception as e:
-            print(f"Error fetching webpage: {str(e)}")
+            log.error("Error during crawl: %s", e, extra={'url': url})
+            return CrawlResult()
+
+
+class StreamProber:
+    """
+    Checks whether stream URLs are playable, many at a time.
+
+    Each probe is a single small ranged GET (servers that ignore Range are cut
+    off after probe_bytes). HLS playlists are followed down to their first
+    media segment, which must also answer. Verdicts are cached for cache_ttl
+    seconds so repeated checks of the same channel list are free. Every batch
+    probes on one shared pool of max_concurrency threads.
+    """
+
+    STREAM_HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Accept': '*/*',
+        'Connection': 'keep-alive',
+    }
+    HLS_CONTENT_TYPES = ('mpegurl', 'x-mpegurl')
+    MAX_PLAYLIST_BYTES = 512 * 1024
+
+    def __init__(self, transport, max_concurrency=500, per_host_concurrency=16, timeout=5,
+                 probe_bytes=2048, cache_ttl=60, max_cached=100000):
+        self.transport = transport
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.timeout = timeout
+        self.probe_bytes = probe_bytes
+        self.verdicts = TTLCache(max_size=max_cached, ttl=cache_ttl)
+        self.probes = 0
+        self._lock = threading.Lock()
+        self._probe_executor = None
+
+    def _probe_pool(self):
+        """The thread pool every batch probes on, created on first use"""
+        if self._probe_executor is None:
+            with self._lock:
+                if self._probe_executor is None:
+                    self._probe_executor = ThreadPoolExecutor(max_workers=max(1, self.max_concurrency),
+                                                              thread_name_prefix='probe')
+        return self._probe_executor
+
+    def close(self):
+        """Stop the probe pool, dropping probes that haven't started"""
+        with self._lock:
+            executor, self._probe_executor = self._probe_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def validate(self, url):
+        """Probe one URL (or return its cached verdict)"""
+        verdict = self.verdicts.get(url)
+        if verdict is None:
+            verdict = self._probe(url)
+            self.verdicts.set(url, verdict)
+        return verdict
+
+    def validate_many(self, urls):
+        """Probe a batch of URLs concurrently; returns {url: verdict}"""
+        results = {}
+        pending = []
+        for url in dict.fromkeys(urls):
+            verdict = self.verdicts.get(url)
+            if verdict is None:
+                pending.append(url)
+            else:
+                results[url] = verdict
+        if pending:
+            results.update(asyncio.run(self._probe_all(pending)))
+        return results
+
+    async def _probe_all(self, urls):
+        loop = asyncio.get_running_loop()
+        host_limits = collections.defaultdict(lambda: asyncio.Semaphore(self.per_host_concurrency))
+        executor = self._probe_pool()
+
+        async def probe(url):
+            async with host_limits[IPTVCrawler.host_key(url)]:
+                return url, await loop.run_in_executor(executor, self.validate, url)
+
+        return dict(await asyncio.gather(*(probe(url) for url in urls)))
+
+    def _probe(self, url):
+        start = time.perf_counter()
+        verdict = {'status': 'broken', 'content_type': None, 'http_status': None, 'error': None}
+        try:
+            http_status, content_type, body = self._fetch_head_bytes(url)
+            verdict['http_status'] = http_status
+            verdict['content_type'] = content_type
+            if http_status not in (200, 206):
+                verdict['error'] = f'HTTP {http_status}'
+            elif self._looks_like_hls(url, content_type, body):
+                verdict['hls'] = True
+                error = self._check_hls(url, body)
+                if error:
+                    verdict['error'] = error
+                else:
+                    verdict['status'] = 'working'
+            else:
+                verdict['status'] = 'working'
+        except requests.exceptions.RequestException as e:
+            verdict['error'] = type(e).__name__
+        except Exception as e:
+            verdict['error'] = str(e)
+        verdict['response_time'] = round(time.perf_counter() - start, 3)
+        return verdict
+
+    def _fetch_head_bytes(self, url, limit=None):
+        """Ranged GET for the first bytes of url; returns (status, content type, body bytes)"""
+        limit = limit or self.probe_bytes
+        headers = dict(self.STREAM_HEADERS, Range=f'bytes=0-{limit - 1}')
+        with self._lock:
+            self.probes += 1
+        # Streams behind self-signed or expired certificates still play, as they do for fetches
+        response = self.transport.get(url, headers=headers, timeout=self.timeout, stream=True, allow_redirects=True,
+                                      verify=False)
+        try:
+            body = b''
+            if response.status_code in (200, 206):
+                for chunk in response.iter_content(chunk_size=min(limit, 65536)):
+                    body += chunk
+                    if len(body) >= limit:
+                        break
+            return response.status_code, response.headers.get('Content-Type'), body[:limit]
+        finally:
+            response.close()
+
+    def _looks_like_hls(self, url, content_type, body):
+        content_type = (content_type or '').lower()
+        if any(kind in content_type for kind in self.HLS_CONTENT_TYPES):
+            return True
+        if urllib.parse.urlsplit(url).path.lower().endswith('.m3u8'):
+            return True
+        return body.lstrip()[:7] == b'#EXTM3U' and b'#EXT-X-' in body
+
+    def _check_hls(self, url, body):
+        """Follow a master or media playlist to its first segment; returns an error string or None"""
+        for _ in range(3):  # master -> media -> segment, with one spare hop
+            if len(body) >= self.probe_bytes:
+                # The probe only read the start of the playlist, fetch enough of it to find a URI
+                _, _, body = self._fetch_head_bytes(url, limit=self.MAX_PLAYLIST_BYTES)
+            text = body.decode('utf-8', errors='replace')
+            if not text.lstrip().startswith('#EXTM3U'):
+                return 'Invalid HLS playlist'
+            uri = self._first_playlist_uri(text)
+            if uri is None:
+                return 'Empty HLS playlist'
+            uri = urllib.parse.urljoin(url, uri)
+            http_status, content_type, segment = self._fetch_head_bytes(uri)
+            if http_status not in (200, 206):
+                return f'HLS segment HTTP {http_status}'
+            if '#EXT-X-STREAM-INF' not in text:
+                return None
+            # A master playlist: the URI was a variant playlist, so descend into it
+            url, body = uri, segment
+        return 'HLS playlist nesting too deep'
+
+    @staticmethod
+    def _first_playlist_uri(text):
+        for line in text.splitlines():
+            line = line.strip()
+            if line and not line.startswith('#'):
+                return line
+        return None
+
+    def stats(self):
+        return {'probes': self.probes, 'cached_verdicts': len(self.verdicts)}
+
+
+class CachedSegment:
+    """A media segment (or playlist) body held by SegmentCache"""
+
+    __slots__ = ('body', 'content_type', 'url', 'size')
+
+    def __init__(self, body, content_type, url=None):
+        self.body = body
+        self.content_type = content_type
+        self.url = url  # Where the body was finally fetched from, after redirects
+        self.size = len(body)
+
+
+class SegmentCache:
+    """
+    Size-bounded LRU of HLS segments shared by every viewer of the proxy.
+
+    Segments are immutable once published, so entries never need revalidating;
+    they simply age out after ttl seconds. With disk_dir set, segments evicted
+    from memory can still be served from a second on-disk tier.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=120, disk_dir=None, max_disk_bytes=2 * 1024 * 1024 * 1024):
+        self.ttl = ttl
+        self.memory = TTLCache(max_size=max_bytes, ttl=ttl, sizeof=lambda entry: entry.size)
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_budget = DiskCacheBudget(disk_dir, max_disk_bytes) if disk_dir else None
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, url):
+        entry = self.memory.get(url)
+        if entry is None and self.disk_dir:
+            entry = self._load_from_disk(url)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_served += entry.size
+        return entry
+
+    def set(self, url, entry):
+        self.memory.set(url, entry)
+        if self.disk_dir:
+            self._save_to_disk(url, entry)
+
+    def _disk_path(self, url):
+        return os.path.join(self.disk_dir, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def _save_to_disk(self, url, entry):
+        path = self._disk_path(url)
+        meta = {'url': url, 'content_type': entry.content_type, 'expires': time.time() + self.ttl}
+        try:
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps(meta).encode('utf-8') + b'\n')
+                f.write(entry.body)
+                size = f.tell()
+            self.disk_budget.add(size - replace_file(tmp_path, path))
+        except OSError as e:
+            log.warning("Could not write segment cache entry: %s", e, extra={'url': url})
+
+    def _load_from_disk(self, url):
+        try:
+            with open(self._disk_path(url), 'rb') as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        remaining = meta.get('expires', 0) - time.time()
+        if meta.get('url') != url or remaining <= 0:
             return None
+        entry = CachedSegment(body, meta.get('content_type'))
+        self.memory.set(url, entry, remaining)
+        return entry
 
-    def extract_iptv_urls(self, content):
-        """Extract IPTV URLs from webpage content"""
-        iptv_urls = []
-        
-        # Parse HTML content
-        soup = BeautifulSoup(content, 'html.parser')
-        
-        # Get all text content
-        text_content = soup.get_text()
-        
-        # Patterns to match IPTV URLs (get.php URLs with username/password)
-        patterns = [
-            r'https?://[^\s<>"]*get\.php\?[^\s<>"]*username=[^\s<>"]*&password=[^\s<>"]*&type=m3u[^\s<>"]*',
-            r'https?://[^\s<>"]*get\.php\?[^\s<>"]*password=[^\s<>"]*&username=[^\s<>"]*&type=m3u[^\s<>"]*',
-            r'https?://[^\s<>"]*get\.php\?[^\s<>"]*type=m3u[^\s<>"]*',
-            r'https?://[^\s<>"]*:8080/get\.php\?[^\s<>"]*',
-            r'https?://[^\s<>"]*:80/get\.php\?[^\s<>"]*',
-            r'https?://[^\s<>"]*get\.php\?[^\s<>"]*',
-            r'https?://[^\s<>"]*:8080/[^\s<>"]*',
-            r'https?://[^\s<>"]*:80/[^\s<>"]*',
-            r'https?://[^\s<>"]*\?[^\s<>"]*username=[^\s<>"]*&password=[^\s<>"]*[^\s<>"]*',
-            r'https?://[^\s<>"]*\?[^\s<>"]*password=[^\s<>"]*&username=[^\s<>"]*[^\s<>"]*',
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, text_content, re.IGNORECASE)
-            iptv_urls.extend(matches)
-        
-        # Also look for URLs in href attributes
-        links = soup.find_all('a', href=True)
-        for link in links:
-            href = link['href']
-            if 'get.php' in href or ('username=' in href and 'password=' in href):
-                if href.startswith('http'):
-                    iptv_urls.append(href)
-        
-        # Look for URLs in script tags
-        scripts = soup.find_all('script')
-        for script in scripts:
-            if script.string:
-                script_text = script.string
-                for pattern in patterns:
-                    matches = re.findall(pattern, script_text, re.IGNORECASE)
-                    iptv_urls.extend(matches)
-        
-        # Remove duplicates and clean URLs
-        unique_urls = []
-        for url in iptv_urls:
-            url = url.strip()
-            # Remove any trailing characters that might be part of the URL
-            url = re.sub(r'[^\w\-\.:/?=&%]+$', '', url)
-            if url not in unique_urls and url.startswith('http'):
-                unique_urls.append(url)
-        
-        print(f"Found {len(unique_urls)} unique IPTV URLs")
-        return unique_urls
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'bytes_served': self.bytes_served,
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory.size,
+                'disk_bytes': self.disk_budget.size if self.disk_budget else None,
+            }
 
-    def fetch_m3u_playlist(self, iptv_url):
-        """Fetch M3U playlist from an IPTV URL"""
+
+class HLSProxy:
+    """
+    Serves HLS through /proxy-video so that upstream traffic scales with the
+    number of channels being watched rather than the number of viewers.
+
+    Playlists are rewritten so every variant, segment, key and map URI points
+    back at the proxy. Segments come from a shared SegmentCache, and concurrent
+    requests for the same segment or playlist share one upstream fetch. Live
+    playlists are reused for playlist_ttl seconds, short enough to keep up with
+    the live edge.
+    """
+
+    HLS_CONTENT_TYPES = ('mpegurl', 'x-mpegurl')
+    URI_ATTR_RE = re.compile(r'URI="([^"]*)"')
+
+    def __init__(self, transport, segment_cache=None, playlist_ttl=1, max_segment_bytes=64 * 1024 * 1024,
+                 max_playlist_bytes=4 * 1024 * 1024, timeout=30):
+        self.transport = transport
+        self.segments = segment_cache or SegmentCache()
+        self.playlists = TTLCache(max_size=64 * 1024 * 1024, ttl=playlist_ttl, sizeof=lambda entry: entry.size)
+        self.flights = SingleFlight()
+        self.max_segment_bytes = max_segment_bytes
+        self.max_playlist_bytes = max_playlist_bytes
+        self.timeout = timeout
+        self.upstream_fetches = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def is_playlist_url(cls, url):
+        return urllib.parse.urlsplit(url).path.lower().endswith('.m3u8')
+
+    @classmethod
+    def is_playlist_response(cls, content_type):
+        content_type = (content_type or '').lower()
+        return any(kind in content_type for kind in cls.HLS_CONTENT_TYPES)
+
+    def playlist(self, url, headers, proxy_url):
+        """Return the rewritten playlist at url as a CachedSegment, or None if upstream failed"""
+        entry = self.playlists.get(url)
+        if entry is None:
+            entry = self.flights.do(('playlist', url), self._fetch_playlist, url, headers)
+        if entry is None:
+            return None
+        body = self.rewrite_playlist(entry.body.decode('utf-8', errors='replace'), entry.url, proxy_url)
+        return CachedSegment(body.encode('utf-8'), 'application/vnd.apple.mpegurl')
+
+    def segment(self, url, headers):
+        """Return the segment at url as a CachedSegment, or None if it can't be cached"""
+        entry = self.segments.get(url)
+        if entry is None:
+            entry = self.flights.do(('segment', url), self._fetch_segment, url, headers)
+        return entry
+
+    def _fetch_playlist(self, url, headers):
+        # Another viewer may have filled the cache while we waited to lead the flight
+        entry = self.playlists.get(url)
+        if entry is not None:
+            return entry
+        body, content_type, final_url = self._fetch(url, headers, self.max_playlist_bytes)
+        if body is None:
+            return None
+        # Keep the post-redirect URL so relative URIs resolve against the right base
+        entry = CachedSegment(body, content_type, final_url)
+        self.playlists.set(url, entry)
+        return entry
+
+    def _fetch_segment(self, url, headers):
+        entry = self.segments.memory.get(url)
+        if entry is not None:
+            return entry
+        body, content_type, _ = self._fetch(url, headers, self.max_segment_bytes)
+        if body is None:
+            return None
+        entry = CachedSegment(body, content_type or 'video/mp2t')
+        self.segments.set(url, entry)
+        return entry
+
+    def _fetch(self, url, headers, limit):
+        """Download url whole; returns (body, content type, final url) or (None, None, None)"""
+        with self._lock:
+            self.upstream_fetches += 1
+        response = self.transport.get(url, headers=headers, stream=True, timeout=self.timeout, verify=False)
         try:
-            print(f"Fetching M3U from: {iptv_url}")
-            
-            # Clean the URL - remove any extra text after the URL (like dates, timestamps, etc.)
-            url_patterns = [
-                r'(https?://[^\s]+?get\.php\?[^\s]+?username=[^\s]+?password=[^\s]+?type=m3u[^\s]*)',  # Complete get.php URLs
-                r'(https?://[^\s]+?get\.php\?[^\s]+?password=[^\s]+?username=[^\s]+?type=m3u[^\s]*)',  # Complete get.php URLs (password first)
-                r'(https?://[^\s]+?get\.php\?[^\s]+?type=m3u[^\s]*)',  # get.php URLs with type=m3u
-                r'(https?://[^\s]+?get\.php\?[^\s]+?username=[^\s]+?password=[^\s]+)',  # get.php URLs with username/password
-                r'(https?://[^\s]+?get\.php\?[^\s]+?password=[^\s]+?username=[^\s]+)',  # get.php URLs with password/username
-                r'(https?://[^\s]+?\.(?:php|m3u|m3u8|mp4|ts))',  # URLs ending with common extensions
-            ]
-            
-            cleaned_url = iptv_url
-            for pattern in url_patterns:
-                match = re.search(pattern, iptv_url, re.IGNORECASE)
-                if match:
-                    cleaned_url = match.group(1)
-                    print(f"Cleaned IPTV URL from: {iptv_url}")
-                    print(f"Cleaned IPTV URL to: {cleaned_url}")
+            if response.status_code != 200:
+                log.warning("HLS upstream returned %d", response.status_code, extra={'url': url})
+                return None, None, None
+            if int(response.headers.get('Content-Length') or 0) > limit:
+                return None, None, None
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(chunk_size=256 * 1024):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > limit:
+                    return None, None, None
+            return b''.join(chunks), response.headers.get('Content-Type'), response.url
+        finally:
+            response.close()
+
+    def rewrite_playlist(self, text, base_url, proxy_url):
+        """Point every URI in an HLS playlist back at proxy_url"""
+        def proxied(uri, kind):
+            absolute = urllib.parse.urljoin(base_url, uri.strip())
+            return f"{proxy_url}?url={urllib.parse.quote(absolute, safe='')}&hls={kind}"
+
+        lines = []
+        # Lines after #EXT-X-STREAM-INF name variant playlists; everything else is a segment
+        next_kind = 'segment'
+        for line in text.splitlines():
+            stripped = line.strip()
+            if not stripped:
+                lines.append(line)
+            elif stripped.startswith('#'):
+                if stripped.startswith('#EXT-X-STREAM-INF'):
+                    next_kind = 'playlist'
+                if 'URI="' in stripped:
+                    kind = 'playlist' if stripped.startswith(('#EXT-X-MEDIA', '#EXT-X-I-FRAME-STREAM-INF')) else 'segment'
+                    stripped = self.URI_ATTR_RE.sub(lambda m: f'URI="{proxied(m.group(1), kind)}"', stripped)
+                lines.append(stripped)
+            else:
+                lines.append(proxied(stripped, next_kind))
+                next_kind = 'segment'
+        return '\n'.join(lines) + '\n'
+
+    def stats(self):
+        return {
+            'upstream_fetches': self.upstream_fetches,
+            'shared_fetches': self.flights.shared,
+            'playlists_cached': len(self.playlists),
+            'segments': self.segments.stats(),
+        }
+
+
+class StreamCatalog:
+    """
+    SQLite catalog of every stream the crawler has found, kept across restarts.
+
+    Streams are keyed by stream_dedup_key() and upserted in batched
+    transactions, refreshing URL, name, group and last_seen on conflict. Indexes on
+    name, group-title, source host and last-seen time let query() page through
+    a catalog of millions of rows with keyset pagination (id > cursor) rather
+    than OFFSET scans.
+    """
+
+    # PRAGMA user_version; 2: rows keyed by stream_dedup_key() instead of a digest of the raw URL
+    SCHEMA_VERSION = 2
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS streams (
+            id INTEGER PRIMARY KEY,
+            url_hash BLOB NOT NULL,
+            url TEXT NOT NULL,
+            name TEXT NOT NULL,
+            group_title TEXT NOT NULL DEFAULT '',
+            source_host TEXT NOT NULL DEFAULT '',
+            first_seen REAL NOT NULL,
+            last_seen REAL NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_streams_url_hash ON streams(url_hash);
+        CREATE INDEX IF NOT EXISTS idx_streams_name ON streams(name COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_streams_group ON streams(group_title COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_streams_source_host ON streams(source_host);
+        CREATE INDEX IF NOT EXISTS idx_streams_last_seen ON streams(last_seen);
+    """
+
+    UPSERT = """
+        INSERT INTO streams (url_hash, url, name, group_title, source_host, first_seen, last_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(url_hash) DO UPDATE SET
+            url = excluded.url,
+            name = excluded.name,
+            group_title = CASE WHEN excluded.group_title != '' THEN excluded.group_title ELSE group_title END,
+            source_host = excluded.source_host,
+            first_seen = MIN(first_seen, excluded.first_seen),
+            last_seen = excluded.last_seen
+    """
+
+    def __init__(self, path='iptv_catalog.db', batch_size=5000):
+        self.path = path
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self.streams = None  # Row count: counted when the catalog is opened, then kept up to date by upsert()
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        # Writes happen off the request path, one batch after another
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='catalog')
+        self._schema_ready = False
+
+    def _connection(self):
+        """
+        One connection per thread; WAL lets readers page while a crawl is being
+        written. The database file is only created on first use.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+            with self._write_lock:
+                if not self._schema_ready:
+                    self._migrate(connection)
+                    self.streams = connection.execute('SELECT COUNT(*) FROM streams').fetchone()[0]
+                    self._schema_ready = True
+        return connection
+
+    def _migrate(self, connection):
+        """Create the schema, re-keying the rows of a catalog written by an older version"""
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        exists = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'streams'").fetchone()
+        if exists and version < self.SCHEMA_VERSION:
+            self._rekey(connection)
+        connection.executescript(self.SCHEMA)
+        connection.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+
+    def _rekey(self, connection):
+        """
+        Rebuild the streams table under the current url_hash in one transaction.
+        Rows that now share a key are merged: the most recently seen row's URL,
+        name and group win, and the earliest first_seen is kept. Row ids change,
+        so query() cursors from before the migration start over.
+        """
+        started = time.perf_counter()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('ALTER TABLE streams RENAME TO streams_old')
+            # The indexes moved with the table; free their names for the new one
+            for (name,) in connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'streams_old' "
+                    "AND sql IS NOT NULL").fetchall():
+                connection.execute(f'DROP INDEX "{name}"')
+            for statement in self.SCHEMA.split(';'):
+                if statement.strip():
+                    connection.execute(statement)
+            rows = connection.execute(
+                'SELECT url, name, group_title, source_host, first_seen, last_seen FROM streams_old '
+                'ORDER BY last_seen, id')
+            migrated = 0
+            while True:
+                batch = rows.fetchmany(self.batch_size)
+                if not batch:
                     break
-            
-            # Handle URL encoding issues
-            if '%' in cleaned_url:
-                cleaned_url = urllib.parse.unquote(cleaned_url)
-                print(f"Decoded IPTV URL: {cleaned_url}")
-            
-            # Try different approaches for the IPTV URL
-            response = None
-            
-            # Multiple header strategies
-            header_strategies = [
-                {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                    'Accept': '*/*',
-                    'Accept-Encoding': 'gzip, deflate',
-                    'Connection': 'keep-alive'
-                },
-                {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                    'Accept': '*/*',
-                    'Accept-Encoding': 'gzip, deflate',
-                    'Connection': 'keep-alive'
-                },
-                {
-                    'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
-                    'Accept': '*/*',
-                }
-            ]
-            
-            for i, headers in enumerate(header_strategies):
+                connection.executemany(self.UPSERT, [(self.url_hash(row[0]), *row) for row in batch])
+                migrated += len(batch)
+            connection.execute('DROP TABLE streams_old')
+        kept = connection.execute('SELECT COUNT(*) FROM streams').fetchone()[0]
+        log.info("Catalog %s re-keyed to schema version %d: %d rows -> %d in %.1fs",
+                 self.path, self.SCHEMA_VERSION, migrated, kept, time.perf_counter() - started)
+
+    @staticmethod
+    def url_hash(url):
+        # Credential variants of one Xtream channel share a row
+        return stream_dedup_key(url)
+
+    def upsert(self, streams):
+        """Insert or refresh streams in batched transactions; returns the number of rows written"""
+        now = time.time()
+        rows = (
+            (self.url_hash(stream.url), stream.url, stream.name, getattr(stream, 'group_title', '') or '',
+             IPTVCrawler.host_key(stream.url), now, now)
+            for stream in streams
+        )
+        written = 0
+        connection = self._connection()
+        with self._write_lock:
+            while True:
+                batch = list(itertools.islice(rows, self.batch_size))
+                if not batch:
+                    break
+                with connection:
+                    # The ids past the last one before the batch are the rows it added
+                    connection.execute('BEGIN IMMEDIATE')
+                    last_id = connection.execute('SELECT MAX(id) FROM streams').fetchone()[0] or 0
+                    connection.executemany(self.UPSERT, batch)
+                    added = connection.execute('SELECT COUNT(*) FROM streams WHERE id > ?', (last_id,)).fetchone()[0]
+                self.streams += added
+                written += len(batch)
+            self.rows_written += written
+        return written
+
+    def upsert_async(self, streams):
+        """Queue streams for upserting without waiting for the write"""
+        future = self._writer.submit(self.upsert, list(streams))
+        future.add_done_callback(self._report_write_error)
+        return future
+
+    def close(self):
+        """Wait for queued writes to land; no more can be queued afterwards"""
+        self._writer.shutdown(wait=True)
+
+    @staticmethod
+    def _report_write_error(future):
+        if future.exception() is not None:
+            log.error("Catalog write failed: %s", future.exception())
+
+    def query(self, limit=100, after=0, name=None, group=None, host=None, seen_since=None):
+        """
+        One page of streams with id > after, in id order; returns (rows, next cursor or None).
+
+        name matches anywhere in the name and group matches the whole
+        group-title, both case-insensitively.
+        """
+        clauses = ['id > ?']
+        params = [after]
+        if name:
+            clauses.append("name LIKE ? ESCAPE '\\'")
+            params.append('%' + name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if group:
+            clauses.append('group_title = ? COLLATE NOCASE')
+            params.append(group)
+        if host:
+            clauses.append('source_host = ?')
+            params.append(host.lower())
+        if seen_since:
+            clauses.append('last_seen >= ?')
+            params.append(seen_since)
+        params.append(limit)
+        rows = self._connection().execute(
+            'SELECT id, name, url, group_title, source_host, first_seen, last_seen FROM streams '
+            f'WHERE {" AND ".join(clauses)} ORDER BY id LIMIT ?', params).fetchall()
+        rows = [dict(row) for row in rows]
+        next_cursor = rows[-1]['id'] if len(rows) == limit else None
+        return rows, next_cursor
+
+    def stats(self):
+        """
+        Counters that don't touch the database. streams is None until the
+        catalog is first used, then the count taken on opening plus the rows
+        this process has added (other workers' inserts show up on reopening).
+        """
+        return {
+            'path': self.path,
+            'streams': self.streams,
+            'rows_written': self.rows_written,
+        }
+
+
+class CrawlJob:
+    """A crawl running in the background: progress counters plus the streams found so far"""
+
+    MAX_ERRORS = 50  # Only the most recent errors are kept
+
+    def __init__(self, url, filter_keyword=None, filter_field=None, max_depth=0, max_pages=50):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.filter_keyword = filter_keyword
+        self.filter_field = filter_field
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.status = 'queued'  # queued -> running -> done | failed
+        self.portals_total = 0
+        self.portals_done = 0
+        self.error_count = 0
+        self.errors = collections.deque(maxlen=self.MAX_ERRORS)
+        self.streams = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._seen_keys = set()
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    # Progress hooks called by IPTVCrawler.crawl_iptv_streams
+
+    def portals_found(self, count):
+        with self._changed:
+            self.portals_total = count
+            self._changed.notify_all()
+
+    def portal_done(self, iptv_url, streams, error=None):
+        with self._changed:
+            self.portals_done += 1
+            if error:
+                self.error_count += 1
+                self.errors.append({'portal': iptv_url, 'error': error})
+            self._add_streams(streams)
+            self._changed.notify_all()
+
+    def _add_streams(self, streams):
+        # Append-only, so the offsets readers page through stay valid
+        for stream in streams:
+            key = stream_dedup_key(stream.url)
+            if key not in self._seen_keys:
+                self._seen_keys.add(key)
+                self.streams.append(stream)
+
+    def start(self):
+        with self._changed:
+            self.status = 'running'
+            self.started_at = time.time()
+            self._changed.notify_all()
+
+    def finish(self, streams=None, error=None):
+        with self._changed:
+            if streams is not None:
+                # The final result is in portal order, not the order portals finished in;
+                # keep the order readers have already seen and add anything they haven't
+                self._add_streams(streams)
+            if error:
+                self.error_count += 1
+                self.errors.append({'portal': None, 'error': error})
+            self.status = 'failed' if error else 'done'
+            self.finished_at = time.time()
+            self._changed.notify_all()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; returns whether it did"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.finished, timeout)
+
+    def wait_for_streams(self, offset, timeout):
+        """Block until there are streams past offset or the job finishes; returns (new streams, finished)"""
+        with self._changed:
+            if len(self.streams) <= offset and not self.finished:
+                self._changed.wait(timeout)
+            return self.streams[offset:], self.finished
+
+    def to_dict(self):
+        with self._changed:
+            end = self.finished_at or time.time()
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'source_url': self.url,
+                'max_depth': self.max_depth,
+                'filter_applied': self.filter_keyword,
+                'portals_total': self.portals_total,
+                'portals_done': self.portals_done,
+                'streams_found': len(self.streams),
+                'errors': self.error_count,
+                'recent_errors': list(self.errors)[-5:],
+                'elapsed': round(end - (self.started_at or end), 3),
+            }
+
+
+class CrawlJobManager:
+    """Runs CrawlJobs on a bounded pool of background workers"""
+
+    def __init__(self, crawler, result_cache=None, max_workers=4, max_queued=100, max_jobs=500, catalog=None):
+        self.crawler = crawler
+        self.result_cache = result_cache
+        self.catalog = catalog
+        self.max_queued = max_queued
+        self.max_jobs = max_jobs
+        self.jobs = collections.OrderedDict()
+        self.closed = False
+        self._queued = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='crawl-job')
+        self._lock = threading.Lock()
+
+    def submit(self, url, filter_keyword=None, filter_field=None, max_depth=0, max_pages=50):
+        """Queue a crawl and return its job, or None when the queue is full or the manager is shut down"""
+        job = CrawlJob(url, filter_keyword, filter_field, max_depth, max_pages)
+        with self._lock:
+            if self.closed or self._queued >= self.max_queued:
+                return None
+            self._queued += 1
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _forget_old_jobs(self):
+        # Drop the oldest finished jobs once we hold more than max_jobs
+        excess = len(self.jobs) - self.max_jobs
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished][:max(excess, 0)]:
+            del self.jobs[job_id]
+
+    def shutdown(self, timeout=None):
+        """
+        Stop taking jobs, fail the ones still queued and wait up to timeout
+        seconds for running ones; returns True if they all finished.
+        """
+        with self._lock:
+            self.closed = True
+            unfinished = [job for job in self.jobs.values() if not job.finished]
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for job in unfinished:
+            if job.status == 'queued':
+                job.finish(error='Server shutting down')
+        return all(job.wait(None if deadline is None else max(0, deadline - time.monotonic())) for job in unfinished)
+
+    def _run(self, job):
+        with self._lock:
+            self._queued -= 1
+        if job.finished:
+            # Failed by shutdown() before a worker got to it
+            return
+        job.start()
+        key = crawl_key(job.url, job.filter_keyword, job.filter_field, job.max_depth, job.max_pages)
+        try:
+            cached = self.result_cache.get(key) if self.result_cache is not None else None
+            if cached is not None:
+                job.finish(cached)
+                return
+            streams = self.crawler.crawl_iptv_streams(job.url, job.filter_keyword, job.filter_field, progress=job,
+                                                      max_depth=job.max_depth, max_pages=job.max_pages)
+            if streams and self.result_cache is not None:
+                self.result_cache.set(key, streams)
+            if streams and self.catalog is not None:
+                self.catalog.upsert_async(streams)
+            job.finish(streams)
+        except Exception as e:
+            log.error("Crawl job failed: %s", e, extra={'job': job.id})
+            job.finish(error=str(e))
+
+
+class AdmissionGate:
+    """
+    Concurrency budget for one kind of request.
+
+    At most max_active requests hold a slot at once and at most max_queued
+    more wait for one, each for up to queue_timeout seconds. Anything past
+    that is turned away straight off, so a burst sheds load instead of
+    piling up threads and upstream fan-out. close() stops admitting (for a
+    graceful shutdown) and wait_idle() waits for the admitted to finish.
+    """
+
+    def __init__(self, name, max_active, max_queued=0, queue_timeout=0, retry_after=5):
+        self.name = name
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after  # Seconds suggested to turned-away clients
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.closed = False
+        self._changed = threading.Condition()
+
+    def acquire(self):
+        """Take a slot, queueing for one if there is room; returns False if the request should be turned away"""
+        with self._changed:
+            if not self.closed and self.active >= self.max_active and self.waiting < self.max_queued:
+                self.waiting += 1
                 try:
-                    print(f"Trying IPTV strategy {i+1}...")
-                    response = requests.get(cleaned_url, timeout=15, verify=False, allow_redirects=True, headers=headers)
-                    response.raise_for_status()
-                    print(f"Success with IPTV strategy {i+1}")
+                    self._changed.wait_for(lambda: self.closed or self.active < self.max_active, self.queue_timeout)
+                finally:
+                    self.waiting -= 1
+            if self.closed or self.active >= self.max_active:
+                self.rejected += 1
+                metrics.inc('iptv_admission_rejected_total', budget=self.name)
+                return False
+            self.active += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._changed:
+            self.active -= 1
+            self._changed.notify_all()
+
+    def close(self):
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Block until no request holds a slot; returns whether that happened within timeout"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.active == 0, timeout)
+
+    def stats(self):
+        with self._changed:
+            return {
+                'active': self.active,
+                'waiting': self.waiting,
+                'max_active': self.max_active,
+                'max_queued': self.max_queued,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'closed': self.closed,
+            }
+
+
+# Create global crawler instance
+crawler = IPTVCrawler()
+
+# Identical /crawl requests share one in-flight crawl, and finished results are
+# kept for a couple of minutes (bounded by the total number of streams held)
+CRAWL_RESULT_TTL = 120
+crawl_flights = SingleFlight()
+crawl_results = TTLCache(max_size=2000000, ttl=CRAWL_RESULT_TTL, sizeof=lambda streams: len(streams) + 1)
+
+# Every crawled stream is also written through to a persistent catalog served by
+# /streams; the file is created on the first write or query, not at import
+CATALOG_PATH = os.environ.get('IPTV_CATALOG_PATH', 'iptv_catalog.db')
+catalog = StreamCatalog(CATALOG_PATH)
+
+# Time budget for a /crawl request in seconds; the body may ask for up to MAX_CRAWL_DEADLINE
+CRAWL_DEADLINE = 60
+MAX_CRAWL_DEADLINE = 600
+
+# Limits on the optional site crawl mode ("max_depth" / "max_pages" in the body)
+MAX_SITE_DEPTH = 5
+MAX_SITE_PAGES = 1000
+
+
+def site_options(data):
+    """Read and validate max_depth / max_pages from a crawl request body; raises ValueError"""
+    try:
+        max_depth = int(data.get('max_depth') or 0)
+        max_pages = int(data.get('max_pages') or 50)
+    except (TypeError, ValueError):
+        raise ValueError('max_depth and max_pages must be integers')
+    if not 0 <= max_depth <= MAX_SITE_DEPTH or not 1 <= max_pages <= MAX_SITE_PAGES:
+        raise ValueError(f'max_depth must be 0-{MAX_SITE_DEPTH} and max_pages 1-{MAX_SITE_PAGES}')
+    return max_depth, max_pages
+
+
+def crawl_key(url, filter_keyword=None, filter_field=None, max_depth=0, max_pages=50):
+    """Cache key for a crawl: the canonical URL plus the options that change its result"""
+    url = canonical_url(url)
+    keyword = filter_keyword.strip().lower() if filter_keyword else None
+    site = (max_depth, max_pages) if max_depth > 0 else None
+    return (url, keyword or None, filter_field if keyword else None, site)
+
+
+def shared_crawl(url, filter_keyword=None, filter_field=None, refresh=False, deadline=None, max_depth=0, max_pages=50,
+                 recrawl=False):
+    """
+    Crawl through the result cache and single-flight group.
+
+    Returns (streams, source) where source is 'cache', 'shared' (joined a crawl
+    already in flight) or 'crawl'. Crawls cut short by their deadline are
+    returned but not cached. Recrawls always run (their delta is relative to
+    the previous recrawl) and only share with identical recrawls in flight.
+    """
+    key = crawl_key(url, filter_keyword, filter_field, max_depth, max_pages)
+    if not refresh and not recrawl:
+        streams = crawl_results.get(key)
+        if streams is not None:
+            return streams, 'cache'
+    
+    leader = []
+    
+    def crawl():
+        leader.append(True)
+        streams = crawler.crawl_iptv_streams(url, filter_keyword, filter_field, deadline=deadline,
+                                             max_depth=max_depth, max_pages=max_pages, recrawl=recrawl)
+        if streams and not streams.timed_out:
+            crawl_results.set(key, streams)
+        if streams:
+            catalog.upsert_async(streams)
+        return streams
+    
+    streams = crawl_flights.do(key + ('recrawl',) if recrawl else key, crawl)
+    return streams, 'crawl' if leader else 'shared'
+
+
+crawl_jobs = CrawlJobManager(crawler, result_cache=crawl_results, catalog=catalog)
+stream_prober = StreamProber(crawler.transport)
+hls_proxy = HLSProxy(crawler.transport)
+
+# Separate budgets, so long-lived proxied streams can't starve crawls or the
+# other way round. Crawls served from the result cache, or joining one already
+# in flight, don't need a crawl slot. Stream checks share the prober's thread
+# pool, so their budget only bounds how many batches wait on it.
+CRAWL_CONCURRENCY = 8
+CRAWL_QUEUE = 32
+CRAWL_QUEUE_TIMEOUT = 30
+PROXY_CONCURRENCY = 256
+PROXY_QUEUE = 64
+PROXY_QUEUE_TIMEOUT = 5
+VALIDATE_CONCURRENCY = 16
+VALIDATE_QUEUE = 32
+VALIDATE_QUEUE_TIMEOUT = 10
+crawl_gate = AdmissionGate('crawl', CRAWL_CONCURRENCY, CRAWL_QUEUE, CRAWL_QUEUE_TIMEOUT, retry_after=10)
+proxy_gate = AdmissionGate('proxy', PROXY_CONCURRENCY, PROXY_QUEUE, PROXY_QUEUE_TIMEOUT, retry_after=2)
+validate_gate = AdmissionGate('validate', VALIDATE_CONCURRENCY, VALIDATE_QUEUE, VALIDATE_QUEUE_TIMEOUT, retry_after=5)
+
+
+def overloaded_response(gate, error):
+    """429 with Retry-After for a full budget, or 503 once the server is draining"""
+    response = jsonify({'success': False, 'error': 'Server is shutting down' if gate.closed else error})
+    response.headers['Retry-After'] = str(gate.retry_after)
+    return response, 503 if gate.closed else 429
+
+
+def gated(gate, error, handler, *args):
+    """
+    Run handler(*args) within gate's budget, or answer with overloaded_response(gate, error).
+
+    The slot is held until the response has been sent (streamed bodies
+    included), not just until the handler returns. gate=None runs the
+    handler unmetered.
+    """
+    if gate is None:
+        return handler(*args)
+    if not gate.acquire():
+        return overloaded_response(gate, error)
+    try:
+        response = app.make_response(handler(*args))
+    except BaseException:
+        gate.release()
+        raise
+    if response.direct_passthrough:
+        # Werkzeug hands a passthrough body to the server as it is, without the response's close hooks
+        response.response = ClosingIterator(response.response, gate.release)
+    else:
+        response.call_on_close(gate.release)
+    return response
+
+
+# Array items per chunk of a streamed JSON response
+JSON_BATCH_SIZE = 2000
+# Content-Encodings a streamed response can use, preferred first. On a 100k
+# stream result gzip level 4 takes half the time of level 6 for ~9% more
+# bytes; brotli quality 5 beats both on size at about level 6's speed.
+RESPONSE_ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+GZIP_LEVEL = 4
+BROTLI_QUALITY = 5
+
+
+def iter_json(fields, batch_size=JSON_BATCH_SIZE):
+    """
+    Serialize a JSON object, given as (key, value) pairs, piece by piece.
+    Values that are iterators are written as arrays of batch_size items per
+    piece, so a large response is never built as one string.
+    """
+    dumps = functools.partial(json.dumps, ensure_ascii=False, separators=(',', ':'))
+    opening = '{'
+    for key, value in fields:
+        if not hasattr(value, '__next__'):
+            yield opening + dumps(key) + ':' + dumps(value)
+        else:
+            yield opening + dumps(key) + ':['
+            comma = ''
+            while True:
+                batch = list(itertools.islice(value, batch_size))
+                if not batch:
                     break
-                except requests.exceptions.SSLError:
-                    print(f"SSL Error with IPTV strategy {i+1}, trying HTTP...")
-                    if cleaned_url.startswith('https://'):
-                        http_url = cleaned_url.replace('https://', 'http://')
-                        response = requests.get(http_url, timeout=15, verify=False, allow_redirects=True, headers=headers)
-                        response.raise_for_status()
-                        print(f"Success with HTTP and IPTV strategy {i+1}")
-                        break
-                    else:
-                        continue
-                except requests.exceptions.RequestException as e:
-                    print(f"Request error with IPTV strategy {i+1}: {str(e)}")
-                    continue
-            
-            if response is None:
-                print("All IPTV request strategies failed")
-                return None
-            
-            content = response.text
-            print(f"M3U content length: {len(content)}")
-            
-            # Verify it's M3U content
-            if self.is_m3u_content(content):
-                return content
-            else:
-                print(f"Content from {cleaned_url} is not M3U format")
-                return None
-                
-        except Exception as e:
-            print(f"Error fetching M3U from {iptv_url}: {str(e)}")
-            return None
+                yield comma + dumps(batch)[1:-1]
+                comma = ','
+            yield ']'
+        opening = ','
+    yield '}' if opening == ',' else '{}'
 
-    def is_m3u_content(self, content):
-        """Check if content is M3U format"""
-        lines = content.split('\n')
-        for line in lines[:10]:  # Check first 10 lines
-            if line.strip().startswith('#EXTM3U') or line.strip().startswith('#EXTINF:'):
-                return True
-        return False
 
-    def extract_streams_from_m3u(self, content, filter_keyword=None):
-        """Extract stream URLs and names from M3U content"""
-        streams = []
-        lines = content.split('\n')
-        
-        current_name = None
-        
-        for i, line in enumerate(lines):
-            line = line.strip()
-            
-            # Skip empty lines
-            if not line:
-                continue
-                
-            # Check for channel name (lines starting with #EXTINF)
-            if line.startswith('#EXTINF:'):
-                # Extract name from #EXTINF line
-                name_match = re.search(r'tvg-name="([^"]*)"', line)
-                if name_match:
-                    current_name = name_match.group(1)
-                else:
-                    # Try to extract name from the end of the line
-                    parts = line.split(',')
-                    if len(parts) > 1:
-                        current_name = parts[-1].strip()
-                    else:
-                        current_name = f"Channel {len(streams) + 1}"
-                continue
-                
-            # Check if line contains a URL
-            if line.startswith('http'):
-                # Apply filter if specified
-                if filter_keyword:
-                    # Check if any line before this URL contains the filter text
-                    check_lines = lines[max(0, i-5):i]
-                    if not any(filter_keyword.lower() in check_line.lower() for check_line in check_lines):
-                        continue
-                
-                # Use current name or generate one
-                if not current_name:
-                    current_name = f"Channel {len(streams) + 1}"
-                
-                streams.append((current_name, line))
-                current_name = None  # Reset for next stream
-        
-        return streams
+def compress_chunks(chunks, encoding=None):
+    """UTF-8 encode str chunks, compressing them for Content-Encoding 'br' or 'gzip' (None = as they are)"""
+    if encoding is None:
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+        return
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip framing
+        compress, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield finish()
 
-    def deduplicate_streams(self, streams):
-        """Remove duplicate streams based on URL"""
-        seen_urls = set()
-        unique_streams = []
-        
-        for name, url in streams:
-            if url not in seen_urls:
-                seen_urls.add(url)
-                unique_streams.append((name, url))
-        
-        return unique_streams
 
-    def crawl_iptv_streams(self, url, filter_keyword=None):
-        """Main method to crawl IPTV streams from any URL"""
-        try:
-            print(f"Starting crawl for URL: {url}")
-            
-            # Check if the input URL is already an IPTV URL (get.php with username/password)
-            if 'get.php' in url and ('username=' in url and 'password=' in url):
-                print("Input URL appears to be an IPTV URL, fetching directly...")
-                m3u_content = self.fetch_m3u_playlist(url)
-                if m3u_content:
-                    streams = self.extract_streams_from_m3u(m3u_content, filter_keyword)
-                    unique_streams = self.deduplicate_streams(streams)
-                    print(f"Total unique streams found: {len(unique_streams)}")
-                    return unique_streams
-                else:
-                    print("Failed to fetch M3U content from IPTV URL")
-                    return []
-            
-            # Step 1: Fetch webpage content
-            content = self.fetch_webpage(url)
-            if not content:
-                return []
-            
-            # Step 2: Extract IPTV URLs from webpage
-            iptv_urls = self.extract_iptv_urls(content)
-            if not iptv_urls:
-                print("No IPTV URLs found on the webpage")
-                return []
-            
-            # Step 3: Fetch M3U playlists from each IPTV URL
-            all_streams = []
-            
-            # Use ThreadPoolExecutor to fetch multiple playlists in parallel
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                # Submit all fetch tasks
-                future_to_url = {executor.submit(self.fetch_m3u_playlist, iptv_url): iptv_url for iptv_url in iptv_urls}
-                
-                # Collect results as they complete
-                for future in as_completed(future_to_url):
-                    iptv_url = future_to_url[future]
-                    try:
-                        m3u_content = future.result()
-                        if m3u_content:
-                            streams = self.extract_streams_from_m3u(m3u_content, filter_keyword)
-                            all_streams.extend(streams)
-                            print(f"Added {len(streams)} streams from {iptv_url}")
-                    except Exception as e:
-                        print(f"Failed to process {iptv_url}: {str(e)}")
-                        continue
-            
-            # Step 4: Remove duplicates
-            unique_streams = self.deduplicate_streams(all_streams)
-            
-            print(f"Total unique streams found: {len(unique_streams)}")
-            return unique_streams
-            
-        except Exception as e:
-            print(f"Error during crawl: {str(e)}")
-            return []
+def timed_chunks(chunks, stage):
+    """Pass chunks through, then observe the time spent producing them (not sending them) as stage"""
+    elapsed = 0.0
+    chunks = iter(chunks)
+    try:
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            elapsed += time.perf_counter() - start
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        metrics.observe('iptv_stage_seconds', elapsed, stage=stage)
+
+
+def streamed_json(fields, etag=None):
+    """
+    A response that serializes fields with iter_json while it is sent,
+    compressed as the request's Accept-Encoding allows, with a weak ETag
+    when one is given.
+    """
+    encoding = request.accept_encodings.best_match(RESPONSE_ENCODINGS)
+    body = timed_chunks(compress_chunks(iter_json(fields), encoding), 'serialization')
+    response = app.response_class(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.content_encoding = encoding
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def columnar_fields(streams):
+    """
+    The streams of a "format": "columnar" response, as iter_json fields.
+
+    Each URL is split after its last '/': the part up to there goes into
+    the url_prefixes dictionary (one entry per portal account for Xtream
+    links) and urls keeps the rest, so stream i's URL is
+    url_prefixes[url_prefix[i]] + urls[i]. Groups are dictionary-encoded
+    the same way: groups[group[i]].
+    """
+    prefixes, groups = {}, {}
+    prefix_ids, group_ids, rests = [], [], []
+    for stream in streams:
+        url = stream.url
+        cut = url.rfind('/') + 1
+        prefix_ids.append(prefixes.setdefault(url[:cut], len(prefixes)))
+        rests.append(url[cut:])
+        group_ids.append(groups.setdefault(stream.group_title, len(groups)))
+    return [
+        ('names', (stream.name for stream in streams)),
+        ('url_prefixes', iter(prefixes)),
+        ('url_prefix', iter(prefix_ids)),
+        ('urls', iter(rests)),
+        ('groups', iter(groups)),
+        ('group', iter(group_ids)),
+    ]
 
-# Create global crawler instance
-crawler = IPTVCrawler()
 
 @app.route('/crawl', methods=['POST'])
 def crawl_endpoint():
@@ -419,19 +3746,37 @@ def crawl_endpoint():
     Expected JSON body:
     {
         "url": "https://example.com",
-        "filter": "sports"  // optional
+        "filter": "sports",  // optional
+        "filter_field": "group",  // optional: match the filter on "name" or "group" only
+        "refresh": false,  // optional: ignore results cached from an identical recent crawl
+        "deadline": 30,  // optional: time budget in seconds (server default CRAWL_DEADLINE)
+        "max_depth": 2,  // optional: follow links this deep into the site (default 0, this page only)
+        "max_pages": 50,  // optional: stop the site crawl after this many pages
+        "recrawl": false,  // optional: only parse what changed and return added/removed streams
+        "category": "Sports",  // optional: only return the streams in this category
+        "format": "json"  // optional: "columnar" for parallel arrays with dictionary-encoded URLs
     }
     
     Returns:
     {
         "success": true,
         "streams": [
-            {"name": "Channel Name", "url": "https://stream.m3u8"},
+            {"name": "Channel Name", "url": "https://stream.m3u8", "group": "Sports"},
             ...
         ],
+        "categories": {"Sports": 4, "News": 6},  // streams per category, over the whole result
+        "category_index": {"Sports": [0, 2, 5, 9], ...},  // positions in streams (left out with "category")
         "total_streams": 10,
-        "source_url": "https://example.com"
+        "source_url": "https://example.com",
+        "cached": false,  // true when served from a recent or in-flight identical crawl
+        "partial": false,  // true when the deadline cut the crawl short
+        "unfinished_portals": []  // portals that hadn't answered by the deadline
     }
+    
+    With "format": "columnar", "streams" is replaced by the arrays described
+    in columnar_fields(). Bodies are streamed, gzip- or brotli-compressed per
+    Accept-Encoding, and carry a weak ETag; a request whose If-None-Match
+    matches gets an empty 304 instead.
     """
     try:
         # Check content type
@@ -453,35 +3798,49 @@ def crawl_endpoint():
         
         url = data['url']
         filter_keyword = data.get('filter')
+        filter_field = data.get('filter_field')
+        if filter_field not in (None, 'name', 'group'):
+            return jsonify({
+                'success': False,
+                'error': 'filter_field must be "name" or "group"'
+            }), 400
         
-        print(f"Received crawl request for URL: {url}")
-        if filter_keyword:
-            print(f"Filter keyword: {filter_keyword}")
+        try:
+            deadline = float(data.get('deadline') or CRAWL_DEADLINE)
+        except (TypeError, ValueError):
+            deadline = 0
+        if not 0 < deadline <= MAX_CRAWL_DEADLINE:
+            return jsonify({
+                'success': False,
+                'error': f'deadline must be a number of seconds between 0 and {MAX_CRAWL_DEADLINE}'
+            }), 400
         
-        # Crawl IPTV streams
-        streams = crawler.crawl_iptv_streams(url, filter_keyword)
+        try:
+            max_depth, max_pages = site_options(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        if not streams:
+        category = data.get('category')
+        if category is not None and not isinstance(category, str):
             return jsonify({
                 'success': False,
-                'error': 'No IPTV streams found at the provided URL'
-            }), 404
-        
-        # Convert to JSON format
-        streams_json = []
-        for name, stream_url in streams:
-            streams_json.append({
-                'name': name,
-                'url': stream_url
-            })
+                'error': 'category must be a string'
+            }), 400
         
-        return jsonify({
-            'success': True,
-            'streams': streams_json,
-            'total_streams': len(streams),
-            'source_url': url,
-            'filter_applied': filter_keyword
-        })
+        response_format = data.get('format') or 'json'
+        if response_format not in ('json', 'columnar'):
+            return jsonify({
+                'success': False,
+                'error': 'format must be "json" or "columnar"'
+            }), 400
+        
+        # Cache hits and requests joining a crawl already in flight cost no upstream traffic
+        refresh, recrawl = bool(data.get('refresh')), bool(data.get('recrawl'))
+        key = crawl_key(url, filter_keyword, filter_field, max_depth, max_pages)
+        metered = refresh or recrawl or (crawl_results.get(key) is None and not crawl_flights.in_flight(key))
+        return gated(crawl_gate if metered else None, 'Too many crawls in progress, try again shortly',
+                     crawl_response, url, filter_keyword, filter_field, refresh, recrawl, deadline, max_depth, max_pages,
+                     category, response_format)
         
     except Exception as e:
         return jsonify({
@@ -490,26 +3849,406 @@ def crawl_endpoint():
         }), 500
 
 
+def crawl_response(url, filter_keyword, filter_field, refresh, recrawl, deadline, max_depth, max_pages, category=None,
+                   response_format='json'):
+    """Run a validated /crawl request and build its response"""
+    log.info("Received crawl request", extra={'url': url, 'filter': filter_keyword})
+    
+    # Crawl IPTV streams (identical concurrent requests share one crawl)
+    streams, source = shared_crawl(url, filter_keyword, filter_field, refresh=refresh,
+                                   deadline=deadline, max_depth=max_depth, max_pages=max_pages, recrawl=recrawl)
+    log.info("Crawl result source: %s", source, extra={'url': url})
+    metrics.inc('iptv_crawls_total', source=source)
+    timed_out = getattr(streams, 'timed_out', False)
+    unfinished = getattr(streams, 'unfinished', [])
+    
+    if recrawl and streams.added is not None:
+        # A recrawl reports only what changed since the previous one
+        return streamed_json([
+            ('success', True),
+            ('added', (stream.to_dict() for stream in streams.added)),
+            ('removed', (stream.to_dict() for stream in streams.removed)),
+            ('total_streams', len(streams)),
+            ('source_url', url),
+            ('filter_applied', filter_keyword),
+            ('cached', source != 'crawl'),
+            ('partial', timed_out),
+            ('unfinished_portals', unfinished),
+        ])
+    
+    if not streams:
+        return jsonify({
+            'success': False,
+            'error': 'Crawl deadline reached before any streams were found' if timed_out
+                     else 'No IPTV streams found at the provided URL',
+            'partial': timed_out,
+            'unfinished_portals': unfinished
+        }), 504 if timed_out else 404
+    
+    # The ETag covers everything in the body except "cached", hence weak
+    etag = hashlib.blake2b(repr((result_fingerprint(streams), url, filter_keyword, filter_field, category,
+                                 response_format)).encode('utf-8'), digest_size=16).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        response.vary.add('Accept-Encoding')
+        return response
+    
+    # Categorized once per result; cached results keep their index
+    index = category_index(streams)
+    fields = [
+        ('success', True),
+        ('total_streams', len(streams)),
+        ('source_url', url),
+        ('filter_applied', filter_keyword),
+        ('cached', source != 'crawl'),
+        ('partial', timed_out),
+        ('unfinished_portals', unfinished),
+        ('categories', {name: len(positions) for name, positions in index.items()}),
+    ]
+    if category is not None:
+        fields.append(('category', category))
+        streams = [streams[position] for position in index.get(category, ())]
+    if response_format == 'columnar':
+        fields.append(('format', 'columnar'))
+        fields.extend(columnar_fields(streams))
+    else:
+        fields.append(('streams', (stream.to_dict() for stream in streams)))
+    if category is None:
+        fields.append(('category_index', index))
+    return streamed_json(fields, etag)
+
+
+@app.route('/crawl-jobs', methods=['POST'])
+def submit_crawl_job():
+    """
+    POST endpoint to start a crawl in the background
+    
+    Takes the same JSON body as /crawl and answers straight away with a job id:
+    {
+        "success": true,
+        "job_id": "3f2a...",
+        "status_url": "/crawl-jobs/3f2a...",
+        "stream_url": "/crawl-jobs/3f2a.../stream"
+    }
+    """
+    data = request.get_json(silent=True)
+    if not data or 'url' not in data:
+        return jsonify({
+            'success': False,
+            'error': 'Missing required field: url'
+        }), 400
+    
+    filter_field = data.get('filter_field')
+    if filter_field not in (None, 'name', 'group'):
+        return jsonify({
+            'success': False,
+            'error': 'filter_field must be "name" or "group"'
+        }), 400
+    
+    try:
+        max_depth, max_pages = site_options(data)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    job = crawl_jobs.submit(data['url'], data.get('filter'), filter_field, max_depth, max_pages)
+    if job is None:
+        response = jsonify({
+            'success': False,
+            'error': 'Server is shutting down' if crawl_jobs.closed else 'Too many crawl jobs queued, try again shortly'
+        })
+        response.headers['Retry-After'] = '5'
+        return response, 503 if crawl_jobs.closed else 429
+    
+    log.info("Queued crawl job", extra={'job': job.id, 'url': job.url})
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': f'/crawl-jobs/{job.id}',
+        'stream_url': f'/crawl-jobs/{job.id}/stream'
+    }), 202
+
+
+@app.route('/crawl-jobs/<job_id>', methods=['GET'])
+def crawl_job_status(job_id):
+    """
+    Progress of a crawl job: portals done/total, streams found and errors.
+    
+    Pass ?offset=N to also get the streams found from position N onwards.
+    """
+    job = crawl_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job id'}), 404
+    
+    result = job.to_dict()
+    result['success'] = True
+    offset = request.args.get('offset', type=int)
+    if offset is not None:
+        new_streams, _ = job.wait_for_streams(offset, timeout=0)
+        result['streams'] = [stream.to_dict() for stream in new_streams]
+    return jsonify(result)
+
+
+@app.route('/crawl-jobs/<job_id>/stream', methods=['GET'])
+def crawl_job_stream(job_id):
+    """
+    Stream a crawl job's results as NDJSON while it runs.
+    
+    Each line is {"type": "stream", ...} for a newly found stream,
+    {"type": "progress", ...} when progress changes (and as a heartbeat), and a
+    final {"type": "done", ...} with the job status.
+    """
+    job = crawl_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job id'}), 404
+    
+    def generate():
+        offset = 0
+        last_progress = None
+        while True:
+            new_streams, finished = job.wait_for_streams(offset, timeout=1.0)
+            if new_streams:
+                offset += len(new_streams)
+                yield ''.join(json.dumps({'type': 'stream', **stream.to_dict()}) + '\n' for stream in new_streams)
+            status = job.to_dict()
+            if finished:
+                yield json.dumps({'type': 'done', **status}) + '\n'
+                return
+            progress = (status['portals_done'], status['portals_total'], status['errors'])
+            if progress != last_progress or not new_streams:
+                last_progress = progress
+                yield json.dumps({'type': 'progress', **status}) + '\n'
+    
+    return app.response_class(generate(), mimetype='application/x-ndjson', headers={'Cache-Control': 'no-cache'})
+
+
+MAX_STREAMS_PAGE = 1000
+
+
+@app.route('/streams', methods=['GET'])
+def list_streams():
+    """
+    Page through every stream ever crawled, from the catalog
+    
+    Query parameters (all optional):
+        limit   rows per page (default 100, at most MAX_STREAMS_PAGE)
+        cursor  next_cursor from the previous page
+        name    substring of the channel name
+        group   exact group-title
+        host    source host:port
+        since   only streams seen at or after this Unix time
+    
+    Returns:
+    {
+        "success": true,
+        "streams": [{"id": 1, "name": "...", "url": "...", "group": "...", ...}],
+        "count": 100,
+        "next_cursor": 100  // null on the last page
+    }
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), MAX_STREAMS_PAGE)
+        cursor = int(request.args.get('cursor') or 0)
+        since = float(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'limit and cursor must be integers, since a Unix time'
+        }), 400
+    
+    rows, next_cursor = catalog.query(limit=limit, after=cursor, name=request.args.get('name'),
+                                      group=request.args.get('group'), host=request.args.get('host'),
+                                      seen_since=since)
+    streams = [{
+        'id': row['id'],
+        'name': row['name'],
+        'url': row['url'],
+        'group': row['group_title'],
+        'source_host': row['source_host'],
+        'first_seen': row['first_seen'],
+        'last_seen': row['last_seen'],
+    } for row in rows]
+    return jsonify({
+        'success': True,
+        'streams': streams,
+        'count': len(streams),
+        'next_cursor': next_cursor
+    })
+
+
+MAX_VALIDATE_URLS = 5000
+
+
+@app.route('/validate-stream', methods=['POST'])
+def validate_stream_endpoint():
+    """
+    POST endpoint to check whether a single stream is playable
+    
+    Expected JSON payload:
+    {
+        "url": "http://example.com:8080/live/user/pass/1.ts"
+    }
+    
+    Returns:
+    {
+        "success": true,
+        "status": "working" | "broken",
+        "content_type": "video/mp2t",
+        "response_time": 0.153
+    }
+    """
+    data = request.get_json(silent=True)
+    if not data or not data.get('url'):
+        return jsonify({
+            'success': False,
+            'error': 'Missing required field: url'
+        }), 400
+    
+    return gated(validate_gate, 'Too many stream checks in progress, try again shortly', validate_stream_response,
+                 data['url'])
+
+
+def validate_stream_response(url):
+    """Probe one validated /validate-stream URL and build the response"""
+    verdict = stream_prober.validate(url)
+    return jsonify({'success': True, 'url': url, **verdict})
+
+
+@app.route('/validate-streams', methods=['POST'])
+def validate_streams_endpoint():
+    """
+    POST endpoint to check many streams at once
+    
+    Expected JSON payload:
+    {
+        "urls": ["http://...", "http://..."],
+        "details": false  // Optional: also return the full verdict per URL
+    }
+    
+    Returns:
+    {
+        "success": true,
+        "results": {"http://...": "working", "http://...": "broken"}
+    }
+    """
+    data = request.get_json(silent=True)
+    urls = data.get('urls') if data else None
+    if not isinstance(urls, list) or not urls:
+        return jsonify({
+            'success': False,
+            'error': 'Missing required field: urls'
+        }), 400
+    if len(urls) > MAX_VALIDATE_URLS:
+        return jsonify({
+            'success': False,
+            'error': f'Too many URLs, at most {MAX_VALIDATE_URLS} per request'
+        }), 400
+    
+    return gated(validate_gate, 'Too many stream checks in progress, try again shortly', validate_streams_response,
+                 urls, bool(data.get('details')))
+
+
+def validate_streams_response(urls, details=False):
+    """Probe a validated /validate-streams batch and build the response"""
+    verdicts = stream_prober.validate_many(url for url in urls if isinstance(url, str) and url)
+    result = {
+        'success': True,
+        'results': {url: verdict['status'] for url, verdict in verdicts.items()},
+        'working': sum(1 for verdict in verdicts.values() if verdict['status'] == 'working'),
+        'total': len(verdicts)
+    }
+    if details:
+        result['details'] = verdicts
+    return jsonify(result)
+
+
+PROXY_BUFFER_SIZE = 256 * 1024  # Bytes read from upstream per write to the client
+
+# Upstream response headers passed through to the player unchanged
+PROXY_PASSTHROUGH_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges', 'Content-Encoding',
+                             'Last-Modified', 'ETag')
+
+PROXY_CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, HEAD, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Range',
+    'Access-Control-Expose-Headers': 'Content-Length, Content-Range, Accept-Ranges',
+}
+
+
+class UpstreamBody:
+    """
+    File-like view of a streamed upstream response for wsgi.file_wrapper.
+
+    Reads the raw bytes straight off the pooled connection. Once the body has
+    been read to the end the connection goes back to the pool; a client that
+    disconnects early closes it instead, since it is mid-response.
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.finished = False
+
+    def read(self, size=-1):
+        data = self.response.raw.read(size if size and size > 0 else None, decode_content=False)
+        if not data:
+            self.finished = True
+        else:
+            metrics.inc('iptv_proxied_bytes_total', len(data))
+        return data
+
+    def close(self):
+        if self.finished:
+            self.response.raw.release_conn()
+        else:
+            self.response.close()
+
+
+def hls_response(entry, max_age=0):
+    """Answer a proxied HLS playlist or segment from memory"""
+    if request.method != 'HEAD':
+        metrics.inc('iptv_proxied_bytes_total', len(entry.body))
+    response = app.response_class(
+        entry.body,
+        status=200,
+        headers={
+            'Content-Type': entry.content_type or 'application/octet-stream',
+            'Cache-Control': f'max-age={max_age}' if max_age else 'no-cache',
+            **PROXY_CORS_HEADERS,
+        }
+    )
+    # Serves Range requests for cached segments as 206 slices of the body; Werkzeug
+    # only answers a range when it is told the complete length
+    try:
+        return response.make_conditional(request, accept_ranges=True, complete_length=len(entry.body))
+    except RequestedRangeNotSatisfiable:
+        return app.response_class(status=416, headers={'Content-Range': f'bytes */{len(entry.body)}',
+                                                       **PROXY_CORS_HEADERS})
+
 
-@app.route('/proxy-video', methods=['GET'])
+@app.route('/proxy-video', methods=['GET', 'HEAD'])
 def proxy_video():
     """Proxy video streams to bypass CORS and format issues"""
     url = request.args.get('url')
     if not url:
         return jsonify({'error': 'No URL provided'}), 400
-    
+    return gated(proxy_gate, 'Too many proxied streams, try again shortly', relay_video, url)
+
+
+def relay_video(url):
+    """Fetch url upstream and build the /proxy-video response for it"""
     try:
         # Decode the URL
         url = urllib.parse.unquote(url)
         
-        # Set headers to mimic VLC
+        # Set headers to mimic VLC. The body is relayed byte for byte, so ask for
+        # it unencoded; that also keeps upstream byte ranges meaningful.
         headers = {
             'User-Agent': 'VLC/3.0.0 LibVLC/3.0.0',
             'Accept': '*/*',
             'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate',
+            'Accept-Encoding': 'identity',
             'Connection': 'keep-alive',
-            'Range': 'bytes=0-',
         }
         
         # Check for additional parameters
@@ -522,37 +4261,68 @@ def proxy_video():
         if request.args.get('vlc') == 'true':
             headers['User-Agent'] = 'VLC/3.0.0 LibVLC/3.0.0'
         
-        print(f"Proxying video: {url}")
+        log.debug("Proxying video", extra={'url': url})
+        
+        # HLS playlists and segments are fetched whole, shared between viewers and cached
+        hls = request.args.get('hls')
+        if hls == 'playlist' or (hls is None and HLSProxy.is_playlist_url(url)):
+            entry = hls_proxy.playlist(url, headers, request.base_url)
+            if entry is None:
+                return jsonify({'error': 'Failed to proxy HLS playlist'}), 502
+            return hls_response(entry, max_age=0)
+        if hls == 'segment':
+            entry = hls_proxy.segment(url, headers)
+            if entry is not None:
+                return hls_response(entry, max_age=hls_proxy.segments.ttl)
+            # Too big to cache (or upstream refused): fall back to plain streaming
+        
+        # Let the player seek: pass its Range through instead of always starting at byte 0
+        if request.headers.get('Range'):
+            headers['Range'] = request.headers['Range']
+        
+        # Stream the response like VLC does, over a pooled connection. HEAD is
+        # sent as a GET too, since many IPTV servers reject HEAD; the body is
+        # simply never read.
+        response = crawler.transport.get(url, headers=headers, stream=True, timeout=30, verify=False)
         
-        # Stream the response like VLC does
-        response = requests.get(url, headers=headers, stream=True, timeout=30, verify=False)
+        if response.status_code in [200, 206] and HLSProxy.is_playlist_response(response.headers.get('Content-Type')):
+            # A playlist behind a URL that didn't look like one: rewrite it all the same
+            try:
+                text = response.content.decode('utf-8', errors='replace')
+                final_url = response.url
+            finally:
+                response.close()
+            body = hls_proxy.rewrite_playlist(text, final_url, request.base_url).encode('utf-8')
+            return hls_response(CachedSegment(body, 'application/vnd.apple.mpegurl'), max_age=0)
         
-        if response.status_code in [200, 206]:
-            # Create a Flask response with streaming
-            def generate():
-                for chunk in response.iter_content(chunk_size=8192):
-                    yield chunk
+        if response.status_code in [200, 206, 416]:
+            response_headers = {name: response.headers[name] for name in PROXY_PASSTHROUGH_HEADERS
+                                if name in response.headers}
+            response_headers.setdefault('Content-Type', 'video/mp4')
+            response_headers.update(PROXY_CORS_HEADERS)
+            
+            if request.method == 'HEAD' or response.status_code == 416:
+                response.close()
+                body = []
+            else:
+                # wsgi.file_wrapper when the server has one, large reads either way
+                body = wrap_file(request.environ, UpstreamBody(response), PROXY_BUFFER_SIZE)
             
             flask_response = app.response_class(
-                generate(),
-                status=200,
-                headers={
-                    'Content-Type': response.headers.get('Content-Type', 'video/mp4'),
-                    'Content-Length': response.headers.get('Content-Length', ''),
-                    'Accept-Ranges': 'bytes',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                    'Access-Control-Allow-Headers': 'Content-Type, Range',
-                }
+                body,
+                status=response.status_code,
+                headers=response_headers,
+                direct_passthrough=True
             )
             
             return flask_response
         else:
-            print(f"Proxy failed with status: {response.status_code}")
+            response.close()
+            log.warning("Proxy failed with status %d", response.status_code, extra={'url': url})
             return jsonify({'error': f'Failed to proxy video: {response.status_code}'}), response.status_code
             
     except Exception as e:
-        print(f"Proxy error: {str(e)}")
+        log.error("Proxy error: %s", e, extra={'url': url})
         return jsonify({'error': f'Proxy error: {str(e)}'}), 500
 
 @app.route('/health', methods=['GET'])
@@ -561,9 +4331,27 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'service': 'IPTV Crawler API',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'transport': crawler.transport.stats(),
+        'cache': crawler.cache.stats() if crawler.cache else None,
+        'hosts': {**crawler.hosts.stats(), 'hedged_requests': crawler.hedged_requests},
+        'fingerprints': crawler.fingerprints.stats(),
+        'crawl_results': {'entries': len(crawl_results), 'shared_crawls': crawl_flights.shared},
+        'stream_prober': stream_prober.stats(),
+        'hls_proxy': hls_proxy.stats(),
+        'catalog': catalog.stats(),
+        'admission': {'crawl': crawl_gate.stats(), 'proxy': proxy_gate.stats(), 'validate': validate_gate.stats()}
     })
 
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage timings, per-host request outcomes, in-flight fetches and byte counters in the Prometheus text format"""
+    for gate in (crawl_gate, proxy_gate, validate_gate):
+        metrics.set('iptv_admission_active', gate.active, budget=gate.name)
+        metrics.set('iptv_admission_waiting', gate.waiting, budget=gate.name)
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/', methods=['GET'])
 def home():
     """Home endpoint with usage instructions"""
@@ -573,8 +4361,15 @@ def home():
         'description': 'Crawls IPTV playlists from any URL by extracting IPTV URLs and fetching M3U playlists',
         'endpoints': {
             'POST /crawl': 'Crawl IPTV streams from any URL (JSON)',
+            'POST /crawl-jobs': 'Start a background crawl, returns a job id (JSON)',
+            'GET /crawl-jobs/<id>': 'Crawl job progress (?offset=N for streams found so far)',
+            'GET /crawl-jobs/<id>/stream': 'Crawl job results as NDJSON while it runs',
+            'GET /streams': 'Page through the stream catalog (?limit=&cursor=&name=&group=&host=)',
+            'POST /validate-stream': 'Check whether one stream is playable (JSON: {"url": ...})',
+            'POST /validate-streams': 'Check many streams at once (JSON: {"urls": [...]})',
             'GET /health': 'Health check',
-            'GET /proxy-video': 'Proxy video streams (use ?url=... parameter)',
+            'GET /metrics': 'Prometheus metrics: stage timings, per-host errors, in-flight fetches, proxied bytes',
+            'GET /proxy-video': 'Proxy video streams (use ?url=... parameter; HLS playlists are rewritten and segments cached)',
             'GET /': 'This help message'
         },
         'usage': {
@@ -582,19 +4377,166 @@ def home():
             'endpoint': '/crawl',
             'body': {
                 'url': 'https://example.com (required)',
-                'filter': 'sports (optional)'
+                'filter': 'sports (optional)',
+                'filter_field': 'name | group (optional)',
+                'refresh': 'true to bypass cached results (optional)',
+                'deadline': f'time budget in seconds, default {CRAWL_DEADLINE} (optional)',
+                'max_depth': f'follow links up to this deep, 0-{MAX_SITE_DEPTH} (optional, default 0)',
+                'max_pages': f'page limit for the site crawl, up to {MAX_SITE_PAGES} (optional, default 50)',
+                'recrawl': 'true to return only the streams added/removed since the last recrawl (optional)',
+                'category': 'only return streams in this category, from the response\'s "categories" (optional)',
+                'format': 'json | columnar (optional, default json; columnar dictionary-encodes URL prefixes)'
             }
         }
     })
 
+SERVER_HOST = '0.0.0.0'
+SERVER_PORT = 5000
+# How long a stopping worker waits for admitted crawls and running jobs; past
+# the default crawl deadline, so a normal /crawl always gets to answer
+DRAIN_TIMEOUT = CRAWL_DEADLINE + 30
+
+
+def drain(timeout=DRAIN_TIMEOUT):
+    """
+    Stop admitting crawls, jobs, stream checks and proxied streams, then wait
+    up to timeout seconds for admitted crawls, stream checks and running jobs
+    to finish and for their streams to reach the catalog. Returns True if
+    everything finished.
+    Proxied streams can run forever, so they are not waited for.
+    """
+    deadline = time.monotonic() + timeout
+    crawl_gate.close()
+    proxy_gate.close()
+    validate_gate.close()
+    jobs_done = crawl_jobs.shutdown(timeout)
+    crawls_done = crawl_gate.wait_idle(max(0.0, deadline - time.monotonic()))
+    checks_done = validate_gate.wait_idle(max(0.0, deadline - time.monotonic()))
+    catalog.close()
+    stream_prober.close()
+    crawler.close()
+    return jobs_done and crawls_done and checks_done
+
+
+def serve_worker(sock, drain_timeout=DRAIN_TIMEOUT):
+    """
+    Serve the app on an already listening socket until SIGTERM or SIGINT,
+    then drain and return. Requests are handled on threads; the admission
+    budgets are what bound the work they can start.
+    """
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    stopping = threading.Event()
+    
+    def stop_gracefully():
+        finished = drain(drain_timeout)
+        log.info("Worker drained" if finished else "Drain timed out, stopping anyway", extra={'pid': os.getpid()})
+        server.shutdown()
+    
+    def on_signal(signum, frame):
+        # serve_forever runs on this thread, so the drain and shutdown happen on another
+        if not stopping.is_set():
+            stopping.set()
+            log.info("Stopping worker, draining in-flight crawls", extra={'pid': os.getpid()})
+            threading.Thread(target=stop_gracefully, name='drain', daemon=True).start()
+    
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    log.info("Worker serving", extra={'pid': os.getpid(), 'address': f'{host}:{port}'})
+    server.serve_forever()
+    server.server_close()
+
+
+def serve(host=SERVER_HOST, port=SERVER_PORT, workers=1, drain_timeout=DRAIN_TIMEOUT):
+    """
+    Production server: one listening socket shared by `workers` forked
+    worker processes, each running serve_worker. Workers that die are
+    replaced; SIGTERM or SIGINT drains them all (a second one kills them).
+    Without os.fork (Windows), or with workers=1, this process serves alone.
+
+    Every worker has its own crawler, caches, budgets and metrics, so
+    background crawl jobs are only visible on the worker that started them.
+    """
+    sock = socket.create_server((host, port), backlog=1024)
+    sock.set_inheritable(True)
+    if workers <= 1 or not hasattr(os, 'fork'):
+        try:
+            serve_worker(sock, drain_timeout)
+        finally:
+            sock.close()
+        return
+    
+    children = set()
+    stopping = []
+    
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                serve_worker(sock, drain_timeout)
+            except BaseException:
+                log.exception("Worker crashed")
+                code = 1
+            finally:
+                # Never return into the parent's supervision loop
+                os._exit(code)
+        children.add(pid)
+    
+    def on_signal(signum, frame):
+        stopping.append(signum)
+        for pid in list(children):
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM if len(stopping) == 1 else signal.SIGKILL)
+    
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    for _ in range(workers):
+        spawn()
+    log.info("Serving with %d workers", workers, extra={'address': f'{host}:{port}'})
+    
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            log.warning("Worker exited unexpectedly, starting a new one", extra={'pid': pid, 'status': status})
+            time.sleep(1)
+            spawn()
+    sock.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='IPTV Crawler API server')
+    parser.add_argument('--host', default=SERVER_HOST, help=f'Address to listen on (default: {SERVER_HOST})')
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help=f'Port to listen on (default: {SERVER_PORT})')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes sharing the port (default: 1; crawl jobs stay on the worker that started them)')
+    parser.add_argument('--parse-workers', type=int, default=0,
+                        help='Processes per worker for parsing large pages and playlists (default: 0 = parse in the request thread)')
+    parser.add_argument('--dev', action='store_true', help="Run Flask's debug server with the reloader instead")
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
+    args = parse_args()
+    configure_logging()
     print("🚀 Starting IPTV Crawler API")
-    print("📍 API will be available at: http://localhost:5000")
+    print(f"📍 API will be available at: http://localhost:{args.port}")
     print("📋 Endpoints:")
     print("   POST /crawl - Crawl IPTV streams from any URL")
+    print("   POST /crawl-jobs - Start a background crawl")
+    print("   POST /validate-stream(s) - Check whether streams are playable")
     print("   GET /health - Health check")
+    print("   GET /metrics - Prometheus metrics")
     print("   GET /proxy-video - Proxy video streams")
     print("   GET / - Help and usage")
     print("=" * 50)
     
-    app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
+    crawler.parse_workers = args.parse_workers
+    if args.dev:
+        app.run(host=args.host, port=args.port, debug=True)
+    else:
+        serve(args.host, args.port, workers=args.workers) 
\ No newline at end of file
@@ -0,0 +1,383 @@
+"""
+Tests for the HTTP API
+======================
+
+Requests go through Flask's test client to the module's app, crawling the
+benchmark's local stand-in server.
+"""
+
+import gzip
+import json
+import re
+import threading
+import time
+from urllib.parse import quote
+
+import pytest
+from flask.testing import FlaskClient
+
+import iptv_crawler
+from benchmark_crawler import StandServer
+
+PORTALS = 6
+
+
+@pytest.fixture
+def stand():
+    with StandServer() as server:
+        yield server
+
+
+class BufferedClient(FlaskClient):
+    # Reads every response through and closes it, so crawls and proxied
+    # streams give back their admission slots as they would on a real server
+    def open(self, *args, buffered=True, **kwargs):
+        return super().open(*args, buffered=buffered, **kwargs)
+
+
+def buffered_client():
+    return BufferedClient(iptv_crawler.app, iptv_crawler.app.response_class, use_cookies=True)
+
+
+@pytest.fixture
+def client():
+    return buffered_client()
+
+
+def post_crawl(client, page, headers=None, **fields):
+    return client.post('/crawl', json={'url': page, **fields}, headers=headers or {})
+
+
+def test_crawl_etag_does_not_depend_on_fetch_order(stand, client, monkeypatch):
+    page = stand.url(f'/page?portals={PORTALS}&entries=20')
+    fetch = iptv_crawler.crawler.fetch_portal_streams
+    slowest_first = [True]
+
+    def fetch_in_order(iptv_url, *args):
+        # Portals finish in reverse listing order on one crawl and in listing order on the next
+        index = int(re.search(r'username=user(\d+)', iptv_url).group(1))
+        time.sleep(0.02 * (PORTALS - index if slowest_first[0] else index))
+        return fetch(iptv_url, *args)
+
+    monkeypatch.setattr(iptv_crawler.crawler, 'fetch_portal_streams', fetch_in_order)
+    first = post_crawl(client, page, refresh=True)
+    slowest_first[0] = False
+    second = post_crawl(client, page, refresh=True)
+    assert first.status_code == second.status_code == 200
+    assert first.headers['ETag'] == second.headers['ETag']
+    assert first.get_data() == second.get_data()
+    hosts = [stream['url'].split('.')[1] for stream in first.get_json()['streams']]
+    assert list(dict.fromkeys(hosts)) == [f'user{i}' for i in range(PORTALS)]
+
+
+def test_crawl_answers_304_for_a_matching_etag(stand, client):
+    page = stand.url(f'/page?portals={PORTALS}&entries=20')
+    response = post_crawl(client, page)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+
+    cached = post_crawl(client, page, headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.get_data() == b''
+    assert cached.headers['ETag'] == etag
+
+    # Another representation of the same result gets its own tag
+    columnar = post_crawl(client, page, headers={'If-None-Match': etag}, format='columnar')
+    assert columnar.status_code == 200
+    assert columnar.headers['ETag'] != etag
+
+
+def test_crawl_body_is_the_same_under_every_encoding(stand, client):
+    page = stand.url(f'/page?portals={PORTALS}&entries=20')
+    plain = post_crawl(client, page)
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    compressed = post_crawl(client, page, headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+
+    body = json.loads(plain.get_data())
+    unpacked = json.loads(gzip.decompress(compressed.get_data()))
+    assert (body.pop('cached'), unpacked.pop('cached')) == (False, True)
+    assert unpacked == body
+    assert body['total_streams'] == len(body['streams']) == PORTALS * 20
+    assert sum(body['categories'].values()) == body['total_streams']
+
+
+def test_columnar_format_rebuilds_the_streams(stand, client):
+    page = stand.url(f'/page?portals={PORTALS}&entries=20')
+    streams = post_crawl(client, page).get_json()['streams']
+    body = post_crawl(client, page, format='columnar').get_json()
+    assert body['format'] == 'columnar'
+    assert [body['url_prefixes'][prefix] + rest for prefix, rest in zip(body['url_prefix'], body['urls'])] \
+        == [stream['url'] for stream in streams]
+    assert body['names'] == [stream['name'] for stream in streams]
+    assert [body['groups'][group] for group in body['group']] == [stream['group'] for stream in streams]
+
+
+def test_category_facets_and_filter(stand, client):
+    page = stand.url(f'/page?portals={PORTALS}&entries=20')
+    body = post_crawl(client, page).get_json()
+    streams, index = body['streams'], body['category_index']
+    assert body['categories'] == {category: len(positions) for category, positions in index.items()}
+    assert sorted(position for positions in index.values() for position in positions) == list(range(len(streams)))
+
+    category = max(index, key=lambda name: len(index[name]))
+    only = post_crawl(client, page, category=category).get_json()
+    assert (only['category'], only['categories']) == (category, body['categories'])
+    assert only['streams'] == [streams[position] for position in index[category]]
+    assert 'category_index' not in only
+    assert post_crawl(client, page, category='No Such Category').get_json()['streams'] == []
+
+
+def test_health_does_not_open_the_catalog(client, monkeypatch):
+    catalog = iptv_crawler.StreamCatalog(iptv_crawler.catalog.path + '.health')
+    monkeypatch.setattr(iptv_crawler, 'catalog', catalog)
+    body = client.get('/health').get_json()
+    assert body['catalog']['streams'] is None
+    assert getattr(catalog._local, 'connection', None) is None
+
+
+def test_crawled_streams_page_through_the_catalog(stand, client, monkeypatch, tmp_path):
+    catalog = iptv_crawler.StreamCatalog(str(tmp_path / 'catalog.db'))
+    monkeypatch.setattr(iptv_crawler, 'catalog', catalog)
+    crawled = post_crawl(client, stand.url('/page?portals=3&entries=25'), refresh=True).get_json()
+    catalog.close()  # Waits for the write-through to land
+
+    pages, ids, cursor = [], [], 0
+    while cursor is not None:
+        page = client.get('/streams', query_string={'limit': 20, 'cursor': cursor}).get_json()
+        pages.append(page['count'])
+        ids += [stream['id'] for stream in page['streams']]
+        cursor = page['next_cursor']
+    assert pages == [20, 20, 20, 15]
+    assert ids == sorted(set(ids)) and len(ids) == crawled['total_streams']
+
+    host = crawled['streams'][0]['url'].split('/')[2]
+    by_host = client.get('/streams', query_string={'host': host, 'limit': 500}).get_json()
+    assert by_host['count'] == sum(stream['url'].split('/')[2] == host for stream in crawled['streams'])
+    assert by_host['next_cursor'] is None
+    assert client.get('/streams', query_string={'limit': 'all'}).status_code == 400
+
+
+def test_identical_crawls_share_one_run_and_its_result(stand, client, monkeypatch):
+    page = stand.url(f'/page?portals={PORTALS}&entries=7')
+    crawl = iptv_crawler.crawler.crawl_iptv_streams
+    runs = []
+    running = threading.Event()
+
+    def slow_crawl(*args, **kwargs):
+        runs.append(args[0])
+        running.set()
+        time.sleep(0.3)  # Long enough for the other requests to arrive while it runs
+        return crawl(*args, **kwargs)
+
+    monkeypatch.setattr(iptv_crawler.crawler, 'crawl_iptv_streams', slow_crawl)
+    shared_before = iptv_crawler.crawl_flights.shared
+    responses = [None] * 3
+
+    def request(i):
+        if i:
+            running.wait(5)
+        # The same crawl, however the URL and keyword are spelled
+        responses[i] = buffered_client().post(
+            '/crawl', json={'url': page + ('#top' if i == 2 else ''), 'filter': ' Radio ' if i else 'radio',
+                            'refresh': i == 0})
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(runs) == 1
+    assert iptv_crawler.crawl_flights.shared - shared_before == 2
+    bodies = [response.get_json() for response in responses]
+    assert [body.pop('cached') for body in bodies] == [False, True, True]
+    assert bodies[0]['streams'] == bodies[1]['streams'] == bodies[2]['streams'] != []
+
+    # Finished results are served from the cache until a refresh asks for a new crawl
+    assert post_crawl(client, page, filter='radio').get_json()['cached'] is True
+    assert len(runs) == 1
+    assert post_crawl(client, page, filter='radio', refresh=True).get_json()['cached'] is False
+    assert len(runs) == 2
+
+
+def test_single_flight_hands_the_leaders_error_to_every_caller():
+    flights = iptv_crawler.SingleFlight()
+    started = threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError('portal down')
+
+    def call():
+        try:
+            flights.do('key', failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=call) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join()
+    assert errors == ['portal down'] * 4
+    assert flights.shared == 3
+    assert not flights.in_flight('key')
+    # A failed run isn't remembered; the next call runs again
+    assert flights.do('key', lambda: 'ok') == 'ok'
+
+
+def test_crawl_job_streams_its_results_as_ndjson(stand, client):
+    page = stand.url(f'/page?portals={PORTALS}&entries=9')
+    submitted = client.post('/crawl-jobs', json={'url': page})
+    assert submitted.status_code == 202
+    job = submitted.get_json()
+
+    lines = [json.loads(line) for line in client.get(job['stream_url']).get_data(as_text=True).splitlines()]
+    streams = [line for line in lines if line['type'] == 'stream']
+    done = lines[-1]
+    assert (done['type'], done['status']) == ('done', 'done')
+    assert done['portals_done'] == done['portals_total'] == PORTALS
+    assert len(streams) == done['streams_found'] == PORTALS * 9
+
+    status = client.get(f"{job['status_url']}?offset={PORTALS * 9 - 2}").get_json()
+    assert status['status'] == 'done'
+    assert [stream['url'] for stream in status['streams']] == [stream['url'] for stream in streams[-2:]]
+    assert client.get('/crawl-jobs/unknown').status_code == 404
+
+
+class BlockedCrawler:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def crawl_iptv_streams(self, url, *args, **kwargs):
+        self.release.wait(5)
+        return iptv_crawler.CrawlResult()
+
+
+def test_job_queue_is_bounded_and_shutdown_fails_queued_jobs():
+    crawler = BlockedCrawler()
+    jobs = iptv_crawler.CrawlJobManager(crawler, max_workers=1, max_queued=2)
+    running = jobs.submit('http://a.example.com/')
+    while running.status == 'queued':
+        time.sleep(0.01)
+    queued = [jobs.submit('http://b.example.com/'), jobs.submit('http://c.example.com/')]
+    assert None not in queued
+    assert jobs.submit('http://d.example.com/') is None
+
+    # Shut down while the first job still runs, so neither queued job gets a worker
+    threading.Timer(0.1, crawler.release.set).start()
+    assert jobs.shutdown(timeout=5)
+    assert running.status == 'done'
+    assert [job.status for job in queued] == ['failed', 'failed']
+    assert jobs.submit('http://e.example.com/') is None
+
+
+def proxied_uris(response):
+    return [line for line in response.get_data(as_text=True).splitlines() if line and not line.startswith('#')]
+
+
+def test_validate_endpoints_report_working_and_broken_streams(stand, client):
+    video, hls, missing = (stand.url(path) for path in ('/video', '/hls/master.m3u8', '/missing.ts'))
+    one = client.post('/validate-stream', json={'url': video}).get_json()
+    assert (one['success'], one['url'], one['status']) == (True, video, 'working')
+
+    body = client.post('/validate-streams', json={'urls': [video, hls, missing, 42], 'details': True}).get_json()
+    assert body['results'] == {video: 'working', hls: 'working', missing: 'broken'}
+    assert (body['working'], body['total']) == (2, 3)
+    assert body['details'][missing]['error'] == 'HTTP 404'
+
+    assert client.post('/validate-stream', json={}).status_code == 400
+    assert client.post('/validate-streams', json={'urls': []}).status_code == 400
+    too_many = [video] * (iptv_crawler.MAX_VALIDATE_URLS + 1)
+    assert client.post('/validate-streams', json={'urls': too_many}).status_code == 400
+
+
+def test_hls_is_proxied_through_rewritten_playlists_and_a_shared_segment_cache(stand, client, monkeypatch):
+    hls = iptv_crawler.HLSProxy(iptv_crawler.crawler.transport)
+    monkeypatch.setattr(iptv_crawler, 'hls_proxy', hls)
+    master = client.get('/proxy-video', query_string={'url': stand.url('/hls/master.m3u8')})
+    assert master.status_code == 200
+    assert master.headers['Content-Type'] == 'application/vnd.apple.mpegurl'
+    [variant] = proxied_uris(master)
+    assert variant == ('http://localhost/proxy-video?url=' + quote(stand.url('/hls/media.m3u8?segments=3'), safe='')
+                       + '&hls=playlist')
+
+    segments = proxied_uris(client.get(variant))
+    assert segments == ['http://localhost/proxy-video?url=' + quote(stand.url(f'/hls/seg{i}.ts'), safe='')
+                        + '&hls=segment' for i in range(3)]
+    fetches = hls.upstream_fetches
+    # Every viewer of the channel gets the segment from one upstream fetch
+    bodies = {client.get(segments[0]).get_data() for _ in range(3)}
+    assert bodies == {bytes(range(256)) * 16}
+    assert hls.upstream_fetches == fetches + 1
+
+
+def test_playlist_rewrite_covers_uri_attributes():
+    hls = iptv_crawler.HLSProxy(transport=None)
+    text = ('#EXTM3U\n'
+            '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="a",URI="audio/en.m3u8"\n'
+            '#EXT-X-KEY:METHOD=AES-128,URI="../keys/k1"\n'
+            '#EXTINF:4.0,\n'
+            'https://cdn.example.net/abs/seg1.ts\n')
+    lines = hls.rewrite_playlist(text, 'http://origin.example.net/live/ch/index.m3u8', '/proxy-video').splitlines()
+    proxied = '/proxy-video?url={}&hls={}'.format
+    assert lines[1] == ('#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="a",URI="'
+                        + proxied(quote('http://origin.example.net/live/ch/audio/en.m3u8', safe=''), 'playlist') + '"')
+    assert lines[2] == ('#EXT-X-KEY:METHOD=AES-128,URI="'
+                        + proxied(quote('http://origin.example.net/live/keys/k1', safe=''), 'segment') + '"')
+    assert lines[4] == proxied(quote('https://cdn.example.net/abs/seg1.ts', safe=''), 'segment')
+
+
+def test_proxy_passes_ranges_through_and_answers_head(stand, client):
+    video = {'url': stand.url('/video?bytes=1000000')}
+    whole = client.get('/proxy-video', query_string=video)
+    assert (whole.status_code, whole.headers['Content-Length']) == (200, '1000000')
+    assert whole.headers['Accept-Ranges'] == 'bytes'
+
+    # A seek is the upstream's 206, not the proxy reading from byte 0
+    seek = client.get('/proxy-video', query_string=video, headers={'Range': 'bytes=500000-500009'})
+    assert seek.status_code == 206
+    assert seek.headers['Content-Range'] == 'bytes 500000-500009/1000000'
+    assert seek.get_data() == bytes(i % 256 for i in range(500000, 500010))
+
+    head = client.head('/proxy-video', query_string=video)
+    assert (head.status_code, head.headers['Content-Length'], head.get_data()) == (200, '1000000', b'')
+    past_the_end = client.get('/proxy-video', query_string=video, headers={'Range': 'bytes=2000000-'})
+    assert (past_the_end.status_code, past_the_end.headers['Content-Range']) == (416, 'bytes */1000000')
+
+
+def test_cached_segments_answer_ranges(stand, client, monkeypatch):
+    monkeypatch.setattr(iptv_crawler, 'hls_proxy', iptv_crawler.HLSProxy(iptv_crawler.crawler.transport))
+    segment = {'url': stand.url('/hls/seg0.ts'), 'hls': 'segment'}
+    partial = client.get('/proxy-video', query_string=segment, headers={'Range': 'bytes=10-19'})
+    assert (partial.status_code, partial.get_data()) == (206, bytes(range(10, 20)))
+    assert partial.headers['Content-Range'] == 'bytes 10-19/4096'
+    unsatisfiable = client.get('/proxy-video', query_string=segment, headers={'Range': 'bytes=5000-'})
+    assert (unsatisfiable.status_code, unsatisfiable.headers['Content-Range']) == (416, 'bytes */4096')
+
+
+def test_crawl_deadline_returns_partial_results_that_are_not_cached(client, monkeypatch):
+    # Two portals at a time, 0.3s each: about half of them answer before the deadline
+    monkeypatch.setattr(iptv_crawler, 'crawler', iptv_crawler.IPTVCrawler(cache=False, max_concurrency=2))
+    with StandServer(latency=0.3) as slow:
+        page = slow.url('/page?portals=10&entries=5')
+        first = post_crawl(client, page, deadline=1.5).get_json()
+        assert first['success'] and first['partial']
+        assert 0 < first['total_streams'] < 50
+        assert len(first['unfinished_portals']) == 10 - first['total_streams'] // 5
+        # A cut-short result isn't cached: the same request goes back to the portals
+        requests_before = slow.requests
+        post_crawl(client, page, deadline=1.5)
+        assert slow.requests > requests_before
+
+    for deadline in (-5, 10 ** 6, 'soon'):
+        response = post_crawl(client, page, deadline=deadline)
+        assert response.status_code == 400, deadline
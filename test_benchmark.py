@@ -0,0 +1,45 @@
+"""
+Tests for the benchmark suite
+=============================
+
+The benchmarks check their results against the legacy implementations as
+they go, so small runs of them double as tests. The baseline comparison
+decides what counts as a regression.
+"""
+
+from benchmark_crawler import (benchmark_crawl_iptv_streams, benchmark_deduplicate_streams,
+                               benchmark_extract_iptv_urls, benchmark_extract_streams_from_m3u, compare_to_baseline,
+                               legacy_extract_streams_from_m3u, make_m3u_playlist, make_xtream_catalog, record)
+
+
+def test_small_benchmark_runs_record_their_results(capsys):
+    results = {}
+    benchmark_extract_iptv_urls(results, sizes=(100,))
+    benchmark_extract_streams_from_m3u(results, sizes=(1000,))
+    benchmark_deduplicate_streams(results, sizes=(1000,))
+    benchmark_crawl_iptv_streams(results, portals=5, entries=20, latency=0, failure_rate=0, ssl_rate=0)
+    assert results['crawl_iptv_streams/5x20']['count'] == 100
+    assert {'extract_iptv_urls/100', 'extract_streams_from_m3u/1000/sports', 'deduplicate_streams/1000'} <= set(results)
+    for result in results.values():
+        assert result['seconds'] > 0 and result['per_second'] > 0
+        assert result['peak_mb'] is None or result['peak_mb'] > 0
+    assert '🌐 crawl_iptv_streams' in capsys.readouterr().out
+
+
+def test_baseline_comparison_flags_only_slowdowns_past_the_tolerance(capsys):
+    baseline, results = {}, {}
+    for name, seconds in (('steady', 1.0), ('slower', 1.0), ('faster', 1.0)):
+        record(baseline, name, seconds, 100, 'items')
+    for name, seconds in (('steady', 1.05), ('slower', 1.5), ('faster', 0.5), ('added', 1.0)):
+        record(results, name, seconds, 100, 'items')
+    assert compare_to_baseline(results, baseline, tolerance=0.1) == ['slower']
+    out = capsys.readouterr().out
+    assert 'added' in out and 'new' in out
+    assert compare_to_baseline(results, baseline, tolerance=0.6) == []
+
+
+def test_xtream_catalog_lists_the_playlist_channels():
+    categories, streams = make_xtream_catalog(50)
+    playlist = legacy_extract_streams_from_m3u(make_m3u_playlist(50))
+    assert [stream['name'] for stream in streams] == [name for name, url in playlist]
+    assert {stream['category_id'] for stream in streams} <= {category['category_id'] for category in categories}
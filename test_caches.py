@@ -0,0 +1,98 @@
+"""
+Tests for the response and segment caches
+=========================================
+
+In-memory tiers are checked directly; disk tiers write under pytest's
+tmp_path.
+"""
+
+import os
+from types import SimpleNamespace
+
+from iptv_crawler import ResponseCache, TTLCache
+
+def response(status_code=200, **headers):
+    return SimpleNamespace(status_code=status_code, headers={key.replace('_', '-'): value
+                                                             for key, value in headers.items()})
+
+
+def test_ttl_cache_evicts_least_recently_used_by_size():
+    cache = TTLCache(max_size=10, sizeof=len)
+    cache.set('a', 'xxxx')
+    cache.set('b', 'xxxx')
+    assert cache.get('a') == 'xxxx'  # a is now the most recently used
+    cache.set('c', 'xxxx')
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == ('xxxx', None, 'xxxx')
+    assert (len(cache), cache.size) == (2, 8)
+    # A value bigger than the whole cache isn't stored, and replaces nothing
+    cache.set('d', 'x' * 11)
+    assert (cache.get('d'), len(cache)) == (None, 2)
+
+
+def test_ttl_cache_keeps_expired_entries_for_revalidation():
+    cache = TTLCache(ttl=60)
+    cache.set('stale', 1, ttl=0)
+    cache.set('fresh', 2)
+    assert cache.get('stale') is None
+    assert cache.peek('stale') == (1, False)
+    assert cache.peek('fresh') == (2, True)
+    assert cache.pop('stale') == 1 and cache.peek('stale') == (None, False)
+
+
+def test_response_cache_revalidates_stale_entries():
+    cache = ResponseCache(ttl=60)
+    url = 'http://portal.example.net/page'
+    cache.store(url, response(ETag='"v1"', Last_Modified='Mon, 01 Jan 2024 00:00:00 GMT',
+                              Cache_Control='max-age=0'), 'body')
+    entry, fresh = cache.lookup(url)
+    assert not fresh
+    assert entry.conditional_headers() == {'If-None-Match': '"v1"',
+                                           'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+
+    # A 304 makes it fresh again under the tag it carries
+    cache.revalidated(url, entry, response(304, ETag='"v2"'))
+    entry, fresh = cache.lookup(url)
+    assert fresh and entry.text == 'body' and entry.etag == '"v2"'
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['revalidations']) == (2, 0, 1)
+
+
+def test_response_cache_honours_no_store_and_errors():
+    cache = ResponseCache()
+    cache.store('http://a.example.net/', response(Cache_Control='no-store'), 'private')
+    cache.store('http://b.example.net/', response(503), 'unavailable')
+    assert cache.lookup('http://a.example.net/') == (None, False)
+    assert cache.lookup('http://b.example.net/') == (None, False)
+
+
+def test_disk_tier_outlives_the_cache(tmp_path):
+    ResponseCache(disk_dir=str(tmp_path)).store('http://portal.example.net/page', response(ETag='"v1"'), 'body')
+    entry, fresh = ResponseCache(disk_dir=str(tmp_path)).lookup('http://portal.example.net/page')
+    assert fresh and (entry.text, entry.etag) == ('body', '"v1"')
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def test_disk_tier_tracks_its_size_instead_of_listing_every_write(tmp_path, monkeypatch):
+    listings = []
+    listdir = os.listdir
+
+    def counting_listdir(path):
+        listings.append(path)
+        return listdir(path)
+
+    monkeypatch.setattr(os, 'listdir', counting_listdir)
+    cache = ResponseCache(disk_dir=str(tmp_path), max_disk_bytes=100 * 1024)
+    for i in range(300):
+        cache.store(f'http://portal.example.net/{i}', response(), 'x' * 1024)
+    # The same URL again replaces its file rather than adding to the total
+    cache.store('http://portal.example.net/299', response(), 'y' * 1024)
+
+    monkeypatch.setattr(os, 'listdir', listdir)
+    assert cache.disk_budget.size == dir_size(str(tmp_path)) <= 100 * 1024
+    assert 0 < cache.disk_budget.trims == len(listings) - 1 < 40
+    # The newest entries survive trimming
+    assert cache._load_from_disk('http://portal.example.net/299')[0].text == 'y' * 1024
+    assert cache._load_from_disk('http://portal.example.net/0')[0] is None
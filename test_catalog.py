@@ -0,0 +1,108 @@
+"""
+Tests for stream identity and the stream catalog
+================================================
+
+The dedup key decides which stream URLs count as the same channel, and the
+SQLite catalog stores one row per key. Each catalog test uses its own
+database file under pytest's tmp_path.
+"""
+
+import hashlib
+import sqlite3
+
+from iptv_crawler import StreamCatalog, StreamRecord, stream_dedup_key
+
+
+def test_xtream_credential_variants_share_a_key():
+    key = stream_dedup_key('http://portal.example.net:8080/live/alice/secret/1234.ts')
+    assert stream_dedup_key('http://PORTAL.example.net:8080/live/bob/hunter2/1234.m3u8') == key
+    assert stream_dedup_key('http://portal.example.net:8080/movie/alice/secret/1234.mkv') != key
+    assert stream_dedup_key('http://portal.example.net:8080/live/alice/secret/1235.ts') != key
+    assert stream_dedup_key('http://portal.example.net:8081/live/alice/secret/1234.ts') != key
+
+
+def test_ordinary_paths_and_queries_are_not_collapsed():
+    assert (stream_dedup_key('http://cdn.example.com/news/hd/1.m3u8')
+            != stream_dedup_key('http://cdn.example.com/sports/sd/1.m3u8'))
+    assert (stream_dedup_key('http://cdn.example.com/live/a/b/5.ts?token=1')
+            != stream_dedup_key('http://cdn.example.com/live/a/b/5.ts?token=2'))
+    assert (stream_dedup_key('http://cdn.example.com/play?channel=5')
+            != stream_dedup_key('http://cdn.example.com/play?channel=6'))
+    assert (stream_dedup_key('http://cdn.example.com/play?b=2&a=1')
+            == stream_dedup_key('http://cdn.example.com:80/play?a=1&b=2'))
+
+
+def test_upsert_refreshes_the_url_of_an_existing_row(tmp_path):
+    catalog = StreamCatalog(str(tmp_path / 'catalog.db'))
+    catalog.upsert([StreamRecord('Channel', 'http://portal.example.net/live/old/pw/7.ts', 'News')])
+    catalog.upsert([StreamRecord('Channel HD', 'http://portal.example.net/live/new/pw/7.ts')])
+    rows, cursor = catalog.query()
+    assert cursor is None
+    assert len(rows) == 1
+    assert rows[0]['url'] == 'http://portal.example.net/live/new/pw/7.ts'
+    assert rows[0]['name'] == 'Channel HD'
+    assert rows[0]['group_title'] == 'News'
+
+
+def test_catalog_pages_with_a_cursor(tmp_path):
+    catalog = StreamCatalog(str(tmp_path / 'catalog.db'), batch_size=7)
+    catalog.upsert(StreamRecord(f'Channel {i}', f'http://cdn.example.com/{i}.m3u8') for i in range(25))
+    urls, cursor = [], 0
+    while cursor is not None:
+        rows, cursor = catalog.query(limit=10, after=cursor)
+        urls.extend(row['url'] for row in rows)
+    assert urls == [f'http://cdn.example.com/{i}.m3u8' for i in range(25)]
+    assert [row['name'] for row in catalog.query(name='channel 1')[0]] == ['Channel 1'] + [f'Channel 1{i}' for i in range(10)]
+
+
+def test_old_catalog_is_rekeyed_on_open(tmp_path):
+    path = str(tmp_path / 'catalog.db')
+    # A catalog from before the schema version, keyed by a digest of the raw URL
+    connection = sqlite3.connect(path)
+    connection.executescript(StreamCatalog.SCHEMA)
+    old_rows = [
+        ('http://portal.example.net/live/old/pw/7.ts', 'Channel', 'News', 100.0, 200.0),
+        ('http://portal.example.net/live/new/pw/7.ts', 'Channel HD', '', 150.0, 300.0),
+        ('http://cdn.example.com/news/hd/1.m3u8', 'Other', '', 50.0, 60.0),
+    ]
+    with connection:
+        connection.executemany(
+            'INSERT INTO streams (url_hash, url, name, group_title, source_host, first_seen, last_seen) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), url, name, group, 'host', first, last)
+             for url, name, group, first, last in old_rows])
+    connection.close()
+
+    catalog = StreamCatalog(path)
+    rows = {row['name']: row for row in catalog.query()[0]}
+    assert sorted(rows) == ['Channel HD', 'Other']
+    merged = rows['Channel HD']
+    assert merged['url'] == 'http://portal.example.net/live/new/pw/7.ts'
+    assert merged['group_title'] == 'News'
+    assert (merged['first_seen'], merged['last_seen']) == (100.0, 300.0)
+
+    # Later writes land on the re-keyed rows, and the indexes came through
+    catalog.upsert([StreamRecord('Channel HD', 'http://portal.example.net/live/third/pw/7.ts')])
+    assert catalog.stats()['streams'] == 2
+    connection = sqlite3.connect(path)
+    assert connection.execute('PRAGMA user_version').fetchone()[0] == StreamCatalog.SCHEMA_VERSION
+    indexes = {name for (name,) in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'streams'")}
+    assert {'idx_streams_url_hash', 'idx_streams_name', 'idx_streams_last_seen'} <= indexes
+    connection.close()
+
+
+def test_stream_count_is_kept_without_counting_rows(tmp_path):
+    path = str(tmp_path / 'catalog.db')
+    catalog = StreamCatalog(path, batch_size=4)
+    assert catalog.stats()['streams'] is None
+    assert not (tmp_path / 'catalog.db').exists()
+
+    catalog.upsert(StreamRecord(f'Channel {i}', f'http://cdn.example.com/{i}.m3u8') for i in range(10))
+    catalog.upsert(StreamRecord(f'Channel {i}', f'http://cdn.example.com/{i}.m3u8') for i in range(5, 15))
+    assert catalog.stats()['streams'] == 15
+    assert catalog.stats()['rows_written'] == 20
+    # A reopened catalog counts its rows once, on first use
+    reopened = StreamCatalog(path)
+    reopened.query(limit=1)
+    assert reopened.stats()['streams'] == 15
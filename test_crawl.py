@@ -0,0 +1,180 @@
+"""
+Tests for crawl scheduling
+==========================
+
+Whole crawls against the benchmark's local stand-in server: how portal
+fetches are spread over threads, what a deadline leaves behind, which
+pages a site crawl follows, what a recrawl reports as changed and when
+player_api.php stands in for the playlist.
+"""
+
+import threading
+import time
+
+import pytest
+
+import iptv_crawler
+from benchmark_crawler import StandServer
+from iptv_crawler import BloomFilter, FingerprintStore, IPTVCrawler, StreamRecord
+
+
+@pytest.fixture
+def slow_stand():
+    with StandServer(latency=0.05) as server:
+        yield server
+
+
+def test_concurrent_crawls_share_one_bounded_fetch_pool(slow_stand):
+    crawler = IPTVCrawler(cache=False, max_concurrency=4)
+    results = {}
+
+    def crawl(i):
+        results[i] = crawler.crawl_iptv_streams(slow_stand.url('/page?portals=8&entries=5'))
+
+    before = set(threading.enumerate())
+    threads = [threading.Thread(target=crawl, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [len(results[i]) for i in range(3)] == [40, 40, 40]
+    # The stand's request threads are daemons; every other thread the crawls left is a fetch pool worker
+    pool = [thread for thread in set(threading.enumerate()) - before if not thread.daemon]
+    assert 0 < len(pool) <= 4
+    assert all(thread.name.startswith('fetch_') for thread in pool)
+
+
+def test_deadline_leaves_the_fetch_pool_usable():
+    crawler = IPTVCrawler(cache=False, max_concurrency=2)
+    with StandServer(latency=0.3) as stand:
+        page = stand.url('/page?portals=10&entries=5')
+        cut = crawler.crawl_iptv_streams(page, deadline=0.8)
+        assert cut.timed_out and cut.unfinished
+        assert len(crawler.crawl_iptv_streams(page)) == 50
+
+
+def test_deadline_during_the_site_crawl_marks_the_result_partial(monkeypatch):
+    crawler = IPTVCrawler(cache=False, page_delay=0)
+    fetch_webpage = crawler.fetch_webpage
+
+    def fetch_slowly(url, *args, **kwargs):
+        # The first list page answers; the others are still loading at the deadline
+        if '/page' in url and 'first=0' not in url:
+            time.sleep(1)
+        return fetch_webpage(url, *args, **kwargs)
+
+    monkeypatch.setattr(crawler, 'fetch_webpage', fetch_slowly)
+    monkeypatch.setattr(iptv_crawler, 'crawler', crawler)
+    with StandServer() as stand:
+        forum = stand.url('/forum?threads=3&portals=1&entries=2')
+        # Every portal found in time has finished, but pages were left unread
+        cut = crawler.crawl_iptv_streams(forum, deadline=0.5, max_depth=1)
+        assert (len(cut), cut.unfinished, cut.timed_out) == (2, [], True)
+
+        streams, source = iptv_crawler.shared_crawl(forum, deadline=0.5, max_depth=1)
+        assert streams.timed_out and source == 'crawl'
+        assert iptv_crawler.crawl_results.get(iptv_crawler.crawl_key(forum, max_depth=1)) is None
+
+
+def test_bloom_filter_has_no_false_negatives():
+    seen = BloomFilter(capacity=10000, error_rate=0.01)
+    urls = [f'http://forum.example.com/thread/{i}' for i in range(10000)]
+    # Near capacity a few new items already look present, and add() says so
+    added = sum(seen.add(url) for url in urls)
+    assert 9900 < added == len(seen)
+    assert all(url in seen for url in urls)
+    assert not seen.add(urls[0])
+    # At capacity the false positive rate is about what was asked for
+    false_positives = sum(f'http://forum.example.com/post/{i}' in seen for i in range(10000))
+    assert false_positives < 300
+
+
+def test_site_crawl_follows_links_on_the_same_site():
+    crawler = IPTVCrawler(cache=False, page_delay=0)
+    with StandServer() as stand:
+        forum = stand.url('/forum?threads=4&portals=2&entries=3')
+        streams = crawler.crawl_iptv_streams(forum, max_depth=1)
+        assert len(streams) == 4 * 2 * 3
+        pages = [path for path in stand.paths if not path.startswith('/get.php')]
+        # The index and its four list pages; not the image, nor the index on another host
+        assert pages[0] == '/forum?threads=4&portals=2&entries=3'
+        assert sorted(pages[1:]) == [f'/page?portals=2&entries=3&first={first}' for first in (0, 2, 4, 6)]
+
+        del stand.paths[:]
+        assert len(crawler.crawl_iptv_streams(forum, max_depth=1, max_pages=3)) == 2 * 2 * 3
+        assert len([path for path in stand.paths if path.startswith('/page')]) == 2
+        # Without max_depth a page with no portals on it has nothing to give
+        assert not crawler.crawl_iptv_streams(forum)
+
+
+def test_site_pages_are_parsed_off_the_event_loop(monkeypatch):
+    crawler = IPTVCrawler(cache=False, page_delay=0)
+    threads = []
+    for name in ('page_portals', 'site_links'):
+        parse = getattr(crawler, name)
+
+        def recording(*args, parse=parse, name=name):
+            threads.append((name, threading.current_thread().name))
+            return parse(*args)
+
+        monkeypatch.setattr(crawler, name, recording)
+    with StandServer() as stand:
+        assert len(crawler.crawl_iptv_streams(stand.url('/forum?threads=3&portals=1&entries=2'), max_depth=1)) == 6
+    # The index is parsed for portals and links, each list page for portals only
+    assert sorted(name for name, _ in threads) == ['page_portals'] * 4 + ['site_links']
+    assert all(thread.startswith('fetch_') for _, thread in threads)
+
+
+def test_recrawl_reports_what_changed_and_reuses_unchanged_parses():
+    crawler = IPTVCrawler(cache=False)
+    with StandServer() as stand:
+        page = stand.url('/page?portals=4&entries=5')
+        first = crawler.crawl_iptv_streams(page, recrawl=True)
+        assert (len(first.added), first.removed) == (20, [])
+
+        second = crawler.crawl_iptv_streams(page, recrawl=True)
+        assert (second.added, second.removed) == ([], [])
+        # The page and all four playlists came back the same, so none was parsed again
+        assert crawler.fingerprints.stats()['unchanged_inputs'] == 5
+
+        # A lapsed account takes its portal's streams with it
+        stand.expired_accounts.add('user2')
+        third = crawler.crawl_iptv_streams(page, recrawl=True)
+        assert third.added == []
+        assert sorted(stream.url for stream in third.removed) \
+            == sorted(stream.url for stream in second if '.user2.' in stream.url)
+        assert len(third.removed) == 5
+
+
+def test_partial_crawl_neither_removes_nor_becomes_the_baseline():
+    store = FingerprintStore()
+    a, b = StreamRecord('A', 'http://s.example.net/1.ts'), StreamRecord('B', 'http://s.example.net/2.ts')
+    store.delta('source', [a, b])
+    assert store.delta('source', [a], partial=True) == ([], [])
+    # The next full crawl is still compared with [a, b]
+    assert store.delta('source', [a]) == ([], [b])
+
+
+def test_filtered_crawl_reads_only_the_matching_xtream_category():
+    with StandServer(xtream_entries=200) as stand:
+        page = stand.url('/page?portals=2&entries=200')
+        from_playlists = IPTVCrawler(cache=False, xtream_api=False).crawl_iptv_streams(page, 'sports', 'group')
+        del stand.paths[:]
+        from_api = IPTVCrawler(cache=False).crawl_iptv_streams(page, 'sports', 'group')
+        assert from_playlists and sorted(stream.name for stream in from_api) \
+            == sorted(stream.name for stream in from_playlists)
+        assert {stream.group_title for stream in from_api} == {'Sports'}
+        assert not [path for path in stand.paths if path.startswith('/get.php')]
+        assert len([path for path in stand.paths if 'action=get_live_streams&category_id=1' in path]) == 2
+
+
+def test_portal_without_player_api_falls_back_to_the_playlist():
+    crawler = IPTVCrawler(cache=False)
+    with StandServer() as stand:
+        streams = crawler.crawl_iptv_streams(stand.url('/page?portals=2&entries=200'), 'sports', 'group')
+        assert streams and {stream.group_title for stream in streams} == {'Sports'}
+        assert len([path for path in stand.paths if path.startswith('/get.php')]) == 2
+        # The failed API is remembered per host, so the next crawl goes straight to the playlists
+        api_requests = sum(path.startswith('/player_api.php') for path in stand.paths)
+        crawler.crawl_iptv_streams(stand.url('/page?portals=2&entries=200'), 'news', 'group')
+        assert sum(path.startswith('/player_api.php') for path in stand.paths) == api_requests
@@ -0,0 +1,92 @@
+"""
+Tests for logging and metrics
+=============================
+
+The Prometheus rendering of counters and histograms, the bound on label
+combinations, the log rate limiter and formatter, and /metrics after a
+crawl of the benchmark's local stand-in server.
+"""
+
+import json
+import logging
+import time
+
+import iptv_crawler
+from benchmark_crawler import StandServer
+from iptv_crawler import LogRateLimiter, Metrics, StructuredFormatter
+
+
+def test_metrics_render_in_the_prometheus_text_format():
+    metrics = Metrics()
+    metrics.declare('requests_total', 'counter', 'Requests', ['host'])
+    metrics.declare('latency_seconds', 'histogram', 'Latency', buckets=(0.1, 1))
+    metrics.inc('requests_total', host='a:80')
+    metrics.inc('requests_total', 2, host='say "hi"')
+    for seconds in (0.05, 0.5, 5):
+        metrics.observe('latency_seconds', seconds)
+    assert metrics.value('requests_total', host='a:80') == 1
+    assert metrics.render().splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{host="a:80"} 1',
+        'requests_total{host="say \\"hi\\""} 2',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 5.550000',
+        'latency_seconds_count 3',
+    ]
+
+
+def test_label_combinations_past_the_limit_share_one_series():
+    metrics = Metrics(max_series=3)
+    metrics.declare('host_requests_total', 'counter', 'Requests', ['host', 'outcome'])
+    for i in range(10):
+        metrics.inc('host_requests_total', host=f'host{i}:80', outcome='ok')
+    assert metrics.value('host_requests_total', host='host0:80', outcome='ok') == 1
+    assert metrics.value('host_requests_total', host='other', outcome='other') == 7
+    assert metrics.render().count('host_requests_total{') == 4
+
+
+def log_record(msg, *args, level=logging.WARNING):
+    return logging.LogRecord('iptv_crawler', level, __file__, 1, msg, args, None)
+
+
+def test_rate_limiter_drops_repeats_and_reports_how_many():
+    limiter = LogRateLimiter(burst=3, interval=0.2)
+    suppressed = iptv_crawler.metrics.value('iptv_log_suppressed_total', level='WARNING')
+    # Records are limited per message template, whatever their arguments
+    passed = [limiter.filter(log_record("Failed to fetch %s", f'http://host{i}/')) for i in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    assert limiter.filter(log_record("Another message"))
+    assert iptv_crawler.metrics.value('iptv_log_suppressed_total', level='WARNING') == suppressed + 7
+
+    time.sleep(0.25)
+    record = log_record("Failed to fetch %s", 'http://host10/')
+    assert limiter.filter(record)
+    assert record.suppressed == 7
+
+
+def test_formatter_writes_extra_fields():
+    record = log_record("Fetched %d streams", 12, level=logging.INFO)
+    record.url = 'http://a.example.net/get.php'
+    record.note = 'two words'
+    text = StructuredFormatter().format(record)
+    assert text.endswith('INFO    Fetched 12 streams url=http://a.example.net/get.php note="two words"')
+    line = json.loads(StructuredFormatter(json_lines=True).format(record))
+    assert (line['level'], line['msg'], line['url'], line['note']) == ('info', 'Fetched 12 streams',
+                                                                       'http://a.example.net/get.php', 'two words')
+
+
+def test_metrics_endpoint_reports_a_crawl():
+    client = iptv_crawler.app.test_client()
+    with StandServer() as stand:
+        host = f'127.0.0.2:{stand.port}'
+        before = iptv_crawler.metrics.value('iptv_host_requests_total', host=host, outcome='ok')
+        assert len(iptv_crawler.crawler.crawl_iptv_streams(stand.url('/page?portals=2&entries=5'))) == 10
+    body = client.get('/metrics').get_data(as_text=True)
+    assert '# TYPE iptv_stage_seconds histogram' in body
+    assert f'iptv_host_requests_total{{host="{host}",outcome="ok"}} {before + 1}' in body
+    assert f'iptv_admission_active{{budget="crawl"}} {iptv_crawler.crawl_gate.active}' in body
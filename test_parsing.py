@@ -0,0 +1,214 @@
+"""
+Tests for page and playlist parsing
+===================================
+
+The optimized parsers and the stream categorizer are checked against the
+original implementations kept in benchmark_crawler.py, on input built to
+contain the awkward cases.
+Streamed playlists come from the benchmark's local stand-in server.
+"""
+
+from concurrent.futures.process import BrokenProcessPool
+
+from benchmark_crawler import (StandServer, legacy_categorize_streams, legacy_extract_iptv_urls,
+                               legacy_extract_streams_from_m3u, make_m3u_playlist, make_portal_page)
+from iptv_crawler import (MAX_PARSE_POOL_FAILURES, STREAM_CATEGORIES, IPTVCrawler, KeywordMatcher, StreamRecord,
+                          stream_categorizer)
+
+# Assets on the IPTV ports, a portal in a comment and an &region= parameter
+# in a script, next to the portals that should be found
+TRICKY_PAGE = '''<html><head><title>Free portals</title>
+<link rel="stylesheet" href="http://cdn.example.com:8080/site.css">
+<style>body { background: url(http://cdn.example.com:80/bg.png) }</style>
+</head><body>
+<!-- expired: http://old.example.net:8080/get.php?username=x&password=y&type=m3u -->
+<img src="http://img.example.com:80/logo.png" style="background: url(http://img.example.com:8080/x.png)">
+<p>Portal 1: http://a.example.net:8080/get.php?username=u1&amp;password=p1&amp;type=m3u_plus</p>
+<p><a href="http://b.example.net/get.php?username=u2&amp;password=p2&amp;type=m3u">Portal 2</a></p>
+<p>Portal 3: http://c.example.net:80/live/u3/p3/</p>
+<p>Portal 4: http://d.example.net/player_api.php?username=u4&amp;password=p4</p>
+<p><a href="http://blog.example.com:8080/post/1">More portals</a></p>
+<script>var s = "http://e.example.net:8080/get.php?username=u5&region=eu&password=p5&type=m3u";</script>
+<script type="text/javascript">
+  // http://f.example.net/get.php?username=u6&password=p6
+  var cfg = {src: 'http://img.example.com/banner.png'};
+</script>
+</body></html>
+'''
+
+
+def test_extract_iptv_urls_matches_legacy_on_tricky_page():
+    crawler = IPTVCrawler(cache=False)
+    urls = crawler.extract_iptv_urls(TRICKY_PAGE)
+    assert urls == legacy_extract_iptv_urls(TRICKY_PAGE)
+    assert crawler.extract_iptv_urls(TRICKY_PAGE.encode()) == urls
+    assert 'http://e.example.net:8080/get.php?username=u5&region=eu&password=p5&type=m3u' in urls
+    assert not [url for url in urls if 'cdn.' in url or 'img.' in url or 'old.' in url or 'blog.' in url]
+
+
+def test_extract_iptv_urls_matches_legacy_on_generated_page():
+    page = make_portal_page(400)
+    urls = IPTVCrawler(cache=False).extract_iptv_urls(page)
+    assert len(urls) == 400
+    assert set(urls) == set(legacy_extract_iptv_urls(page))
+
+
+# Entries without tvg-name or without any #EXTINF, #EXTGRP groups, other
+# directives, blank lines and CRLF line ends
+TRICKY_PLAYLIST = (
+    '#EXTM3U x-tvg-url="http://epg.example.net/guide.xml"\r\n'
+    '#EXTINF:-1 tvg-id="a" tvg-name="Alpha HD" group-title="News",Alpha\r\n'
+    'http://s.example.net/live/u/p/1.ts\r\n'
+    '\r\n'
+    '#EXTINF:-1 tvg-logo="http://logos.example.net/b.png",Bravo Sports\r\n'
+    '#EXTGRP:Sports\r\n'
+    '#EXTVLCOPT:http-user-agent=VLC\r\n'
+    '  http://s.example.net/live/u/p/2.ts  \r\n'
+    'http://s.example.net/live/u/p/3.ts\r\n'
+    '#EXTINF:-1,\r\n'
+    'http://s.example.net/live/u/p/4.ts\r\n'
+    '#EXTINF:-1 tvg-name="" group-title="Movies",Charlie\r\n'
+    'http://s.example.net/movie/u/p/5.mkv\r\n'
+)
+
+
+def test_extract_streams_matches_legacy():
+    crawler = IPTVCrawler(cache=False)
+    playlist = make_m3u_playlist(2000)
+    assert [tuple(stream) for stream in crawler.extract_streams_from_m3u(playlist)] \
+        == legacy_extract_streams_from_m3u(playlist)
+
+    streams = crawler.extract_streams_from_m3u(TRICKY_PLAYLIST)
+    legacy = legacy_extract_streams_from_m3u(TRICKY_PLAYLIST)
+    assert [tuple(stream) for stream in streams[:4]] == legacy[:4]
+    # An empty tvg-name falls back to the title, where the original gave up on it
+    assert (streams[4].name, legacy[4][0]) == ('Charlie', 'Channel 5')
+    assert [stream.group_title for stream in streams] == ['News', 'Sports', '', '', 'Movies']
+    assert [stream.name_lc for stream in streams] == ['alpha hd', 'bravo sports', '', '', 'charlie']
+    assert streams[0].attributes == {'tvg-id': 'a', 'tvg-name': 'Alpha HD', 'group-title': 'News'}
+    assert [stream.to_dict() for stream in streams][2] == {'name': 'Channel 3', 'url': 'http://s.example.net/live/u/p/3.ts'}
+
+
+def test_filtered_extract_streams_keeps_the_matching_entries():
+    crawler = IPTVCrawler(cache=False)
+    playlist = make_m3u_playlist(5000)
+    everything = crawler.extract_streams_from_m3u(playlist)
+    # Rare, clustered and dense keywords take different routes through the playlist
+    for keyword in ('kids', 'channel 1', 'hd'):
+        expected = [(stream.name, stream.url) for stream in everything if stream.matches(keyword)]
+        assert [tuple(stream) for stream in crawler.extract_streams_from_m3u(playlist, keyword.upper())] == expected
+    sports = crawler.extract_streams_from_m3u(TRICKY_PLAYLIST, 'sports', 'group')
+    assert [stream.url for stream in sports] == ['http://s.example.net/live/u/p/2.ts']
+
+
+def pooled_crawler():
+    # Every playlist goes to the pool, in small pieces so one playlist spans several of them
+    return IPTVCrawler(cache=False, parse_workers=1, parse_offload_bytes=0, parse_chunk_bytes=256)
+
+
+def test_pooled_parse_matches_parsing_in_thread():
+    crawler = pooled_crawler()
+    try:
+        for playlist in (TRICKY_PLAYLIST, make_m3u_playlist(500)):
+            expected = IPTVCrawler(cache=False).extract_streams_from_m3u(playlist)
+            streams = crawler.parse_playlist(playlist)
+            assert [(stream.name, stream.url, stream.group_title) for stream in streams] \
+                == [(stream.name, stream.url, stream.group_title) for stream in expected]
+        assert [tuple(stream) for stream in crawler.parse_playlist(make_m3u_playlist(500), 'sports', 'group')] \
+            == [tuple(stream) for stream in expected if stream.matches('sports', 'group')]
+    finally:
+        crawler.close()
+
+
+def test_broken_parse_pool_is_replaced():
+    crawler = pooled_crawler()
+    playlist = make_m3u_playlist(200)
+    try:
+        expected = [tuple(stream) for stream in crawler.parse_playlist(playlist)]
+        broken = crawler._parse_executor
+        for process in list(broken._processes.values()):
+            process.kill()
+            process.join()
+        # The parse that finds the pool dead still answers, from the calling thread
+        assert [tuple(stream) for stream in crawler.parse_playlist(playlist)] == expected
+        assert crawler._parse_executor is None
+        assert crawler.parse_pool_failures == 1
+        assert [tuple(stream) for stream in crawler.parse_playlist(playlist)] == expected
+        assert crawler._parse_executor not in (None, broken)
+        assert crawler.parse_pool_failures == 0
+    finally:
+        crawler.close()
+
+
+class BrokenPool:
+    def submit(self, *args):
+        raise BrokenProcessPool('worker died')
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def test_parse_pool_is_given_up_after_repeated_failures():
+    crawler = pooled_crawler()
+    crawler._parse_pool = lambda: crawler._parse_executor
+    for failures in range(1, MAX_PARSE_POOL_FAILURES + 1):
+        crawler._parse_executor = BrokenPool()
+        assert len(crawler.parse_playlist(TRICKY_PLAYLIST)) == 5
+        assert crawler.parse_pool_failures == failures
+    assert crawler.parse_workers == 0
+
+
+def test_closed_crawler_parses_in_thread():
+    crawler = pooled_crawler()
+    crawler.parse_playlist(TRICKY_PLAYLIST)
+    crawler.close()
+    # A crawl thread still running after close() doesn't start a new pool
+    assert len(crawler.parse_playlist(TRICKY_PLAYLIST)) == 5
+    assert crawler._parse_executor is None
+
+
+def test_streamed_playlist_matches_the_buffered_parse():
+    crawler = IPTVCrawler(cache=False)
+    with StandServer() as stand:
+        url = stand.url('/get.php?username=u1&password=p1&type=m3u_plus&entries=300')
+        buffered = [tuple(stream) for stream in crawler.extract_streams_from_m3u(crawler.fetch_m3u_playlist(url))]
+        assert len(buffered) == 300
+        assert [tuple(stream) for stream in crawler.iter_m3u_streams(url)] == buffered
+        assert [tuple(stream) for stream in crawler.iter_m3u_streams(url, 'sports')] \
+            == [tuple(stream) for stream in crawler.extract_streams_from_m3u(crawler.fetch_m3u_playlist(url), 'sports')]
+
+        # The caps stop the read part way, keeping what came before
+        assert [tuple(stream) for stream in crawler.iter_m3u_streams(url, max_entries=50)] == buffered[:50]
+        capped = [tuple(stream) for stream in crawler.iter_m3u_streams(url, max_bytes=4096)]
+        assert 0 < len(capped) < 300 and capped == buffered[:len(capped)]
+        # A body that isn't a playlist gives nothing
+        assert list(crawler.iter_m3u_streams(stand.url('/video?bytes=100000'))) == []
+
+
+def test_keyword_matcher_prefers_the_earlier_category():
+    matcher = KeywordMatcher(STREAM_CATEGORIES)
+    # "bbc" comes first in the text, but Sports comes first in the table
+    assert matcher.match('bbc sport hd') == 'Sports'
+    assert matcher.match('disney junior') == 'Movies'
+    assert matcher.match('sky sports news') == 'Sports'
+    assert matcher.match('weather') is None
+
+
+def test_categorizer_matches_legacy_on_streams_without_groups():
+    everything = IPTVCrawler(cache=False).extract_streams_from_m3u(make_m3u_playlist(3000))
+    streams = [StreamRecord(stream.name, stream.url) for stream in everything]
+    index = stream_categorizer.index(streams)
+    assert {category: [streams[position] for position in positions] for category, positions in index.items()} \
+        == legacy_categorize_streams(streams)
+
+
+def test_categorizer_goes_by_group_first():
+    streams = [
+        StreamRecord('CNN', 'http://s.example.net/1.ts', 'Sports Extra'),  # The group wins over the name
+        StreamRecord('CNN', 'http://s.example.net/2.ts', 'Local'),  # An unmatched group falls through to the name
+        StreamRecord('Weather', 'http://s.example.net/3.ts', 'Local'),  # then to the group itself
+        StreamRecord('Weather', 'http://s.example.net/movie/4.mkv'),  # A name that says nothing goes by its URL
+        StreamRecord('Weather', 'http://s.example.net/5.ts'),
+    ]
+    assert stream_categorizer.index(streams) == {'Sports': [0], 'News': [1], 'Local': [2], 'Movies': [3],
+                                                 'General': [4]}
@@ -0,0 +1,133 @@
+"""
+Tests for production serving
+============================
+
+The admission budgets on their own and in front of /crawl,
+/validate-streams and /proxy-video, and a worker serving on a real socket until SIGTERM drains it.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+import iptv_crawler
+from benchmark_crawler import StandServer
+from iptv_crawler import AdmissionGate
+
+
+def test_gate_queues_up_to_its_limit_and_turns_the_rest_away():
+    gate = AdmissionGate('test', max_active=1, max_queued=1, queue_timeout=5)
+    assert gate.acquire()
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(gate.acquire()))
+    waiter.start()
+    while not gate.waiting:
+        time.sleep(0.01)
+    # One active and one queued: a third request isn't kept waiting at all
+    started = time.monotonic()
+    assert not gate.acquire()
+    assert time.monotonic() - started < 1
+    gate.release()
+    waiter.join(5)
+    assert admitted == [True]
+    assert not gate.wait_idle(0.05)
+    gate.release()
+    assert gate.wait_idle(0)
+    assert (gate.admitted, gate.rejected) == (2, 1)
+
+
+def test_queued_request_gives_up_after_the_timeout():
+    gate = AdmissionGate('test', max_active=1, max_queued=1, queue_timeout=0.1)
+    assert gate.acquire()
+    assert not gate.acquire()
+    assert gate.stats()['waiting'] == 0
+
+
+def test_closing_the_gate_wakes_waiters_and_admits_nothing():
+    gate = AdmissionGate('test', max_active=1, max_queued=1, queue_timeout=30)
+    assert gate.acquire()
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(gate.acquire()))
+    waiter.start()
+    while not gate.waiting:
+        time.sleep(0.01)
+    gate.close()
+    waiter.join(5)
+    assert admitted == [False]
+    gate.release()
+    assert not gate.acquire()
+
+
+def test_full_and_closed_budgets_answer_429_and_503(monkeypatch):
+    client = iptv_crawler.app.test_client()
+    gate = AdmissionGate('crawl', max_active=0, retry_after=7)
+    monkeypatch.setattr(iptv_crawler, 'crawl_gate', gate)
+    body = {'url': 'http://full.example.com/portals', 'refresh': True}
+    full = client.post('/crawl', json=body)
+    assert (full.status_code, full.headers['Retry-After']) == (429, '7')
+    gate.close()
+    draining = client.post('/crawl', json=body)
+    assert (draining.status_code, draining.get_json()['error']) == (503, 'Server is shutting down')
+
+
+def test_stream_checks_have_their_own_budget(monkeypatch):
+    client = iptv_crawler.app.test_client()
+    gate = AdmissionGate('validate', max_active=0, retry_after=3)
+    monkeypatch.setattr(iptv_crawler, 'validate_gate', gate)
+    for path, body in (('/validate-stream', {'url': 'http://s.example.net/1.ts'}),
+                       ('/validate-streams', {'urls': ['http://s.example.net/1.ts']})):
+        response = client.post(path, json=body)
+        assert (response.status_code, response.headers['Retry-After']) == (429, '3')
+    # A malformed request is still answered without a slot
+    assert client.post('/validate-streams', json={'urls': []}).status_code == 400
+    assert gate.rejected == 2
+
+
+def test_proxied_streams_give_back_their_slot(monkeypatch):
+    gate = AdmissionGate('proxy', max_active=1)
+    monkeypatch.setattr(iptv_crawler, 'proxy_gate', gate)
+    client = iptv_crawler.app.test_client()
+    with StandServer() as stand:
+        video = {'url': stand.url('/video?bytes=100000')}
+        # With one slot, each of these is only admitted if the one before gave it back
+        for headers in ({}, {'Range': 'bytes=0-9'}, {'Range': 'bytes=200000-'}, {}):
+            response = client.get('/proxy-video', query_string=video, headers=headers)
+            assert response.status_code in (200, 206, 416)
+            response.get_data()
+            response.close()
+        assert gate.stats()['active'] == 0 and gate.admitted == 4
+
+
+WORKER = '''
+import socket
+import iptv_crawler
+sock = socket.create_server(('127.0.0.1', 0))
+print(sock.getsockname()[1], flush=True)
+iptv_crawler.serve_worker(sock, drain_timeout=10)
+'''
+
+
+def test_worker_serves_until_sigterm_drains_it(tmp_path):
+    env = {**os.environ, 'IPTV_CATALOG_PATH': str(tmp_path / 'catalog.db'), 'IPTV_LOG_LEVEL': 'ERROR'}
+    worker = subprocess.Popen([sys.executable, '-c', WORKER], stdout=subprocess.PIPE, text=True, env=env)
+    try:
+        base = f'http://127.0.0.1:{worker.stdout.readline().strip()}'
+        with StandServer() as stand:
+            video = requests.get(f'{base}/proxy-video', params={'url': stand.url('/video?bytes=1000000')}, timeout=10)
+            assert len(video.content) == 1000000
+            crawl = requests.post(f'{base}/crawl', json={'url': stand.url('/page?portals=2&entries=5')}, timeout=30)
+            assert crawl.json()['total_streams'] == 10
+        admission = requests.get(f'{base}/health', timeout=5).json()['admission']
+        assert (admission['proxy']['active'], admission['proxy']['admitted']) == (0, 1)
+        assert (admission['crawl']['active'], admission['crawl']['admitted']) == (0, 1)
+
+        worker.send_signal(signal.SIGTERM)
+        assert worker.wait(15) == 0
+    finally:
+        worker.kill()
+        worker.wait()
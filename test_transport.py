@@ -0,0 +1,185 @@
+"""
+Tests for the crawler's HTTP layer
+==================================
+
+Host state, circuit breaking and stream probing, run against the
+benchmark's local stand-in server, so no network access is needed.
+"""
+
+import shutil
+import socket
+import subprocess
+import threading
+
+import pytest
+import requests
+
+from benchmark_crawler import StandServer
+from iptv_crawler import HostStateTable, HTTPTransport, IPTVCrawler, StreamProber
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_circuit_opens_after_consecutive_failures():
+    hosts = HostStateTable(failure_threshold=3, cooldown=60)
+    for _ in range(2):
+        hosts.record_failure('dead:80')
+    assert hosts.allow('dead:80')
+    hosts.record_failure('dead:80')
+    assert not hosts.allow('dead:80')
+    assert hosts.stats()['circuits_opened'] == 1
+    assert hosts.allow('other:80')
+
+
+def test_circuit_lets_one_trial_through_after_cooldown():
+    hosts = HostStateTable(failure_threshold=1, cooldown=0)
+    hosts.record_failure('dead:80')
+    assert hosts.allow('dead:80')  # The trial request
+    hosts.record_success('dead:80', 'strategy', 0)
+    assert hosts.allow('dead:80')
+    assert hosts.hosts.get('dead:80').failures == 0
+
+
+def test_unreachable_host_opens_the_circuit():
+    crawler = IPTVCrawler(cache=False, host_state=HostStateTable(failure_threshold=3))
+    url = f"http://127.0.0.1:{unused_port()}/get.php?username=u&password=p&type=m3u"
+    for _ in range(3):
+        assert crawler.fetch_m3u_playlist(url) is None
+    assert crawler.hosts.stats()['circuits_opened'] == 1
+    assert crawler.fetch_m3u_playlist(url) is None
+    assert crawler.hosts.stats()['skipped_requests'] == 1
+
+
+def test_refused_accounts_do_not_open_the_circuit():
+    dead = ['dead0', 'dead1', 'dead2', 'dead3']
+    with StandServer(expired_accounts=dead) as stand:
+        crawler = IPTVCrawler(cache=False, host_state=HostStateTable(failure_threshold=3))
+        for user in dead:
+            assert crawler.fetch_m3u_playlist(stand.url(f"/get.php?username={user}&password=p&type=m3u_plus&entries=5")) is None
+        assert crawler.hosts.stats()['circuits_opened'] == 0
+
+        # A working account on the same host:port is still crawled
+        streams = crawler.fetch_portal_streams(stand.url("/get.php?username=live&password=p&type=m3u_plus&entries=5"))
+        assert len(streams) == 5
+        assert crawler.hosts.stats()['skipped_requests'] == 0
+
+
+def test_refusal_ends_a_run_of_failures():
+    hosts = HostStateTable(failure_threshold=3)
+    hosts.record_failure('flaky:80')
+    hosts.record_failure('flaky:80')
+    hosts.record_alive('flaky:80')
+    hosts.record_failure('flaky:80')
+    assert hosts.allow('flaky:80')
+
+
+@pytest.fixture
+def self_signed(tmp_path):
+    if shutil.which('openssl') is None:
+        pytest.skip('openssl is needed to make a test certificate')
+    certfile, keyfile = str(tmp_path / 'cert.pem'), str(tmp_path / 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=localhost', '-keyout', keyfile, '-out', certfile],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+@pytest.mark.filterwarnings('ignore::urllib3.exceptions.InsecureRequestWarning')
+def test_prober_accepts_untrusted_certificates(self_signed):
+    certfile, keyfile = self_signed
+    with StandServer(certfile=certfile, keyfile=keyfile) as stand:
+        url = stand.url('/video?bytes=65536')
+        with pytest.raises(requests.exceptions.SSLError):
+            requests.get(url, timeout=5)
+        verdict = StreamProber(HTTPTransport()).validate(url)
+        assert verdict['status'] == 'working', verdict
+        assert verdict['http_status'] == 206  # The probe is a ranged GET
+
+
+def test_prober_reports_a_tls_failure_as_broken():
+    with StandServer() as stand:
+        # https:// to the plain-HTTP server fails the handshake itself
+        verdict = StreamProber(HTTPTransport()).validate(stand.url('/video').replace('http://', 'https://'))
+        assert verdict['status'] == 'broken'
+        assert verdict['error'] == 'SSLError'
+
+
+def test_connection_falls_back_to_the_next_cached_address(monkeypatch):
+    resolve = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host == 'multi.example.test':
+            # Nothing listens on the IPv6 loopback, so the first address is refused
+            return [(socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('::1', port, 0, 0)),
+                    (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', port))]
+        return resolve(host, port, *args, **kwargs)
+
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+    transport = HTTPTransport()
+    with StandServer() as stand:
+        response = transport.session.get(f'http://multi.example.test:{stand.port}/video?bytes=10', timeout=5)
+    assert response.status_code == 200
+    # The refused address goes to the back, so the next connection starts with the one that answered
+    assert transport.dns_cache.resolve('multi.example.test', stand.port) == ('127.0.0.1', '::1')
+
+
+def test_transport_reuses_pooled_connections():
+    transport = HTTPTransport()
+    with StandServer() as stand:
+        for _ in range(5):
+            assert len(transport.get(stand.url('/video?bytes=100', host='localhost'), timeout=5).content) == 100
+    stats = transport.stats()
+    assert (stats['requests'], stats['pool_hits'], stats['pool_misses']) == (5, 4, 1)
+    # Only the one new connection needed an address
+    assert (stats['dns_misses'], stats['dns_hits']) == (1, 0)
+
+
+def test_prober_follows_hls_playlists_to_a_segment():
+    prober = StreamProber(HTTPTransport())
+    with StandServer() as stand:
+        master, media, missing, nothing = urls = [stand.url(path) for path in (
+            '/hls/master.m3u8', '/hls/media.m3u8', '/hls/media.m3u8?missing=1', '/nothing.ts')]
+        verdicts = prober.validate_many(urls)
+        probes = prober.probes
+        # Verdicts are cached, so checking the list again costs no requests
+        assert prober.validate_many(urls) == verdicts
+        assert prober.probes == probes
+    assert [verdicts[url]['status'] for url in urls] == ['working', 'working', 'broken', 'broken']
+    assert verdicts[master]['hls'] is True
+    assert verdicts[missing]['error'] == 'HLS segment HTTP 404'
+    assert verdicts[nothing]['error'] == 'HTTP 404'
+
+
+def test_concurrent_batches_probe_on_one_bounded_pool():
+    prober = StreamProber(HTTPTransport(), max_concurrency=4)
+    results = {}
+    with StandServer(latency=0.05) as stand:
+        def check(i):
+            results[i] = prober.validate_many(stand.url(f'/video?bytes=10&batch={i}&n={n}') for n in range(8))
+
+        before = set(threading.enumerate())
+        batches = [threading.Thread(target=check, args=(i,)) for i in range(3)]
+        for batch in batches:
+            batch.start()
+        for batch in batches:
+            batch.join()
+    assert [sorted(verdict['status'] for verdict in results[i].values()) for i in range(3)] == [['working'] * 8] * 3
+    pool = [thread for thread in set(threading.enumerate()) - before if thread.name.startswith('probe_')]
+    assert 0 < len(pool) <= 4
+    prober.close()
+
+
+def test_slow_first_strategy_is_hedged():
+    with StandServer(latency=0.2) as stand:
+        page = stand.url('/page?portals=3&entries=1')
+        hedging = IPTVCrawler(cache=False, hedge_after=0.05)
+        assert 'get.php' in hedging.fetch_webpage(page)
+        assert (hedging.hedged_requests, stand.requests) == (1, 2)
+        # When the first strategy answers in time, only one request goes out
+        patient = IPTVCrawler(cache=False, hedge_after=5)
+        assert 'get.php' in patient.fetch_webpage(page)
+        assert (patient.hedged_requests, stand.requests) == (0, 3)
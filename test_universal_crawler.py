@@ -0,0 +1,57 @@
+"""
+Tests for the command line crawler
+==================================
+
+Sources run against a stand-in crawl function, so these check how main()
+queues, interrupts and writes rather than the crawl itself.
+"""
+
+import threading
+
+import universal_iptv_crawler
+from iptv_crawler import StreamRecord
+from universal_iptv_crawler import M3UWriter, SourceProgress
+
+
+def test_writer_skips_duplicates_and_drops_writes_after_close(tmp_path):
+    path = tmp_path / 'out.m3u'
+    writer = M3UWriter(str(path))
+    writer.write([StreamRecord('One', 'http://portal.example.net/live/a/pw/1.ts'),
+                  StreamRecord('One again', 'http://portal.example.net/live/b/pw/1.ts')])
+    writer.close()
+    writer.write([StreamRecord('Late', 'http://portal.example.net/live/a/pw/2.ts')])
+    assert (writer.written, writer.duplicates) == (1, 1)
+    assert path.read_text(encoding='utf-8') == '#EXTM3U\n#EXTINF:-1,One\nhttp://portal.example.net/live/a/pw/1.ts\n'
+
+
+def test_interrupt_cancels_queued_sources(tmp_path, monkeypatch):
+    started = []
+    crawling = threading.Event()
+    release = threading.Event()
+
+    def crawl_source(crawler, writer, url, args):
+        started.append(url)
+        crawling.set()
+        release.wait(5)
+        # Still running after the interrupt: what it finds has nowhere to go
+        progress = SourceProgress(writer)
+        progress.portal_done(url, [StreamRecord('Late', 'http://portal.example.net/live/a/pw/1.ts')])
+        return progress
+
+    def interrupted(futures):
+        crawling.wait(5)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(universal_iptv_crawler, 'crawl_source', crawl_source)
+    monkeypatch.setattr(universal_iptv_crawler, 'as_completed', interrupted)
+    output = tmp_path / 'out.m3u'
+    sources = [f'http://site{i}.example.com/' for i in range(5)]
+    argv = ['--output', str(output), '--concurrency', '1'] + [arg for url in sources for arg in ('--url', url)]
+    assert universal_iptv_crawler.main(argv) == 1
+
+    release.set()
+    for thread in threading.enumerate():
+        if thread.name.startswith('ThreadPoolExecutor') and thread is not threading.current_thread():
+            thread.join(5)
+    assert started == sources[:1]
+    assert output.read_text(encoding='utf-8') == '#EXTM3U\n'
@@ -0,0 +1,184 @@
+"""
+Universal IPTV Crawler - command line
+=====================================
+
+Batch front end for IPTVCrawler: crawls one URL or thousands of them
+concurrently and writes every stream it finds straight to an M3U file.
+
+Streams are appended to the output as each portal answers, and duplicates
+are dropped on the way in, so memory use doesn't grow with the size of the
+output.
+
+How to run:
+    python universal_iptv_crawler.py --url "https://example.com"
+    python universal_iptv_crawler.py --input sources.txt --output all.m3u --filter sports
+    cat sources.txt | python universal_iptv_crawler.py --input - --output all.m3u
+"""
+
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from iptv_crawler import IPTVCrawler, configure_logging, stream_dedup_key
+
+
+class M3UWriter:
+    """
+    Appends streams to an M3U file as they arrive, skipping URLs already written.
+
+    Seen channels are kept as 8-byte stream_dedup_key digests rather than URL
+    strings, so credential variants of one Xtream channel are written once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write('#EXTM3U\n')
+        self.written = 0
+        self.duplicates = 0
+        self.closed = False
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def write(self, streams):
+        lines = []
+        with self._lock:
+            if self.closed:
+                return  # A source still finishing after an interrupt
+            for stream in streams:
+                key = stream_dedup_key(stream.url)
+                if key in self._seen:
+                    self.duplicates += 1
+                    continue
+                self._seen.add(key)
+                extinf = getattr(stream, 'extinf', None) or f'#EXTINF:-1,{stream.name}'
+                lines.append(f'{extinf}\n{stream.url}\n')
+            if lines:
+                self.file.write(''.join(lines))
+                self.written += len(lines)
+
+    def close(self):
+        """Close the file; streams written after this are dropped"""
+        with self._lock:
+            self.closed = True
+            self.file.close()
+
+
+class SourceProgress:
+    """Progress hooks for one source URL: portal results go straight to the writer"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.portals = 0
+        self.failed_portals = 0
+
+    def portals_found(self, count):
+        self.portals = count
+
+    def portal_done(self, iptv_url, streams, error=None):
+        if error:
+            self.failed_portals += 1
+        self.writer.write(streams)
+
+
+def iter_input_lines(path):
+    if path == '-':
+        yield from sys.stdin
+    else:
+        with open(path, encoding='utf-8') as handle:
+            yield from handle
+
+
+def read_sources(args):
+    """Source URLs from --url and --input (a file, or - for stdin), blank lines and # comments skipped"""
+    urls = list(args.url or [])
+    if args.input:
+        for line in iter_input_lines(args.input):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                urls.append(line)
+    # Keep the first occurrence of each source
+    return list(dict.fromkeys(urls))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Crawl IPTV streams from one or many URLs into an M3U file')
+    parser.add_argument('--url', action='append', help='URL to crawl (may be given more than once)')
+    parser.add_argument('--input', help='File with one source URL per line, or - to read them from stdin')
+    parser.add_argument('--output', default='extracted_streams.m3u', help='Output M3U file (default: extracted_streams.m3u)')
+    parser.add_argument('--filter', help='Only keep streams matching this keyword (e.g. "sports")')
+    parser.add_argument('--filter-field', choices=['name', 'group'], help='Match the filter on the name or group only')
+    parser.add_argument('--concurrency', type=int, default=8, help='Source URLs crawled at once (default: 8)')
+    parser.add_argument('--portal-concurrency', type=int, default=200,
+                        help='Portal playlists fetched at once, shared by all sources (default: 200)')
+    parser.add_argument('--max-depth', type=int, default=0, help='Follow links this deep into each site (default: 0)')
+    parser.add_argument('--max-pages', type=int, default=50, help='Page limit per site crawl (default: 50)')
+    parser.add_argument('--parse-workers', type=int, default=0,
+                        help='Processes for parsing large pages and playlists (default: 0 = parse on the crawl threads)')
+    parser.add_argument('--deadline', type=float, help='Time budget per source URL in seconds')
+    parser.add_argument('--verbose', action='store_true', help="Show the crawler's own log output (on stderr)")
+    args = parser.parse_args(argv)
+    if not args.url and not args.input:
+        parser.error('give at least one --url or an --input file')
+    return args
+
+
+def crawl_source(crawler, writer, url, args):
+    progress = SourceProgress(writer)
+    crawler.crawl_iptv_streams(url, args.filter, args.filter_field, progress=progress, deadline=args.deadline,
+                               max_depth=args.max_depth, max_pages=args.max_pages)
+    return progress
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sources = read_sources(args)
+
+    print("🚀 Universal IPTV Crawler")
+    print(f"🌐 Sources: {len(sources)}")
+    print(f"📁 Output: {args.output}")
+    if args.filter:
+        print(f"🔧 Filter: {args.filter}")
+
+    # The crawler logs every request; keep the terminal to a progress line unless asked
+    configure_logging('DEBUG' if args.verbose else 'ERROR')
+    crawler = IPTVCrawler(max_concurrency=args.portal_concurrency, parse_workers=args.parse_workers)
+    writer = M3UWriter(args.output)
+    failed_sources = 0
+    portals = 0
+    start = time.perf_counter()
+
+    executor = ThreadPoolExecutor(max_workers=max(1, args.concurrency))
+    try:
+        futures = {executor.submit(crawl_source, crawler, writer, url, args): url for url in sources}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                portals += future.result().portals
+            except Exception as e:
+                failed_sources += 1
+                print(f"❌ {futures[future]}: {str(e)}", file=sys.stderr)
+            print(f"\r📡 {done}/{len(sources)} sources, {writer.written} streams", end='', file=sys.stderr)
+        print(file=sys.stderr)
+    except KeyboardInterrupt:
+        print("\n⏹️ Interrupted, keeping the streams written so far", file=sys.stderr)
+    finally:
+        # Queued sources never start; ones already crawling can't be stopped, and the
+        # writer and crawler drop or finish in-thread whatever they still send
+        executor.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+        crawler.close()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    megabytes = crawler.bytes_fetched / (1024 * 1024)
+    print("=" * 50)
+    print(f"✅ Wrote {writer.written} unique streams to {args.output} ({writer.duplicates} duplicates skipped)")
+    print(f"⏱️ {elapsed:.1f}s for {len(sources)} sources and {portals} portals ({failed_sources} sources failed)")
+    print(f"📊 {len(sources) / elapsed:.2f} URLs/s | {writer.written / elapsed:.1f} streams/s | "
+          f"{megabytes:.1f} MB fetched ({megabytes / elapsed:.2f} MB/s)")
+    return 0 if writer.written else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())